@@ -0,0 +1,10 @@
+"""
+Benchmarks for the hot paths of the magic sessions and records, run against
+mongomock or a local mongod.
+
+    python -m records.fbw_dlkit_adapters.benchmarks.run --help
+
+See run.py for the operations that get measured, and fixtures.py for the
+synthetic data. import_budget.py checks the import time of the modules, and
+simulate_scaffold.py simulates students to size deployments.
+"""
@@ -0,0 +1,236 @@
+"""
+Synthetic assessment data for the benchmarks.
+
+Builds, through the dlkit runtime:
+- a bank of randomized MC items, spread over a chain of learning objectives,
+  where the wrong answer of an item for objective n confuses objective n + 1,
+  so every wrong answer scaffolds down one more level
+- an assessment with one part holding a single scaffold-down part
+- a number of prior takens per agent, each with its first question answered,
+  so there are seen items to exclude
+- the taken under test, answered wrong down to maxLevels, so the section
+  holds a full scaffold tree
+
+build_assessment() builds the bank and the assessment only, for callers that
+drive their own takens.
+
+The record and genus types below have to match the records registry of the
+runtime the benchmarks run in.
+"""
+from collections import namedtuple
+from random import Random
+
+from dlkit.abstract_osid.osid.errors import IllegalState
+from dlkit.primordium.id.primitives import Id
+from dlkit.primordium.type.primitives import Type
+
+from ..magic_parts.magic_ids import MAGIC_PART_AUTHORITY
+
+SIMPLE_SEQUENCE_RECORD_TYPE = Type('osid-object%3Asimple-child-sequencing%40ODL.MIT.EDU')
+PART_RECORD_TYPE = Type('assessment-part-record-type%3Ascaffold-down%40ODL.MIT.EDU')
+PART_GENUS_TYPE = Type('assessment-part-genus-type%3Afbw-specify-lo%40ODL.MIT.EDU')
+MC_ITEM_RECORD_TYPE = Type('item-record-type%3Amulti-choice%40ODL.MIT.EDU')
+ITEM_RECORD_TYPE = Type('item-record-type%3Amulti-choice-randomized%40ODL.MIT.EDU')
+QUESTION_RECORD_TYPE = Type('question-record-type%3Amulti-choice-randomized%40ODL.MIT.EDU')
+ANSWER_RECORD_TYPE = Type('answer-record-type%3Amulti-choice-with-files-and-feedback%40ODL.MIT.EDU')
+RIGHT_ANSWER_GENUS_TYPE = Type('answer-type%3Aright-answer%40ODL.MIT.EDU')
+WRONG_ANSWER_GENUS_TYPE = Type('answer-type%3Awrong-answer%40ODL.MIT.EDU')
+
+BenchmarkParams = namedtuple('BenchmarkParams', [
+    'bank_size',
+    'num_objectives',
+    'choices_per_question',
+    'prior_takens',
+    'max_levels',
+    'max_waypoint_items',
+    'waypoint_quota',
+    'seed'
+])
+
+DEFAULT_PARAMS = BenchmarkParams(bank_size=200,
+                                 num_objectives=10,
+                                 choices_per_question=4,
+                                 prior_takens=5,
+                                 max_levels=3,
+                                 max_waypoint_items=2,
+                                 waypoint_quota=1,
+                                 seed=0)
+
+Assessment = namedtuple('Assessment', [
+    'bank_id',
+    'offered_id',
+    'item_ids',
+    'choice_ids',
+    'right_choice_ids',
+    'objective_ids'
+])
+
+Fixture = namedtuple('Fixture', [
+    'bank',
+    'item_ids',
+    'choice_ids',
+    'objective_ids',
+    'section',
+    'root_part_id'
+])
+
+
+def get_proxy(username):
+    from dlkit.runtime import PROXY_SESSION
+    from dlkit.runtime.proxy_example import SimpleRequest
+    condition = PROXY_SESSION.get_proxy_condition()
+    condition.set_http_request(SimpleRequest(username=username))
+    return PROXY_SESSION.get_proxy(condition)
+
+
+def get_assessment_manager(username):
+    from dlkit.runtime import RUNTIME
+    return RUNTIME.get_service_manager('ASSESSMENT', proxy=get_proxy(username))
+
+
+def _get_objective_id(index):
+    return Id(namespace='learning.Objective',
+              identifier='benchmark-objective-{0}'.format(index),
+              authority='benchmarks')
+
+
+def _create_item(bank, objective_id, confused_objective_id, num_choices, random):
+    form = bank.get_item_form_for_create([MC_ITEM_RECORD_TYPE, ITEM_RECORD_TYPE])
+    form.display_name = 'benchmark item'
+    form.set_learning_objectives([objective_id])
+    item = bank.create_item(form)
+
+    form = bank.get_question_form_for_create(item.ident, [QUESTION_RECORD_TYPE])
+    for index in range(num_choices):
+        form.add_choice('choice {0}'.format(index), name='choice {0}'.format(index))
+    question = bank.create_question(form)
+    # in the stored order, the question itself comes back shuffled
+    choice_ids = [choice['id'] for choice in question.get_unrandomized_choices()]
+    right_choice_id = random.choice(choice_ids)
+
+    form = bank.get_answer_form_for_create(item.ident, [ANSWER_RECORD_TYPE])
+    form.set_genus_type(RIGHT_ANSWER_GENUS_TYPE)
+    form.add_choice_id(right_choice_id)
+    bank.create_answer(form)
+    for choice_id in choice_ids:
+        if choice_id == right_choice_id:
+            continue
+        form = bank.get_answer_form_for_create(item.ident, [ANSWER_RECORD_TYPE])
+        form.set_genus_type(WRONG_ANSWER_GENUS_TYPE)
+        form.add_choice_id(choice_id)
+        form.set_confused_learning_objective_ids([str(confused_objective_id)])
+        bank.create_answer(form)
+    return item.ident, choice_ids, right_choice_id
+
+
+def get_magic_part_maps(section_map):
+    return [part_map for part_map in section_map['assessmentParts']
+            if Id(part_map['assessmentPartId']).authority == MAGIC_PART_AUTHORITY]
+
+
+def create_taken(bank, offered_id):
+    form = bank.get_assessment_taken_form_for_create(offered_id, [])
+    taken = bank.create_assessment_taken(form)
+    return bank.get_first_assessment_section(taken.ident)
+
+
+def _submit(bank, section, question, choice_id):
+    form = bank.get_response_form(section.ident, question.ident)
+    form.add_choice_id(choice_id)
+    bank.submit_response(section.ident, question.ident, form)
+
+
+def answer_question(bank, section, question, assessment, correct, random):
+    """submits the right choice, or a random wrong one"""
+    # the question's own id is local to the section, its map keeps the item's
+    original_identifier = Id(question._my_map['itemId']).identifier
+    right_choice_id = assessment.right_choice_ids.get(original_identifier)
+    if correct:
+        choice_ids = [right_choice_id] if right_choice_id is not None else []
+    else:
+        choice_ids = [choice_id for choice_id in assessment.choice_ids.get(original_identifier, [])
+                      if choice_id != right_choice_id]
+    if choice_ids:
+        _submit(bank, section, question, random.choice(choice_ids))
+
+
+def build_assessment(params=DEFAULT_PARAMS, random=None):
+    """creates the bank of items and the offered scaffold-down assessment"""
+    if random is None:
+        random = Random(params.seed)
+    manager = get_assessment_manager('benchmark-author@mit.edu')
+    form = manager.get_bank_form_for_create([])
+    form.display_name = 'benchmark bank'
+    bank = manager.create_bank(form)
+
+    objective_ids = [_get_objective_id(index) for index in range(params.num_objectives)]
+    item_ids = []
+    choice_ids = {}
+    right_choice_ids = {}
+    for index in range(params.bank_size):
+        objective_index = index % params.num_objectives
+        item_id, item_choice_ids, right_choice_id = _create_item(
+            bank,
+            objective_ids[objective_index],
+            objective_ids[(objective_index + 1) % params.num_objectives],
+            params.choices_per_question,
+            random)
+        item_ids.append(item_id)
+        choice_ids[item_id.identifier] = item_choice_ids
+        right_choice_ids[item_id.identifier] = right_choice_id
+
+    form = bank.get_assessment_form_for_create([SIMPLE_SEQUENCE_RECORD_TYPE])
+    form.display_name = 'benchmark assessment'
+    assessment = bank.create_assessment(form)
+    # sections start at a plain part, the scaffold-down part goes under it
+    form = bank.get_assessment_part_form_for_create_for_assessment(assessment.ident,
+                                                                  [SIMPLE_SEQUENCE_RECORD_TYPE])
+    form.display_name = 'benchmark section'
+    parent_part = bank.create_assessment_part_for_assessment(form)
+    form = bank.get_assessment_part_form_for_create_for_assessment_part(parent_part.ident,
+                                                                       [PART_RECORD_TYPE, SIMPLE_SEQUENCE_RECORD_TYPE])
+    form.set_genus_type(PART_GENUS_TYPE)
+    form.set_learning_objective_ids([objective_ids[0]])
+    form.set_item_bank_id(bank.ident)
+    form.set_max_levels(params.max_levels)
+    form.set_max_waypoint_items(params.max_waypoint_items)
+    form.set_waypoint_quota(params.waypoint_quota)
+    form.set_allow_repeat_items(True)
+    bank.create_assessment_part_for_assessment_part(form)
+    form = bank.get_assessment_offered_form_for_create(assessment.ident, [])
+    offered = bank.create_assessment_offered(form)
+
+    return Assessment(bank_id=bank.ident,
+                      offered_id=offered.ident,
+                      item_ids=item_ids,
+                      choice_ids=choice_ids,
+                      right_choice_ids=right_choice_ids,
+                      objective_ids=objective_ids)
+
+
+def build_fixture(params=DEFAULT_PARAMS, username='benchmark-student@mit.edu'):
+    random = Random(params.seed)
+    assessment = build_assessment(params, random)
+    student_bank = get_assessment_manager(username).get_bank(assessment.bank_id)
+
+    for _ in range(params.prior_takens):
+        section = create_taken(student_bank, assessment.offered_id)
+        answer_question(student_bank, section, student_bank.get_first_unanswered_question(section.ident),
+                        assessment, False, random)
+
+    section = create_taken(student_bank, assessment.offered_id)
+    for _ in range(params.max_levels + 1):
+        try:
+            question = student_bank.get_first_unanswered_question(section.ident)
+        except IllegalState:
+            # nothing left to answer
+            break
+        answer_question(student_bank, section, question, assessment, False, random)
+    section = student_bank.get_assessment_section(section.ident)
+
+    return Fixture(bank=student_bank,
+                   item_ids=assessment.item_ids,
+                   choice_ids=assessment.choice_ids,
+                   objective_ids=assessment.objective_ids,
+                   section=section,
+                   root_part_id=Id(get_magic_part_maps(section._my_map)[0]['assessmentPartId']))
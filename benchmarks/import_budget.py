@@ -0,0 +1,175 @@
+"""
+Checks which modules the adapter modules load at import, and their import time
+against a budget relative to a baseline measured on the same machine.
+
+Each module gets imported in a fresh interpreter, a few times, and the median
+time counts. Some modules must not pull in others at import: the registry is
+read by processes that never build a record, so it must not load dlkit's
+implementation, bson or pymongo. The record modules must leave their opt-in
+helpers (seen items index, objective item index, prefetch, seeded choice
+orders) unloaded until a record or session uses them.
+
+The record modules subclass dlkit.json_ sessions and objects, and dlkit's
+basic records, so those can't be deferred. They get imported first, in the
+same interpreter, and only the time of the module itself counts.
+
+The budgets are fractions of the median import time of REFERENCE_MODULE, in
+fresh interpreters of the same run, so they hold on slower or faster hardware.
+They are about 1.5 times the largest fraction measured over a few runs.
+
+Run it from the directory holding the records package, with the interpreter
+and dlkit the adapters are deployed with, before merging changes to imports:
+
+    python -m records.fbw_dlkit_adapters.benchmarks.import_budget
+    python -m records.fbw_dlkit_adapters.benchmarks.import_budget --runs 9 --budget registry=0.05
+
+Exits with 1 if a module is over its budget or loads a module it mustn't.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+PACKAGE = 'records.fbw_dlkit_adapters'
+# dlkit's records package, that this one lives in
+RECORDS_PACKAGE = PACKAGE.rpartition('.')[0]
+
+# the unit of the budgets
+REFERENCE_MODULE = 'dlkit.json_.assessment.objects'
+
+_NEVER_AT_IMPORT = [PACKAGE + '.benchmarks', PACKAGE + '.tests', PACKAGE + '.magic_id_compaction',
+                    'mongomock', 'multiprocessing']
+
+# module (relative to PACKAGE): the modules it builds on, imported before it
+# is timed; its budget, as a fraction of the reference import time; and the
+# modules it must not load
+BUDGETS = {
+    'registry': ([], 0.02, ['dlkit.json_', 'bson', 'pymongo'] + _NEVER_AT_IMPORT),
+    'instrumentation': ([], 0.04, ['dlkit', 'bson', 'pymongo'] + _NEVER_AT_IMPORT),
+    'utilities': ([], 0.04, ['dlkit', 'bson', 'pymongo'] + _NEVER_AT_IMPORT),
+    'magic_parts.magic_ids': ([], 0.2, ['dlkit.json_', 'bson', 'pymongo'] + _NEVER_AT_IMPORT),
+    'multi_choice_questions.magic_ids': ([], 0.2, ['dlkit', 'bson', 'pymongo'] + _NEVER_AT_IMPORT),
+    'magic_parts.assessment_part_records': (
+        ['dlkit.json_.assessment_authoring.sessions',
+         'dlkit.json_.assessment_authoring.objects',
+         'dlkit.json_.osid.metadata',
+         RECORDS_PACKAGE + '.osid.base_records'],
+        0.2,
+        [PACKAGE + '.magic_parts.seen_items',
+         PACKAGE + '.magic_parts.objective_item_index',
+         PACKAGE + '.magic_parts.item_prefetch',
+         PACKAGE + '.multi_choice_questions'] + _NEVER_AT_IMPORT),
+    'multi_choice_questions.randomized_questions': (
+        ['dlkit.json_.assessment.sessions',
+         'dlkit.json_.assessment.objects',
+         RECORDS_PACKAGE + '.osid.base_records',
+         RECORDS_PACKAGE + '.assessment.basic.base_records',
+         RECORDS_PACKAGE + '.assessment.basic.multi_choice_records'],
+        0.08,
+        [PACKAGE + '.multi_choice_questions.choice_order',
+         PACKAGE + '.magic_parts'] + _NEVER_AT_IMPORT),
+}
+
+_MEASURE_IMPORT = '''
+import importlib
+import json
+import sys
+import time
+for name in sys.argv[2:]:
+    importlib.import_module(name)
+before = set(name for name, module in sys.modules.items() if module is not None)
+start = time.time()
+importlib.import_module(sys.argv[1])
+elapsed = time.time() - start
+print(json.dumps({'seconds': elapsed,
+                  'modules': sorted(name for name, module in sys.modules.items()
+                                    if module is not None and name not in before)}))
+'''
+
+
+def measure_import(module_name, preloaded=(), python=sys.executable):
+    """imports the module in a fresh interpreter, after the preloaded ones,
+    and returns the seconds it took and the names of the modules it loaded"""
+    output = subprocess.check_output([python, '-c', _MEASURE_IMPORT, module_name] + list(preloaded))
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['modules']
+
+
+def _median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def measure_reference(runs=5, python=sys.executable):
+    """the median import time of REFERENCE_MODULE in ms"""
+    return _median([measure_import(REFERENCE_MODULE, python=python)[0] * 1000 for _ in range(runs)])
+
+
+def _is_loaded(forbidden_name, module_names):
+    return any(name == forbidden_name or name.startswith(forbidden_name + '.')
+               for name in module_names)
+
+
+def get_loaded_modules(module_name, preloaded=(), python=sys.executable):
+    """the names of the modules that importing the module loads, after the preloaded ones"""
+    return measure_import(module_name, preloaded, python)[1]
+
+
+def get_forbidden_modules(module_names, forbidden):
+    """the forbidden modules (or packages) among the module names"""
+    return [forbidden_name for forbidden_name in forbidden
+            if _is_loaded(forbidden_name, module_names)]
+
+
+def check_module(module_name, preloaded, budget_ms, forbidden, runs=5, python=sys.executable):
+    """the median import time of the module in ms, and the problems with it,
+    as readable lines"""
+    timings = []
+    module_names = []
+    for _ in range(runs):
+        seconds, module_names = measure_import(module_name, preloaded, python)
+        timings.append(seconds * 1000)
+    median_ms = _median(timings)
+    problems = []
+    if median_ms > budget_ms:
+        problems.append('{0}: {1:.1f} ms > {2:.1f} ms'.format(module_name, median_ms, budget_ms))
+    for forbidden_name in get_forbidden_modules(module_names, forbidden):
+        problems.append('{0}: loads {1}'.format(module_name, forbidden_name))
+    return median_ms, problems
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description='check the import time of the adapter modules')
+    parser.add_argument('--runs', type=int, default=5, help='imports per module, the median counts')
+    parser.add_argument('--budget', action='append', default=[], metavar='MODULE=FRACTION',
+                        help='override the budget of a module, as a fraction of the reference '
+                             'import time, e.g. registry=0.05')
+    parser.add_argument('--python', default=sys.executable, help='the interpreter to import with')
+    return parser
+
+
+def main(argv=None):
+    args = get_argument_parser().parse_args(argv)
+    budgets = dict(BUDGETS)
+    for override in args.budget:
+        name, _, fraction = override.partition('=')
+        preloaded, _, forbidden = budgets.get(name, ([], None, []))
+        budgets[name] = (preloaded, float(fraction), forbidden)
+
+    reference_ms = measure_reference(args.runs, args.python)
+    print('{0:<45} {1:8.1f} ms  (reference)'.format(REFERENCE_MODULE, reference_ms))
+    problems = []
+    for name, (preloaded, fraction, forbidden) in sorted(budgets.items()):
+        budget_ms = fraction * reference_ms
+        median_ms, module_problems = check_module('{0}.{1}'.format(PACKAGE, name), preloaded, budget_ms,
+                                                  forbidden, args.runs, args.python)
+        print('{0:<45} {1:8.1f} ms  (budget {2:.1f} ms)'.format(name, median_ms, budget_ms))
+        problems += module_problems
+    for problem in problems:
+        print('OVER BUDGET ' + problem)
+    if problems:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
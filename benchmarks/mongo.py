@@ -0,0 +1,38 @@
+"""
+Mongo backends for the benchmarks, with a count of the round trips made
+through them.
+"""
+import threading
+
+from .. import instrumentation
+
+
+class RoundTripCounter(object):
+    """instrumentation sink that only counts the Mongo round trips"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, kind, name, value):
+        if name == 'mongo.round_trips':
+            with self._lock:
+                self.count += value
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+
+
+def get_mongo_client(backend='mongomock', uri=None):
+    if backend == 'mongomock':
+        import mongomock
+        return mongomock.MongoClient()
+    import pymongo
+    return pymongo.MongoClient(uri)
+
+
+def use_counting_mongo_client(backend='mongomock', uri=None):
+    """points dlkit at an instrumented client for the backend, and returns
+    the counter of its round trips"""
+    instrumentation.instrument_mongo_client(get_mongo_client(backend, uri))
+    return instrumentation.add_sink(RoundTripCounter())
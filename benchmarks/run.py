@@ -0,0 +1,183 @@
+"""
+Measures the latency and Mongo round trips of the magic sessions' hot paths:
+
+    get_item                  RandomizedMCItemLookupSession.get_item, magic ids
+    get_assessment_part       MagicAssessmentPartLookupSession.get_assessment_part
+    get_parts                 ScaffoldDownAssessmentPartRecord.get_parts, whole tree
+    load_item_for_objective   ScaffoldDownAssessmentPartRecord.load_item_for_objective
+
+Each operation runs on fresh sessions, so nothing is served from a session
+cache. Save a baseline with --save, and check against it with --compare,
+which exits with 1 on a regression.
+
+    python -m records.fbw_dlkit_adapters.benchmarks.run --save baseline.json
+    python -m records.fbw_dlkit_adapters.benchmarks.run --compare baseline.json
+"""
+import argparse
+import json
+import sys
+import time
+
+from random import Random
+
+from dlkit.primordium.id.primitives import Id
+
+from ..magic_parts.assessment_part_records import MagicAssessmentPartLookupSession
+from ..multi_choice_questions.magic_ids import get_magic_item_identifier
+from ..multi_choice_questions.randomized_questions import MAGIC_AUTHORITY, RandomizedMCItemLookupSession
+from .fixtures import DEFAULT_PARAMS, BenchmarkParams, build_fixture
+from .mongo import use_counting_mongo_client
+
+PERCENTILES = (50, 90, 99)
+
+
+def get_percentile(sorted_values, percentile):
+    """nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    rank = int(round(percentile / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+def summarize(latencies, round_trips):
+    latencies = sorted(latencies)
+    summary = dict(('p{0}_ms'.format(percentile), get_percentile(latencies, percentile) * 1000)
+                   for percentile in PERCENTILES)
+    summary.update({
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'round_trips': float(sum(round_trips)) / len(round_trips),
+        'runs': len(latencies)
+    })
+    return summary
+
+
+def measure(counter, operation, iterations, warmup=2):
+    """measures iterations runs of an operation, and returns their summary
+
+    operation() sets up one run and returns the callable to measure, so the
+    setup stays out of the measurement.
+
+    """
+    latencies = []
+    round_trips = []
+    for run in range(warmup + iterations):
+        run_operation = operation()
+        counter.reset()
+        start = time.time()
+        run_operation()
+        elapsed = time.time() - start
+        if run >= warmup:
+            latencies.append(elapsed)
+            round_trips.append(counter.count)
+    return summarize(latencies, round_trips)
+
+
+def get_operations(fixture, random):
+    section = fixture.section
+    runtime = section._runtime
+    proxy = section._proxy
+    catalog_id = fixture.bank.ident
+
+    def get_magic_item_id():
+        item_id = random.choice(fixture.item_ids)
+        original_choice_ids = fixture.choice_ids[item_id.identifier]
+        choice_ids = list(original_choice_ids)
+        random.shuffle(choice_ids)
+        return Id(namespace=item_id.namespace,
+                  identifier=get_magic_item_identifier(item_id.identifier, choice_ids, original_choice_ids),
+                  authority=MAGIC_AUTHORITY)
+
+    def get_part_lookup_session():
+        mpls = MagicAssessmentPartLookupSession(section, catalog_id=catalog_id, runtime=runtime, proxy=proxy)
+        mpls.use_unsequestered_assessment_part_view()
+        mpls.use_federated_bank_view()
+        return mpls
+
+    def get_item():
+        session = RandomizedMCItemLookupSession(catalog_id=catalog_id, runtime=runtime, proxy=proxy)
+        session.use_federated_bank_view()
+        item_id = get_magic_item_id()
+        return lambda: session.get_item(item_id)
+
+    def get_assessment_part():
+        mpls = get_part_lookup_session()
+        return lambda: mpls.get_assessment_part(fixture.root_part_id)
+
+    def get_parts():
+        part = get_part_lookup_session().get_assessment_part(fixture.root_part_id)
+        return part.get_parts
+
+    def load_item_for_objective():
+        part = get_part_lookup_session().get_assessment_part(fixture.root_part_id)
+        return part.load_item_for_objective
+
+    return [('get_item', get_item),
+            ('get_assessment_part', get_assessment_part),
+            ('get_parts', get_parts),
+            ('load_item_for_objective', load_item_for_objective)]
+
+
+def compare(results, baseline, tolerance):
+    """the regressions of results against the baseline, as readable lines"""
+    regressions = []
+    for name, summary in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for key in ['p50_ms', 'p90_ms']:
+            if summary[key] > baseline[name][key] * (1 + tolerance):
+                regressions.append('{0} {1}: {2:.2f} > {3:.2f}'.format(name, key, summary[key],
+                                                                       baseline[name][key]))
+        if summary['round_trips'] > baseline[name]['round_trips']:
+            regressions.append('{0} round_trips: {1:.1f} > {2:.1f}'.format(name, summary['round_trips'],
+                                                                         baseline[name]['round_trips']))
+    return regressions
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description='benchmark the magic sessions')
+    parser.add_argument('--backend', choices=['mongomock', 'mongod'], default='mongomock')
+    parser.add_argument('--mongo-uri', default=None, help='for the mongod backend')
+    parser.add_argument('--iterations', type=int, default=50)
+    for field in BenchmarkParams._fields:
+        parser.add_argument('--' + field.replace('_', '-'), type=int, default=getattr(DEFAULT_PARAMS, field))
+    parser.add_argument('--save', metavar='JSON', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON', help='compare the results with a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed latency increase over the baseline, as a fraction')
+    return parser
+
+
+def main(argv=None):
+    args = get_argument_parser().parse_args(argv)
+    params = BenchmarkParams(**dict((field, getattr(args, field)) for field in BenchmarkParams._fields))
+    counter = use_counting_mongo_client(args.backend, args.mongo_uri)
+    fixture = build_fixture(params)
+    random = Random(params.seed)
+
+    results = {}
+    for name, operation in get_operations(fixture, random):
+        results[name] = measure(counter, operation, args.iterations)
+        print('{0:<25} p50 {p50_ms:8.2f} ms  p90 {p90_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  '
+              'round trips {round_trips:6.1f}'.format(name, **results[name]))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({'backend': args.backend,
+                       'params': params._asdict(),
+                       'results': results}, baseline_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['params'] != params._asdict() or baseline['backend'] != args.backend:
+            print('warning: the baseline was made with different parameters')
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Simulates students taking a scaffold-down assessment, to size deployments.
+
+Every student takes the assessment through the real sessions and records, so
+the tree grows by ScaffoldDownAssessmentPartRecord's own rules (maxLevels,
+maxWaypointItems, waypointQuota), and answers each question right with the
+probability their profile gives for the question's level. The students are
+spread over a pool of processes; each process builds its own bank and
+assessment, in mongomock by default.
+
+    python -m records.fbw_dlkit_adapters.benchmarks.simulate_scaffold --students 2000 \\
+        --profile average --profile struggling --max-levels 4
+
+Reports the distributions of the tree depth, the number of parts and
+questions and the size of the finished sections, and of the Mongo reads and
+writes of each request, overall and per profile.
+"""
+import argparse
+import json
+import sys
+
+from multiprocessing import Pool, cpu_count
+from random import Random
+
+from bson import BSON
+from dlkit.abstract_osid.osid.errors import IllegalState
+from dlkit.primordium.id.primitives import Id
+
+from .. import instrumentation
+from ..magic_parts.magic_ids import MAGIC_PART_AUTHORITY, parse_magic_part_identifier
+from .fixtures import DEFAULT_PARAMS, BenchmarkParams, answer_question, build_assessment, create_taken,\
+    get_assessment_manager
+from .mongo import get_mongo_client
+from .run import get_percentile
+
+# probability of a right answer at each level, the last one holds for the
+# levels below it
+PROFILES = {
+    'strong': [0.9],
+    'average': [0.65],
+    'struggling': [0.35],
+    'improving': [0.3, 0.5, 0.7, 0.85],
+    'guessing': [0.25]
+}
+
+READ_METHODS = frozenset(['aggregate', 'count', 'distinct', 'find', 'find_one'])
+# a student who never finishes would otherwise keep the worker busy forever
+MAX_QUESTIONS_PER_STUDENT = 500
+DISTRIBUTIONS = ['depth', 'parts', 'questions', 'section_bytes',
+                 'next_question_reads', 'next_question_writes', 'submit_reads', 'submit_writes']
+
+
+class QueryCounter(object):
+    """instrumentation sink that counts the Mongo reads and writes"""
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+    def __call__(self, kind, name, value):
+        if kind != instrumentation.TIMING or not name.startswith('mongo.'):
+            return
+        if name.rpartition('.')[2] in READ_METHODS:
+            self.reads += 1
+        else:
+            self.writes += 1
+
+    def reset(self):
+        self.reads = 0
+        self.writes = 0
+
+
+_worker = {}
+
+
+def _init_worker(backend, mongo_uri, params):
+    instrumentation.instrument_mongo_client(get_mongo_client(backend, mongo_uri))
+    _worker['assessment'] = build_assessment(params)
+    # count only once the assessment is built
+    _worker['counter'] = instrumentation.add_sink(QueryCounter())
+
+
+def get_level(section_map, question):
+    """the level of the part the question belongs to"""
+    for question_map in section_map['questions']:
+        if question_map['questionId'] == str(question.ident):
+            part_id = Id(question_map['assessmentPartId'])
+            if part_id.get_authority() != MAGIC_PART_AUTHORITY:
+                return 0
+            return parse_magic_part_identifier(part_id.get_identifier())[1]['level']
+    return 0
+
+
+def get_right_answer_probability(profile, level):
+    probabilities = PROFILES[profile]
+    return probabilities[min(level, len(probabilities) - 1)]
+
+
+def simulate_student(student_index, profile, seed):
+    """takes the assessment as one student, and returns what it took"""
+    assessment = _worker['assessment']
+    counter = _worker['counter']
+    random = Random(seed)
+    bank = get_assessment_manager('simulated-student-{0}@mit.edu'.format(student_index)).get_bank(
+        assessment.bank_id)
+    section = create_taken(bank, assessment.offered_id)
+    result = dict((name, []) for name in DISTRIBUTIONS if name.startswith(('next_question', 'submit')))
+    for _ in range(MAX_QUESTIONS_PER_STUDENT):
+        counter.reset()
+        try:
+            question = bank.get_first_unanswered_question(section.ident)
+        except IllegalState:
+            break
+        result['next_question_reads'].append(counter.reads)
+        result['next_question_writes'].append(counter.writes)
+        # find out the level outside of the counted requests
+        level = get_level(bank.get_assessment_section(section.ident)._my_map, question)
+        correct = random.random() < get_right_answer_probability(profile, level)
+        counter.reset()
+        answer_question(bank, section, question, assessment, correct, random)
+        result['submit_reads'].append(counter.reads)
+        result['submit_writes'].append(counter.writes)
+
+    section_map = bank.get_assessment_section(section.ident)._my_map
+    levels = [parse_magic_part_identifier(Id(part_map['assessmentPartId']).get_identifier())[1]['level']
+              for part_map in section_map['assessmentParts']
+              if Id(part_map['assessmentPartId']).get_authority() == MAGIC_PART_AUTHORITY]
+    result.update({
+        'profile': profile,
+        'depth': max(levels) if levels else 0,
+        'parts': len(section_map['assessmentParts']),
+        'questions': len(section_map['questions']),
+        'section_bytes': len(BSON.encode(section_map))
+    })
+    return result
+
+
+def simulate_students(students):
+    """runs a chunk of (student_index, profile, seed) on a worker"""
+    return [simulate_student(*student) for student in students]
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    summary = dict(('p{0}'.format(percentile), get_percentile(values, percentile))
+                   for percentile in (50, 90, 99))
+    summary.update({
+        'min': values[0],
+        'max': values[-1],
+        'mean': float(sum(values)) / len(values),
+        'count': len(values)
+    })
+    return summary
+
+
+def aggregate(results):
+    """the distributions over all the students, and per profile"""
+    def get_distributions(student_results):
+        values = dict((name, []) for name in DISTRIBUTIONS)
+        depth_histogram = {}
+        for student_result in student_results:
+            for name in DISTRIBUTIONS:
+                value = student_result[name]
+                if isinstance(value, list):
+                    values[name] += value
+                else:
+                    values[name].append(value)
+            depth_histogram[student_result['depth']] = depth_histogram.get(student_result['depth'], 0) + 1
+        distributions = dict((name, summarize(name_values)) for name, name_values in values.items())
+        distributions['depth_histogram'] = depth_histogram
+        distributions['students'] = len(student_results)
+        return distributions
+
+    report = {'all': get_distributions(results)}
+    for profile in sorted(set(result['profile'] for result in results)):
+        report[profile] = get_distributions([result for result in results if result['profile'] == profile])
+    return report
+
+
+def run_simulation(params, profiles, students, processes=None, backend='mongomock', mongo_uri=None,
+                   chunk_size=20):
+    """simulates the students, with profiles assigned in turn, and returns the report"""
+    random = Random(params.seed)
+    student_args = [(index, profiles[index % len(profiles)], random.getrandbits(32))
+                    for index in range(students)]
+    chunks = [student_args[start:start + chunk_size] for start in range(0, len(student_args), chunk_size)]
+    pool = Pool(processes=processes or cpu_count(),
+                initializer=_init_worker,
+                initargs=(backend, mongo_uri, params))
+    try:
+        results = []
+        for chunk_results in pool.imap_unordered(simulate_students, chunks):
+            results += chunk_results
+    finally:
+        pool.close()
+        pool.join()
+    return aggregate(results)
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(description='simulate students taking a scaffold-down assessment')
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                        help='student profile, may be repeated; the students take them in turn')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to the number of CPUs')
+    parser.add_argument('--chunk-size', type=int, default=20, help='students per task')
+    parser.add_argument('--backend', choices=['mongomock', 'mongod'], default='mongomock')
+    parser.add_argument('--mongo-uri', default=None, help='for the mongod backend')
+    for field in BenchmarkParams._fields:
+        if field == 'prior_takens':
+            continue
+        parser.add_argument('--' + field.replace('_', '-'), type=int, default=getattr(DEFAULT_PARAMS, field))
+    parser.add_argument('--output', metavar='JSON', help='save the report')
+    return parser
+
+
+def main(argv=None):
+    args = get_argument_parser().parse_args(argv)
+    params = DEFAULT_PARAMS._replace(**dict((field, getattr(args, field)) for field in BenchmarkParams._fields
+                                            if field != 'prior_takens'))
+    report = run_simulation(params, args.profile or ['average'], args.students, args.processes,
+                            args.backend, args.mongo_uri, args.chunk_size)
+
+    for group, distributions in sorted(report.items()):
+        print('{0} ({1} students)'.format(group, distributions['students']))
+        for name in DISTRIBUTIONS:
+            if distributions[name] is None:
+                continue
+            print('  {0:<22} p50 {p50:8} p90 {p90:8} p99 {p99:8} max {max:8}'.format(name, **distributions[name]))
+        print('  depth histogram        {0}'.format(
+            ', '.join('{0}: {1}'.format(depth, count)
+                      for depth, count in sorted(distributions['depth_histogram'].items()))))
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump({'params': params._asdict(), 'report': report}, report_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Opt-in instrumentation of the adapter sessions and records.
+
+Nothing gets measured until a sink is added:
+
+    from records.fbw_dlkit_adapters import instrumentation
+    stats = instrumentation.add_sink(instrumentation.StatsSink())
+    ...
+    stats.summary()
+
+Sinks get every metric as (kind, name, value), where kind is COUNTER
+(value is the increment), TIMING (value in seconds) or GAUGE. Without
+sinks, each instrumented call site costs a single check of an empty list.
+
+Mongo round trips go through dlkit, so they are only counted once
+instrument_mongo_client() has wrapped dlkit's client.
+"""
+import threading
+import time
+
+COUNTER = 'counter'
+TIMING = 'timing'
+GAUGE = 'gauge'
+
+_sinks = []
+
+
+def add_sink(sink):
+    """starts sending metrics to sink, a callable taking (kind, name, value).
+    Returns the sink."""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def is_enabled():
+    return bool(_sinks)
+
+
+def _emit(kind, name, value):
+    for sink in list(_sinks):
+        sink(kind, name, value)
+
+
+def increment(name, value=1):
+    if _sinks:
+        _emit(COUNTER, name, value)
+
+
+def timing(name, seconds):
+    if _sinks:
+        _emit(TIMING, name, seconds)
+
+
+def gauge(name, value):
+    if _sinks:
+        _emit(GAUGE, name, value)
+
+
+def count_cache_lookup(name, hit):
+    """counts a hit or a miss of the named cache"""
+    if _sinks:
+        _emit(COUNTER, '{0}.{1}'.format(name, 'hit' if hit else 'miss'), 1)
+
+
+class _Timer(object):
+    def __init__(self, name):
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        timing(self._name, time.time() - self._start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name):
+    """context manager that reports the time spent in it"""
+    if _sinks:
+        return _Timer(name)
+    return _NULL_TIMER
+
+
+class CallbackSink(object):
+    """hands the metrics to callback(kind, name, value), e.g. for logging"""
+    def __init__(self, callback):
+        self._callback = callback
+
+    def __call__(self, kind, name, value):
+        self._callback(kind, name, value)
+
+
+class StatsSink(object):
+    """keeps the metrics in memory, thread-safe"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+
+    def __call__(self, kind, name, value):
+        with self._lock:
+            if kind == COUNTER:
+                self.counters[name] = self.counters.get(name, 0) + value
+            elif kind == TIMING:
+                self.timings.setdefault(name, []).append(value)
+            else:
+                self.gauges[name] = value
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+            self.gauges.clear()
+
+    def summary(self):
+        """the counters and gauges, and the count, total and max of each timing"""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timings': dict((name, {'count': len(values),
+                                        'total': sum(values),
+                                        'max': max(values)})
+                                for name, values in self.timings.items())
+            }
+
+
+class StatsdSink(object):
+    """formats the metrics as statsd lines ("name:value|type") and hands them
+    to write, e.g. a function sending them over UDP"""
+    _types = {COUNTER: 'c', TIMING: 'ms', GAUGE: 'g'}
+
+    def __init__(self, write, prefix='fbw_dlkit_adapters'):
+        self._write = write
+        self._prefix = prefix
+
+    def __call__(self, kind, name, value):
+        if kind == TIMING:
+            value = int(round(value * 1000))
+        if self._prefix:
+            name = '{0}.{1}'.format(self._prefix, name)
+        self._write('{0}:{1}|{2}'.format(name, value, self._types[kind]))
+
+
+# Mongo round trips
+
+ROUND_TRIP_METHODS = frozenset([
+    'aggregate', 'count', 'delete_many', 'delete_one', 'distinct', 'find',
+    'find_one', 'find_one_and_update', 'insert_many', 'insert_one',
+    'replace_one', 'save', 'update_many', 'update_one'
+])
+
+
+class _Proxy(object):
+    def __init__(self, target, name=None):
+        self._target = target
+        self._name = name
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class InstrumentedCollection(_Proxy):
+    """counts and times the round trips of a pymongo or mongomock collection.
+    Cursors are timed up to their creation only."""
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in ROUND_TRIP_METHODS:
+            return attr
+        metric_name = 'mongo.{0}.{1}'.format(self._name, name)
+
+        def instrumented(*args, **kwargs):
+            if not _sinks:
+                return attr(*args, **kwargs)
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                _emit(COUNTER, 'mongo.round_trips', 1)
+                _emit(TIMING, metric_name, time.time() - start)
+        return instrumented
+
+
+class InstrumentedDatabase(_Proxy):
+    def __getitem__(self, name):
+        return InstrumentedCollection(self._target[name], name)
+
+
+class InstrumentedMongoClient(_Proxy):
+    def __getitem__(self, name):
+        return InstrumentedDatabase(self._target[name], name)
+
+
+def instrument_mongo_client(mongo_client=None):
+    """wraps dlkit's Mongo client (or sets mongo_client, wrapped) so that
+    round trips get reported
+
+    dlkit's managers replace the client whenever they initialize, so the
+    clients they make from then on get wrapped too. A mongo_client given
+    here is kept instead.
+
+    """
+    from dlkit.json_ import JSON_CLIENT, utilities
+    make_mongo_client = getattr(utilities.MongoClient, 'unwrapped', utilities.MongoClient)
+    keep_mongo_client = mongo_client is not None
+    if mongo_client is None and JSON_CLIENT.is_json_client_set():
+        mongo_client = JSON_CLIENT.json_client
+    if mongo_client is not None:
+        if not isinstance(mongo_client, InstrumentedMongoClient):
+            mongo_client = InstrumentedMongoClient(mongo_client)
+        JSON_CLIENT.set_json_client(mongo_client)
+
+    def make_instrumented_mongo_client(*args, **kwargs):
+        if keep_mongo_client:
+            return mongo_client
+        return InstrumentedMongoClient(make_mongo_client(*args, **kwargs))
+    make_instrumented_mongo_client.unwrapped = make_mongo_client
+    utilities.MongoClient = make_instrumented_mongo_client
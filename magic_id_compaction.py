@@ -0,0 +1,419 @@
+"""
+Offline compaction of the magic ids stored in AssessmentSection documents.
+
+Sections store the magic part and item ids verbatim, in
+questions[*].itemId, questions[*].questionId, questions[*].assessmentPartId
+and assessmentParts[*].assessmentPartId. The legacy forms make the documents
+large: child part ids embed their parent id at every level, and item ids
+hold the JSON list of choice ids. This job rewrites them to the compact
+forms, path part ids (magic_parts/magic_ids.py) and index item ids
+(multi_choice_questions/magic_ids.py). In the sections of finished takens, it
+also drops the magic parts that no question references, directly or through
+a descendant. A section still being taken can have parts whose questions
+are yet to be added, so those keep all their parts.
+
+    report = compact_assessment_sections(runtime, proxy, dry_run=True)
+
+The job goes through the sections in _id order, in batches, and records the
+last section done after every batch, so it can be stopped and restarted.
+Unless verify is off, every rewritten id is first resolved through
+MagicAssessmentPartLookupSession and RandomizedMCItemLookupSession; a section
+with an id that doesn't resolve to the same part or choice order is left
+alone.
+
+The ids are rewritten in place, one array element at a time, and only where
+they still hold the ids that were read, so responses submitted meanwhile are
+kept. The orphaned parts are then pulled, unless questions or parts were
+added to the section meanwhile.
+"""
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+try:
+    from bson import encode as bson_encode
+except ImportError:
+    from bson import BSON
+    bson_encode = BSON.encode
+
+from dlkit.abstract_osid.osid.errors import NotFound
+from dlkit.json_.utilities import JSONClientValidated
+from dlkit.primordium.id.primitives import Id
+
+from .magic_parts.assessment_part_records import MagicAssessmentPartLookupSession
+from .magic_parts.magic_ids import MAGIC_PART_AUTHORITY, get_magic_part_id, parse_magic_part_identifier
+from .multi_choice_questions.magic_ids import get_magic_item_identifier, parse_magic_item_identifier
+from .multi_choice_questions.randomized_questions import MAGIC_AUTHORITY, RandomizedMCItemLookupSession
+
+COMPACTION_STATE_COLLECTION = 'MagicIdCompaction'
+MAX_REPORTED_FAILURES = 100
+
+
+def _get_magic_part_path(part_id_str):
+    """the path of a legacy child part id, or None if it can't be rebuilt
+    into a path id with the same parent ids"""
+    original_identifier, arg_map = parse_magic_part_identifier(Id(part_id_str).get_identifier())
+    steps = []
+    current_id_str = part_id_str
+    current_arg_map = arg_map
+    while True:
+        if current_arg_map['path'] is not None:
+            steps = current_arg_map['path'] + steps
+            break
+        steps.insert(0, [current_arg_map['waypoint_index'], current_arg_map['objective_ids']])
+        if current_arg_map['parent_id'] is None:
+            # the root id stays as it is, so it has to come out the same
+            if str(get_magic_part_id(original_identifier, steps[:1])) != current_id_str:
+                return None
+            break
+        current_id_str = current_arg_map['parent_id']
+        current_identifier, current_arg_map = parse_magic_part_identifier(Id(current_id_str).get_identifier())
+        if current_identifier != original_identifier:
+            return None
+    if len(steps) - 1 != arg_map['level']:
+        return None
+    return steps
+
+
+def compact_magic_part_id(part_id_str):
+    """the path form of a legacy magic part id; other ids come back unchanged"""
+    part_id = Id(part_id_str)
+    if part_id.get_authority() != MAGIC_PART_AUTHORITY:
+        return part_id_str
+    original_identifier, arg_map = parse_magic_part_identifier(part_id.get_identifier())
+    if arg_map['path'] is not None or arg_map['parent_id'] is None:
+        # already compact, or a root part, which has a single form
+        return part_id_str
+    path = _get_magic_part_path(part_id_str)
+    if path is None:
+        return part_id_str
+    return str(get_magic_part_id(original_identifier, path))
+
+
+def compact_magic_item_id(item_id_str, original_choice_ids):
+    """the index form of a legacy magic item id, given the item's original
+    choice ids; other ids come back unchanged"""
+    item_id = Id(item_id_str)
+    if item_id.get_authority() != MAGIC_AUTHORITY or original_choice_ids is None:
+        return item_id_str
+    original_identifier, choice_order = parse_magic_item_identifier(item_id.get_identifier())
+    if not choice_order or all(isinstance(choice_id, int) for choice_id in choice_order):
+        return item_id_str
+    return str(Id(namespace=item_id.get_identifier_namespace(),
+                  identifier=get_magic_item_identifier(original_identifier,
+                                                       choice_order,
+                                                       original_choice_ids),
+                  authority=MAGIC_AUTHORITY))
+
+
+def _is_legacy_magic_item_id(item_id_str):
+    item_id = Id(item_id_str)
+    if item_id.get_authority() != MAGIC_AUTHORITY:
+        return False
+    choice_order = parse_magic_item_identifier(item_id.get_identifier())[1]
+    return bool(choice_order) and not all(isinstance(choice_id, int) for choice_id in choice_order)
+
+
+def _get_original_item_identifier(item_id_str):
+    item_id = Id(item_id_str)
+    if item_id.get_authority() != MAGIC_AUTHORITY:
+        return None
+    return parse_magic_item_identifier(item_id.get_identifier())[0]
+
+
+def _get_ancestor_part_ids(part_id_str):
+    ancestor_ids = []
+    while True:
+        part_id = Id(part_id_str)
+        if part_id.get_authority() != MAGIC_PART_AUTHORITY:
+            return ancestor_ids
+        part_id_str = parse_magic_part_identifier(part_id.get_identifier())[1]['parent_id']
+        if part_id_str is None:
+            return ancestor_ids
+        ancestor_ids.append(part_id_str)
+
+
+def compact_section_map(section_map, original_choice_ids, drop_orphaned_parts=True):
+    """returns the compacted questions and assessmentParts of a section map,
+    and the old id -> new id map of everything that changed
+
+    original_choice_ids maps original item identifiers to their choice ids.
+    Unless drop_orphaned_parts, the magic parts no question references are
+    kept, e.g. for sections still being taken.
+
+    """
+    rewritten_ids = {}
+    compacted_item_ids = {}
+
+    def compact_part_id(part_id_str):
+        if part_id_str not in rewritten_ids:
+            rewritten_ids[part_id_str] = compact_magic_part_id(part_id_str)
+        return rewritten_ids[part_id_str]
+
+    def compact_item_id(item_id_str):
+        if item_id_str not in compacted_item_ids:
+            compacted_item_ids[item_id_str] = compact_magic_item_id(
+                item_id_str,
+                original_choice_ids.get(_get_original_item_identifier(item_id_str)))
+        return compacted_item_ids[item_id_str]
+
+    questions = []
+    for question_map in section_map.get('questions', []):
+        question_map = dict(question_map)
+        # the magic item id can be in both, and they have to stay alike:
+        # rewrite both or neither
+        item_keys = [key for key in ('itemId', 'questionId') if key in question_map]
+        new_item_ids = dict((key, compact_item_id(question_map[key])) for key in item_keys)
+        if not any(_is_legacy_magic_item_id(new_item_ids[key]) for key in item_keys):
+            for key in item_keys:
+                rewritten_ids[question_map[key]] = new_item_ids[key]
+                question_map[key] = new_item_ids[key]
+        if 'assessmentPartId' in question_map:
+            question_map['assessmentPartId'] = compact_part_id(question_map['assessmentPartId'])
+        questions.append(question_map)
+
+    referenced_part_ids = set()
+    for question_map in questions:
+        if 'assessmentPartId' in question_map:
+            referenced_part_ids.add(question_map['assessmentPartId'])
+            referenced_part_ids.update(_get_ancestor_part_ids(question_map['assessmentPartId']))
+    assessment_parts = []
+    for part_map in section_map.get('assessmentParts', []):
+        part_id_str = compact_part_id(part_map['assessmentPartId'])
+        if (drop_orphaned_parts and
+                Id(part_id_str).get_authority() == MAGIC_PART_AUTHORITY and
+                part_id_str not in referenced_part_ids):
+            # orphaned
+            continue
+        part_map = dict(part_map)
+        part_map['assessmentPartId'] = part_id_str
+        assessment_parts.append(part_map)
+
+    return questions, assessment_parts, dict((old_id, new_id) for old_id, new_id in rewritten_ids.items()
+                                             if old_id != new_id)
+
+
+class CompactionVerifier(object):
+    """checks that compacted ids resolve to the same parts and choice orders
+    as the ids they replace
+
+    Its lookup sessions keep every part and item they resolve, so use a new
+    verifier for every batch of sections.
+
+    """
+    def __init__(self, runtime, proxy=None):
+        self._part_session = MagicAssessmentPartLookupSession(None, runtime=runtime, proxy=proxy)
+        self._part_session.use_unsequestered_assessment_part_view()
+        self._part_session.use_federated_bank_view()
+        self._item_session = RandomizedMCItemLookupSession(runtime=runtime, proxy=proxy)
+        self._item_session.use_federated_bank_view()
+
+    def verify_part_id(self, old_id_str, new_id_str):
+        old_id = Id(old_id_str)
+        new_id = Id(new_id_str)
+        old_identifier, old_arg_map = parse_magic_part_identifier(old_id.get_identifier())
+        new_identifier, new_arg_map = parse_magic_part_identifier(new_id.get_identifier())
+        if old_identifier != new_identifier:
+            return False
+        for key in ['level', 'objective_ids', 'waypoint_index']:
+            if old_arg_map[key] != new_arg_map[key]:
+                return False
+        if old_arg_map['parent_id'] is not None:
+            if compact_magic_part_id(old_arg_map['parent_id']) != new_arg_map['parent_id']:
+                return False
+        try:
+            part = self._part_session.get_assessment_part(new_id)
+        except NotFound:
+            return False
+        return str(part.get_id()) == new_id_str
+
+    def verify_item_id(self, old_id_str, new_id_str):
+        old_choice_ids = parse_magic_item_identifier(Id(old_id_str).get_identifier())[1]
+        try:
+            question = self._item_session.get_item(Id(new_id_str)).get_question()
+        except NotFound:
+            return False
+        return [choice['id'] for choice in question._my_map['choices']] == old_choice_ids
+
+    def verify(self, old_id_str, new_id_str):
+        if Id(old_id_str).get_authority() == MAGIC_PART_AUTHORITY:
+            return self.verify_part_id(old_id_str, new_id_str)
+        return self.verify_item_id(old_id_str, new_id_str)
+
+
+def _get_original_choice_ids(section_maps, runtime):
+    """original item identifier -> choice ids, for the magic items in the sections"""
+    object_ids = set()
+    for section_map in section_maps:
+        for question_map in section_map.get('questions', []):
+            for key in ('itemId', 'questionId'):
+                identifier = _get_original_item_identifier(question_map.get(key, ''))
+                if identifier is None:
+                    continue
+                try:
+                    object_ids.add(ObjectId(identifier))
+                except InvalidId:
+                    continue
+    if not object_ids:
+        return {}
+    items = JSONClientValidated('assessment',
+                                collection='Item',
+                                runtime=runtime)
+    original_choice_ids = {}
+    for item_map in items.raw().find({'_id': {'$in': list(object_ids)}}, {'question.choices.id': 1}):
+        choices = (item_map.get('question') or {}).get('choices')
+        if choices:
+            original_choice_ids[str(item_map['_id'])] = [choice['id'] for choice in choices]
+    return original_choice_ids
+
+
+def _get_finished_taken_ids(section_maps, runtime):
+    """the assessmentTakenIds of the sections whose takens have been finished"""
+    taken_ids = {}
+    for section_map in section_maps:
+        try:
+            taken_ids[ObjectId(Id(section_map['assessmentTakenId']).identifier)] = section_map['assessmentTakenId']
+        except (KeyError, InvalidId):
+            continue
+    if not taken_ids:
+        return set()
+    takens = JSONClientValidated('assessment',
+                                 collection='AssessmentTaken',
+                                 runtime=runtime)
+    return set(taken_ids[taken_map['_id']]
+               for taken_map in takens.raw().find({'_id': {'$in': list(taken_ids)},
+                                                   'completionTime': {'$ne': None}},
+                                                  {'_id': 1}))
+
+
+def _get_section_updates(section_map, questions, assessment_parts):
+    """the updates that write the compacted ids of the section in place, and
+    then pull its orphaned parts
+
+    Every id only gets set where the section still holds the id that was
+    read, and the parts only get pulled if the section has as many questions
+    and parts as it had.
+
+    """
+    updates = []
+    id_filter = {'_id': section_map['_id']}
+    new_ids = {}
+    for index, (question_map, compacted_map) in enumerate(zip(section_map.get('questions', []), questions)):
+        for key in ('itemId', 'questionId', 'assessmentPartId'):
+            if question_map.get(key) != compacted_map.get(key):
+                field = 'questions.{0}.{1}'.format(index, key)
+                id_filter[field] = question_map[key]
+                new_ids[field] = compacted_map[key]
+    kept_part_ids = set(part_map['assessmentPartId'] for part_map in assessment_parts)
+    orphaned_part_ids = []
+    for index, part_map in enumerate(section_map.get('assessmentParts', [])):
+        part_id_str = compact_magic_part_id(part_map['assessmentPartId'])
+        if part_id_str not in kept_part_ids:
+            orphaned_part_ids += [part_map['assessmentPartId'], part_id_str]
+        if part_id_str != part_map['assessmentPartId']:
+            field = 'assessmentParts.{0}.assessmentPartId'.format(index)
+            id_filter[field] = part_map['assessmentPartId']
+            new_ids[field] = part_id_str
+    if new_ids:
+        updates.append(UpdateOne(id_filter, {'$set': new_ids}))
+    if orphaned_part_ids:
+        updates.append(UpdateOne({'_id': section_map['_id'],
+                                  'questions': {'$size': len(section_map.get('questions', []))},
+                                  'assessmentParts': {'$size': len(section_map.get('assessmentParts', []))}},
+                                 {'$pull': {'assessmentParts': {'assessmentPartId': {'$in': orphaned_part_ids}}}}))
+    return updates
+
+
+def _get_new_report():
+    return {
+        'sections_scanned': 0,
+        'sections_compacted': 0,
+        'sections_failing_verification': 0,
+        # updates skipped because their section changed since it was read
+        'updates_changed_meanwhile': 0,
+        'ids_compacted': 0,
+        'orphaned_parts_dropped': 0,
+        'bytes_before': 0,
+        'bytes_after': 0,
+        'verification_failures': []
+    }
+
+
+def compact_assessment_sections(runtime, proxy=None, dry_run=False, batch_size=100,
+                                verify=True, job_name='default', restart=False):
+    """compacts the magic ids in all the AssessmentSections
+
+    With dry_run, only reports what would change, including the size of the
+    section documents before and after. Otherwise carries on from where the
+    job named job_name stopped, unless restart. Returns the report, which
+    covers all the runs of the job.
+
+    """
+    sections = JSONClientValidated('assessment',
+                                   collection='AssessmentSection',
+                                   runtime=runtime).raw()
+    state_collection = JSONClientValidated('assessment',
+                                           collection=COMPACTION_STATE_COLLECTION,
+                                           runtime=runtime).raw()
+    last_section_id = None
+    report = _get_new_report()
+    if not dry_run and not restart:
+        state = state_collection.find_one({'_id': job_name})
+        if state is not None:
+            last_section_id = state['lastSectionId']
+            report = state['report']
+
+    while True:
+        query = {}
+        if last_section_id is not None:
+            query = {'_id': {'$gt': last_section_id}}
+        section_maps = list(sections.find(query).sort('_id', 1).limit(batch_size))
+        if not section_maps:
+            break
+        original_choice_ids = _get_original_choice_ids(section_maps, runtime)
+        finished_taken_ids = _get_finished_taken_ids(section_maps, runtime)
+        verifier = CompactionVerifier(runtime, proxy) if verify else None
+        updates = []
+        for section_map in section_maps:
+            report['sections_scanned'] += 1
+            questions, assessment_parts, rewritten_ids = compact_section_map(
+                section_map,
+                original_choice_ids,
+                drop_orphaned_parts=section_map.get('assessmentTakenId') in finished_taken_ids)
+            num_dropped = len(section_map.get('assessmentParts', [])) - len(assessment_parts)
+            if not rewritten_ids and not num_dropped:
+                continue
+            if verifier is not None:
+                failures = [(old_id, new_id) for old_id, new_id in rewritten_ids.items()
+                            if not verifier.verify(old_id, new_id)]
+                if failures:
+                    report['sections_failing_verification'] += 1
+                    remaining = MAX_REPORTED_FAILURES - len(report['verification_failures'])
+                    report['verification_failures'] += [{'sectionId': str(section_map['_id']),
+                                                         'oldId': old_id,
+                                                         'newId': new_id}
+                                                        for old_id, new_id in failures[:max(remaining, 0)]]
+                    continue
+            compacted_map = dict(section_map)
+            compacted_map['questions'] = questions
+            compacted_map['assessmentParts'] = assessment_parts
+            report['sections_compacted'] += 1
+            report['ids_compacted'] += len(rewritten_ids)
+            report['orphaned_parts_dropped'] += num_dropped
+            report['bytes_before'] += len(bson_encode(section_map))
+            report['bytes_after'] += len(bson_encode(compacted_map))
+            updates.append(_get_section_updates(section_map, questions, assessment_parts))
+        last_section_id = section_maps[-1]['_id']
+        if dry_run:
+            continue
+        if updates:
+            # the parts get pulled after their ids are rewritten
+            result = sections.bulk_write([update for section_updates in updates for update in section_updates],
+                                         ordered=True)
+            report['updates_changed_meanwhile'] += sum(len(section_updates) for section_updates in updates) -\
+                result.matched_count
+        state_collection.update_one({'_id': job_name},
+                                    {'$set': {'lastSectionId': last_section_id,
+                                              'report': report}},
+                                    upsert=True)
+    return report
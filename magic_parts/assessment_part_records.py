@@ -1,51 +1,99 @@
 """
 Defines records for assessment parts
 """
-import json
+import threading
+import time
 
 from bson import ObjectId
 from collections import OrderedDict
+from copy import deepcopy
 from random import shuffle
-from urllib import quote, unquote
+from urllib import unquote
 
 from dlkit.abstract_osid.assessment_authoring import record_templates as abc_assessment_authoring_records
-from dlkit.json_.assessment.assessment_utilities import get_assessment_part_lookup_session
-from dlkit.json_.assessment_authoring.objects import AssessmentPartList
-from dlkit.json_.assessment_authoring.sessions import AssessmentPartLookupSession
+from dlkit.json_.assessment.assessment_utilities import get_assessment_part_lookup_session, get_item_lookup_session
+from dlkit.json_.assessment.objects import ItemList
+from dlkit.json_.assessment_authoring.objects import AssessmentPart, AssessmentPartList
+from dlkit.json_.assessment_authoring.sessions import AssessmentPartAdminSession, AssessmentPartLookupSession
 from dlkit.json_.id.objects import IdList
 from dlkit.json_.osid import record_templates as osid_records
 from dlkit.json_.osid.metadata import Metadata
-from dlkit.json_.utilities import JSONClientValidated
+from dlkit.json_.utilities import JSONClientValidated, get_effective_agent_id_with_proxy
 
 from dlkit.primordium.id.primitives import Id
+from dlkit.primordium.type.primitives import Type
 from dlkit.abstract_osid.osid.errors import IllegalState, InvalidArgument, NoAccess, NotFound, OperationFailed
 
-from dlkit.abstract_osid.assessment_authoring import record_templates as abc_assessment_authoring_records
-from dlkit.abstract_osid.osid.errors import IllegalState, InvalidArgument, NoAccess, NotFound, OperationFailed
-from dlkit.primordium.id.primitives import Id
-
 from ...osid.base_records import ObjectInitRecord
+from ..instrumentation import count_cache_lookup, gauge, is_enabled, timed
+from ..registry import ASSESSMENT_PART_RECORD_TYPES
+from ..utilities import LRUCache
+from .item_sampling import SAMPLE_ITEMS, SHUFFLE_ITEMS, reservoir_sample,\
+    reservoir_sample_item_id, sample_item_id
+from .magic_ids import MAGIC_PART_AUTHORITY, get_legacy_magic_part_id, get_magic_part_id,\
+    parse_magic_part_identifier
+from .section_cache import end_item_selection_batch, end_scaffold_evaluation, get_child_part_index,\
+    get_item_selection_batch, get_question_index, get_scaffold_evaluation_context,\
+    get_section_version, start_item_selection_batch, start_scaffold_evaluation
 
-MAGIC_PART_AUTHORITY = 'magic-part-authority'
 ENDLESS = 10000 # For seemingly endless waypoints
+SCAFFOLD_DOWN_RECORD_TYPE = Type(authority=ASSESSMENT_PART_RECORD_TYPES['scaffold-down']['authority'],
+                                 namespace=ASSESSMENT_PART_RECORD_TYPES['scaffold-down']['namespace'],
+                                 identifier=ASSESSMENT_PART_RECORD_TYPES['scaffold-down']['identifier'])
 
 
-def get_part_from_magic_part_lookup_session(section, part_id, *args, **kwargs):
-    mpls = MagicAssessmentPartLookupSession(section, *args, **kwargs)
+def get_magic_assessment_part_lookup_session(assessment_section=None, *args, **kwargs):
+    """the MagicAssessmentPartLookupSession for the section, from
+    MagicAssessmentPartLookupSession.session_pool if there is one
+
+    Configure magicAssessmentPartLookupSessions to this function, instead of
+    to the session class, for the sections to get their sessions from the pool.
+
+    """
+    pool = MagicAssessmentPartLookupSession.session_pool
+    if pool is not None and assessment_section is not None:
+        return pool.get_session(assessment_section, *args, **kwargs)
+    mpls = MagicAssessmentPartLookupSession(assessment_section, *args, **kwargs)
     mpls.use_unsequestered_assessment_part_view()
     mpls.use_federated_bank_view()
-    return mpls.get_assessment_part(part_id)
+    return mpls
+
+
+def get_part_from_magic_part_lookup_session(section, part_id, *args, **kwargs):
+    return get_magic_assessment_part_lookup_session(section, *args, **kwargs).get_assessment_part(part_id)
 
 class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
     """magic assessment part record for scaffold down adaptive questions"""
     _implemented_record_type_identifiers = [
         'scaffold-down'
     ]
+    # look up seen items in the per-agent index (see seen_items.py) instead of
+    # scanning every section of every taken of the agent
+    use_seen_items_index = False
+    # find the candidate items in the objective -> item index (see
+    # objective_item_index.py) instead of querying the Items
+    use_objective_item_index = False
+    # how to pick an unseen item among the candidates (see item_sampling.py):
+    # SHUFFLE_ITEMS, SAMPLE_ITEMS (in MongoDB) or RESERVOIR_ITEMS
+    item_selection_mode = SHUFFLE_ITEMS
+    # a multiprocessing.pool.ThreadPool on which prefetch_next_item selects
+    # items ahead of time (see item_prefetch.py), or None
+    prefetch_pool = None
+    # a multiprocessing.pool.ThreadPool on which to look up the seen items
+    # while the candidate items get queried, or None. Don't share it with
+    # prefetch_pool: a prefetch waiting on its own pool can deadlock
+    query_pool = None
+    # give the randomized MC items of the part a choice order seeded by the
+    # taken id (see choice_order.py), so any process can tell the order a
+    # student got from the taken, instead of a random one
+    use_seeded_choice_orders = False
+
     def __init__(self, *args, **kwargs):
         super(ScaffoldDownAssessmentPartRecord, self).__init__(*args, **kwargs)
         self._magic_identifier = None
         self._assessment_section = None
         self._magic_parent_id = None
+        self._magic_path = None
         self._level = 0
         self._part_map = dict()
         self._child_parts = None
@@ -56,26 +104,35 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
 
     def get_id(self):
         """override get_id to generate our "magic" id that encodes scaffolding information"""
-        waypoint_index = 0
-        if 'waypointIndex' in self.my_osid_object._my_map:
-            waypoint_index = self.my_osid_object._my_map['waypointIndex']
-        magic_identifier = {
-            'level': self._level,
-            'objective_ids': self.my_osid_object._my_map['learningObjectiveIds'],
-            'waypoint_index': waypoint_index
-        }
-        if self._magic_parent_id is not None:
-            magic_identifier['parent_id'] = str(self._magic_parent_id)
-
-        identifier = quote('{0}?{1}'.format(str(self.my_osid_object._my_map['_id']),
-                                            json.dumps(magic_identifier)))
-        return Id(namespace='assessment_authoring.AssessmentPart',
-                  identifier=identifier,
-                  authority=MAGIC_PART_AUTHORITY)
+        magic_path = self._get_magic_path()
+        if magic_path is not None:
+            return get_magic_part_id(str(self.my_osid_object._my_map['_id']), magic_path)
+        return get_legacy_magic_part_id(str(self.my_osid_object._my_map['_id']),
+                                        self._level,
+                                        self.my_osid_object._my_map['learningObjectiveIds'],
+                                        self._get_waypoint_index(),
+                                        self._magic_parent_id)
 
     ident = property(fget=get_id)
     id_ = property(fget=get_id)
 
+    def _get_waypoint_index(self):
+        if 'waypointIndex' in self.my_osid_object._my_map:
+            return self.my_osid_object._my_map['waypointIndex']
+        return 0
+
+    def _get_magic_path(self):
+        """the [waypoint_index, objective_ids] steps from the root part to this part
+
+        Returns None for parts that were created with a legacy magic id, whose
+        descendants keep using legacy ids so their parent ids still match.
+
+        """
+        if self._magic_parent_id is not None and self._magic_path is None:
+            return None
+        my_step = [self._get_waypoint_index(), self.my_osid_object._my_map['learningObjectiveIds']]
+        return (self._magic_path or []) + [my_step]
+
     def initialize(self, magic_identifier, assessment_section):
         """This method is to be called by a magic AssessmentPart lookup session.
         
@@ -84,17 +141,19 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
             level = how many levels deep
             objective_id = the Objective Id to for which to select an item
             waypoint_index = the index of this item in its parent part
+
+        or, for path ids, the path of waypoint indexes and objective ids
+        leading to this part, from which all of the above are derived.
         
         """
-        arg_map = json.loads(unquote(magic_identifier).split('?')[-1], object_pairs_hook=OrderedDict)
+        orig_identifier, arg_map = parse_magic_part_identifier(magic_identifier)
         self._magic_identifier = magic_identifier
         self._assessment_section = assessment_section
-        if 'level' in arg_map:
-            self._level = arg_map['level']
-        else:
-            self._level = 0
-        if 'parent_id' in arg_map:
+        self._level = arg_map['level']
+        if arg_map['parent_id'] is not None:
             self._magic_parent_id = Id(arg_map['parent_id'])
+        if arg_map['path'] is not None:
+            self._magic_path = arg_map['path'][:-1]
         self.my_osid_object._my_map['learningObjectiveIds'] = arg_map['objective_ids']
         self.my_osid_object._my_map['waypointIndex'] = arg_map['waypoint_index']
 
@@ -110,30 +169,231 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
                 self.my_osid_object._my_map['itemIds'] = []
 
     def get_parts(self, parts=None, reference_level=0):
-        """Recursively returns a depth-first list of all known magic parts"""
-        if parts is None:
-            parts = list()
-            new_reference_level = reference_level
-        else:
-            self._level_in_section = self._level + reference_level
-            new_reference_level = self._level_in_section
+        """Returns a depth-first list of all known magic parts
+
+        When given parts, appends this part and then its descendants to it.
+
+        """
+        if parts is not None:
             parts.append(self.my_osid_object)
+            parts.extend(self._walk_parts(self.enter_walk(reference_level)))
+            return parts
+        with timed('magic_parts.get_parts'):
+            parts = self._walk_parts(reference_level)
+        if is_enabled():
+            self._report_walk(parts, reference_level)
+        if self.use_seen_items_index and self._assessment_section is not None:
+            # the section has this part in its list already, if it is new too
+            self._record_seen_items([self.my_osid_object] + parts)
+        return parts
+
+    def _record_seen_items(self, parts):
+        """adds the items of the parts that are new to the section to the
+        agent's seen items index. The section adds their questions, and saves
+        itself, as soon as get_parts returns to it."""
+        section_part_ids = set(part_map['assessmentPartId']
+                               for part_map in self._assessment_section._my_map['assessmentParts'])
+        item_ids = [item_id
+                    for part in parts if str(part.get_id()) not in section_part_ids
+                    for item_id in part._my_map['itemIds']]
+        if item_ids:
+            from .seen_items import add_seen_item_ids
+            add_seen_item_ids(self._assessment_section._assessment_taken.taking_agent_id,
+                              item_ids,
+                              runtime=self.my_osid_object._runtime)
+
+    def _walk_parts(self, reference_level):
+        """all the parts below this one, with the section's answers memoized for the walk"""
+        started_evaluation = (self._assessment_section is not None and
+                              start_scaffold_evaluation(self._assessment_section))
+        try:
+            return list(self.iter_parts(reference_level))
+        finally:
+            if started_evaluation:
+                end_scaffold_evaluation(self._assessment_section)
+
+    def iter_parts(self, reference_level=0):
+        """Lazily yields the known magic parts below this one, depth-first
+
+        Children are only generated once the walk gets to their parent, so
+        stopping early (see get_first_unanswered_part) saves generating the
+        rest of the tree. The walk keeps its own stack, however deep the tree.
+        Callers memoize the section's answers around the walk, with
+        start_scaffold_evaluation and end_scaffold_evaluation.
+
+        """
+        child_iters = [iter(self.get_walk_children())]
+        reference_levels = [reference_level]
+        while child_iters:
+            try:
+                part = next(child_iters[-1])
+            except StopIteration:
+                child_iters.pop()
+                reference_levels.pop()
+                continue
+            level_in_section = part.enter_walk(reference_levels[-1])
+            yield part
+            child_iters.append(iter(part.get_walk_children()))
+            reference_levels.append(level_in_section)
+
+    def enter_walk(self, reference_level):
+        """sets and returns the level of this part in the section, during a walk"""
+        self._level_in_section = self._level + reference_level
+        return self._level_in_section
+
+    def get_walk_children(self):
+        """the child parts, generated if need be, or an empty list"""
         if self._child_parts is None:
             if self.has_magic_children():
                 self.generate_children()
             else:
-                return parts
-        for part in self._child_parts:
-            part.get_parts(parts, new_reference_level)
-            # Don't need to append here, because parts is passed by reference
-            # so appending is redundant
-            # child_parts = part.get_parts(parts, reference_level)
-            # parts += child_parts
-        return parts
+                return []
+        return self._child_parts or []
+
+    def get_first_unanswered_part(self):
+        """the first part below this one, depth-first, whose question hasn't
+        been answered yet, or None. Only walks the tree as far as that part."""
+        started_evaluation = (self._assessment_section is not None and
+                              start_scaffold_evaluation(self._assessment_section))
+        walk = self.iter_parts()
+        try:
+            for part in walk:
+                question_id = self.get_question_id_for_assessment_part(part.get_id())
+                if question_id is None:
+                    # its question hasn't made it into the section yet
+                    return part
+                try:
+                    self._get_section_answers().is_correct(question_id)
+                except IllegalState:
+                    return part
+        finally:
+            walk.close()
+            if started_evaluation:
+                end_scaffold_evaluation(self._assessment_section)
+        return None
+
+    def _report_walk(self, parts, reference_level):
+        """reports the size and depth of a tree walk to the instrumentation"""
+        gauge('magic_parts.get_parts.parts', len(parts))
+        # the walk has just set the level in the section of every part
+        levels = [part._level_in_section for part in parts]
+        gauge('magic_parts.get_parts.depth', max(levels) - reference_level if levels else 0)
 
     def load_item_for_objective(self):
         """if this is the first time for this magic part, find an LO linked item"""
+        with timed('magic_parts.load_item_for_objective'):
+            self._load_item_for_objective()
+
+    def _load_item_for_objective(self):
+        selection = None
+        if self.prefetch_pool is not None:
+            selection = self._pop_prefetched_selection()
+        batch = get_item_selection_batch(self._assessment_section)
+        if batch is not None and batch.seen_item_ids is None:
+            batch.seen_item_ids = self._get_all_seen_item_ids()
+        if selection is None:
+            objective_ids = self.my_osid_object._my_map['learningObjectiveIds']
+            if batch is not None:
+                selection = self._select_item_ids(objective_ids,
+                                                  batch.seen_item_ids,
+                                                  candidate_item_ids=batch.get_candidate_item_ids(
+                                                      self.my_osid_object._my_map['itemBankId'], objective_ids))
+            else:
+                selection = self._select_item_ids(objective_ids)
+        item_ids, unseen = selection
+        self.my_osid_object._my_map['itemIds'] = item_ids
+        if batch is not None:
+            # so the next parts of the batch don't pick it too
+            batch.seen_item_ids.update(item_ids)
+        if item_ids:
+            self.prefetch_next_item()
+
+    def _get_all_seen_item_ids(self, mgr=None, section_snapshot=None):
+        """the item ids in this section, and those the agent has seen before
+
+        section_snapshot is a _get_section_snapshot() to read instead of the
+        section, for callers off the request thread.
+
+        """
+        if mgr is None:
+            mgr = self.my_osid_object._get_provider_manager('ASSESSMENT', local=True)
+        if section_snapshot is None:
+            section_snapshot = self._get_section_snapshot()
+        section_item_ids, taking_agent_id = section_snapshot
+        # let's seed this with the current section's questions
+        seen_items = set(section_item_ids)
+        seen_items.update(self._get_seen_item_ids(mgr, taking_agent_id))
+        return seen_items
+
+    def _get_section_snapshot(self):
+        """the item ids in the section and its taking agent id, which is all
+        that item selection reads from the section"""
+        # dlkit only lists the items of the authored parts in _item_id_list
+        section_item_ids = set(str(item_id) for item_id in self._assessment_section._item_id_list)
+        section_item_ids.update(question_map['itemId']
+                                for question_map in self._assessment_section._my_map['questions'])
+        return frozenset(section_item_ids), self._assessment_section._assessment_taken.taking_agent_id
+
+    def _select_item_ids(self, objective_ids, seen_items=None, section_snapshot=None, candidate_item_ids=None):
+        """picks the item for a part of this part's kind with the given objectives
+
+        Returns the itemIds for the part, and whether the item is unseen.
+        seen_items and candidate_item_ids save looking up the seen and the
+        candidate item ids, if the caller already has them. With
+        section_snapshot instead of the section, it can run off the request
+        thread.
+
+        With query_pool, the seen items get looked up on the pool while the
+        candidate items are queried here. The sampling modes exclude the seen
+        items in the query itself, so they can't overlap the two.
+
+        """
         mgr = self.my_osid_object._get_provider_manager('ASSESSMENT', local=True)
+        pending_seen_items = None
+        if seen_items is None:
+            if self.query_pool is not None and self.item_selection_mode == SHUFFLE_ITEMS:
+                # on its own manager, rather than share this one across threads
+                if section_snapshot is None:
+                    section_snapshot = self._get_section_snapshot()
+                pending_seen_items = self.query_pool.apply_async(self._get_all_seen_item_ids,
+                                                                 (None, section_snapshot))
+            else:
+                seen_items = self._get_all_seen_item_ids(mgr, section_snapshot)
+        if self.item_selection_mode == SHUFFLE_ITEMS:
+            try:
+                if candidate_item_ids is not None:
+                    item_id_list = list(candidate_item_ids)
+                else:
+                    item_id_list = self._get_candidate_item_ids(mgr, objective_ids)
+            finally:
+                if pending_seen_items is not None:
+                    # even if the query failed, so the lookup doesn't outlive
+                    # the request. Its own error is raised by get() below
+                    pending_seen_items.wait()
+            if pending_seen_items is not None:
+                seen_items = pending_seen_items.get()
+            # need to randomly shuffle this item_id_list
+            shuffle(item_id_list)
+            unseen_item_id = None
+            for item_id in item_id_list:
+                if item_id not in seen_items:
+                    unseen_item_id = item_id
+                    break
+            get_repeat_item_id = lambda: item_id_list[0] if item_id_list else None
+        else:
+            unseen_item_id = self._sample_candidate_item_id(mgr, objective_ids, seen_items, candidate_item_ids)
+            get_repeat_item_id = lambda: self._sample_candidate_item_id(mgr, objective_ids,
+                                                                        candidate_item_ids=candidate_item_ids)
+        if unseen_item_id is not None:
+            return [unseen_item_id], True
+        elif self.my_osid_object._my_map['allowRepeatItems']:
+            repeat_item_id = get_repeat_item_id()
+            if repeat_item_id is not None:
+                return [repeat_item_id], False
+        return [], False  # don't put '' here, it will break when it tries to find an item with id ''
+
+    def _get_item_query(self, mgr, objective_ids):
+        """the query session and item query for the objectives"""
         if self.my_osid_object._my_map['itemBankId']:
             item_query_session = mgr.get_item_query_session_for_bank(Id(self.my_osid_object._my_map['itemBankId']),
                                                                      proxy=self.my_osid_object._proxy)
@@ -141,20 +401,146 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
             item_query_session = mgr.get_item_query_session(proxy=self.my_osid_object._proxy)
         item_query_session.use_federated_bank_view()
         item_query = item_query_session.get_item_query()
-        for objective_id_str in self.my_osid_object._my_map['learningObjectiveIds']:
+        for objective_id_str in objective_ids:
             item_query.match_learning_objective_id(Id(objective_id_str), True)
-        item_list = list(item_query_session.get_items_by_query(item_query))
+        return item_query_session, item_query
+
+    def _get_candidate_item_ids(self, mgr, objective_ids):
+        """the id strings of all the items for the objectives"""
+        if self.use_objective_item_index:
+            from .objective_item_index import get_item_ids_for_objectives
+            return get_item_ids_for_objectives(objective_ids,
+                                               runtime=self.my_osid_object._runtime,
+                                               bank_id=self.my_osid_object._my_map['itemBankId'])
+        item_query_session, item_query = self._get_item_query(mgr, objective_ids)
+        return [str(item.ident) for item in item_query_session.get_items_by_query(item_query)]
+
+    def get_candidate_item_ids_by_objective(self, objective_ids):
+        """the candidate item id strings of each of the objectives, for parts
+        of this part's kind, with a single query for all of them. None if
+        item selection wouldn't use them, because it samples in the query."""
+        if self.use_objective_item_index:
+            from .objective_item_index import get_item_ids_by_objective
+            return get_item_ids_by_objective(objective_ids,
+                                             runtime=self.my_osid_object._runtime,
+                                             bank_id=self.my_osid_object._my_map['itemBankId'])
+        if self.item_selection_mode != SHUFFLE_ITEMS:
+            return None
+        mgr = self.my_osid_object._get_provider_manager('ASSESSMENT', local=True)
+        item_query_session, item_query = self._get_item_query(mgr, objective_ids)
+        item_ids = dict((objective_id, []) for objective_id in objective_ids)
+        for item in item_query_session.get_items_by_query(item_query):
+            for objective_id in item._my_map['learningObjectiveIds']:
+                if objective_id in item_ids:
+                    item_ids[objective_id].append(str(item.ident))
+        return item_ids
+
+    def _sample_candidate_item_id(self, mgr, objective_ids, exclude_item_ids=(), candidate_item_ids=None):
+        """a random candidate item id string that is not excluded, or None"""
+        if self.use_objective_item_index:
+            # the index only holds ids, so sampling them here is cheap already
+            if candidate_item_ids is None:
+                candidate_item_ids = self._get_candidate_item_ids(mgr, objective_ids)
+            return reservoir_sample(candidate_item_ids, exclude_item_ids)
+        item_query_session, item_query = self._get_item_query(mgr, objective_ids)
+        if self.item_selection_mode == SAMPLE_ITEMS:
+            return sample_item_id(item_query_session, item_query, exclude_item_ids)
+        return reservoir_sample_item_id(item_query_session, item_query, exclude_item_ids)
+
+    def prefetch_next_item(self):
+        """once this part has its item, starts selecting the item of its first
+        child part on prefetch_pool, for if the item gets answered wrong.
+
+        The child's objective is the one the item's wrong answers confuse, so
+        this only prefetches when they all confuse the same one. The selection
+        gets staged for this part, and the child picks it up in
+        load_item_for_objective if it is ready by then and was made for its
+        objective, and otherwise selects its item as usual. Returns True if a
+        prefetch was started.
+
+        """
+        if self.prefetch_pool is None or self._assessment_section is None:
+            return False
+        if self._child_parts or not self.my_osid_object._my_map['itemIds']:
+            return False
+        if (self.my_osid_object._my_map['maxLevels'] is not None and
+                self.my_osid_object._my_map['maxLevels'] <= self._level):
+            return False
+        section_item_ids, taking_agent_id = self._get_section_snapshot()
+        # the item's question is not in the section yet
+        section_snapshot = (section_item_ids.union(self.my_osid_object._my_map['itemIds']), taking_agent_id)
+        from .item_prefetch import stage_item_selection
+        stage_item_selection(self.prefetch_pool,
+                             self._assessment_section,
+                             self.get_id(),
+                             self._select_child_item_ids,
+                             self.my_osid_object._my_map['itemIds'][0],
+                             section_snapshot)
+        return True
+
+    def _select_child_item_ids(self, item_id, section_snapshot):
+        """the objective ids and _select_item_ids of the first child part, if
+        the item gets answered wrong, or None if that can't be told yet"""
+        mgr = self.my_osid_object._get_provider_manager('ASSESSMENT', local=True)
+        if self.my_osid_object._my_map['itemBankId']:
+            item_lookup_session = mgr.get_item_lookup_session_for_bank(
+                Id(self.my_osid_object._my_map['itemBankId']),
+                proxy=self.my_osid_object._proxy)
+        else:
+            item_lookup_session = mgr.get_item_lookup_session(proxy=self.my_osid_object._proxy)
+        item_lookup_session.use_federated_bank_view()
+        item_map = item_lookup_session.get_item(Id(item_id))._my_map
+        # generate_children only scaffolds the first confused objective
+        objective_ids = set(str(Id(answer['confusedLearningObjectiveIds'][0]))
+                            for answer in item_map.get('answers', [])
+                            if answer.get('confusedLearningObjectiveIds'))
+        if len(objective_ids) != 1:
+            return None
+        objective_ids = list(objective_ids)
+        return objective_ids, self._select_item_ids(objective_ids, section_snapshot=section_snapshot)
+
+    def _pop_prefetched_selection(self):
+        """the selection prefetched for this part by its parent, if it is
+        ready and still usable, else None"""
+        if self._magic_parent_id is None or self._get_waypoint_index() != 0:
+            return None
+        from .item_prefetch import pop_staged_item_selection
+        prefetched = pop_staged_item_selection(self._assessment_section, self._magic_parent_id)
+        if prefetched is None:
+            return None
+        objective_ids, selection = prefetched
+        if objective_ids != self.my_osid_object._my_map['learningObjectiveIds']:
+            # the answer confused another objective
+            return None
+        section_item_ids = self._get_section_snapshot()[0]
+        if selection[1] and str(selection[0][0]) in section_item_ids:
+            # another part got to the prefetched item first
+            return None
+        return selection
+
+    def _get_seen_item_ids(self, mgr, taking_agent_id=None):
+        """the item ids the taking agent has seen in any of their sections
+
+        With use_seen_items_index this is a single lookup in the agent's seen
+        items index, which gets built from the sections the first time.
+
+        """
+        if taking_agent_id is None:
+            taking_agent_id = self._assessment_section._assessment_taken.taking_agent_id
+        if self.use_seen_items_index:
+            from .seen_items import get_seen_item_ids
+            seen_items = get_seen_item_ids(taking_agent_id, runtime=self.my_osid_object._runtime)
+            if seen_items is not None:
+                return seen_items
         # Let's query all takens and their children sections for questions, to
         # remove seen ones
-        taking_agent_id = self._assessment_section._assessment_taken.taking_agent_id
         atqs = mgr.get_assessment_taken_query_session(proxy=self.my_osid_object._proxy)
         atqs.use_federated_bank_view()
         querier = atqs.get_assessment_taken_query()
         querier.match_taking_agent_id(taking_agent_id, match=True)
-        # let's seed this with the current section's questions
-        seen_items = [item_id for item_id in self._assessment_section._item_id_list]
         taken_ids = [str(t.ident)
                      for t in atqs.get_assessments_taken_by_query(querier)]
+        seen_items = set()
         # Try to find the questions directly via Mongo query -- don't do
         # for section in taken._get_assessment_sections():
         #     seen_items += [question['itemId'] for question in section._my_map['questions']]
@@ -165,23 +551,11 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
         results = collection.find({"assessmentTakenId": {"$in": taken_ids}})
         for section in results:
             if 'questions' in section:
-                seen_items += [question['itemId'] for question in section['questions']]
-        unseen_item_id = None
-        # need to randomly shuffle this item_list
-        shuffle(item_list)
-        for item in item_list:
-            if str(item.ident) not in seen_items:
-                unseen_item_id = item.get_id()
-                break
-        if unseen_item_id is not None:
-            self.my_osid_object._my_map['itemIds'] = [str(unseen_item_id)]
-        elif self.my_osid_object._my_map['allowRepeatItems']:
-            if len(item_list) > 0:
-                self.my_osid_object._my_map['itemIds'] = [str(item_list[0].ident)]
-            else:
-                self.my_osid_object._my_map['itemIds'] = []  # don't put '' here, it will break when it tries to find an item with id ''
-        else:
-            self.my_osid_object._my_map['itemIds'] = []  # don't put '' here, it will break when it tries to find an item with id ''
+                seen_items.update(question['itemId'] for question in section['questions'])
+        if self.use_seen_items_index:
+            from .seen_items import set_seen_item_ids
+            set_seen_item_ids(taking_agent_id, seen_items, runtime=self.my_osid_object._runtime)
+        return seen_items
 
     def has_magic_children(self):
         """checks if child parts are currently available for this part"""
@@ -191,8 +565,8 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
             if (self.my_osid_object._my_map['maxLevels'] is None or
                     self.my_osid_object._my_map['maxLevels'] > self._level):
                 try:
-                    section = self._assessment_section
-                    item_id = self.get_my_item_id_from_section(section)
+                    section = self._get_section_answers()
+                    item_id = self.get_my_item_id_from_section(self._assessment_section)
                     if not section.is_correct(item_id) and section.get_confused_learning_objective_ids(item_id).available() > 0:
                         return True
                 except IllegalState:
@@ -215,7 +589,7 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
             if question_id is None:
                 raise OperationFailed
             try:
-                if self._assessment_section.is_correct(question_id):
+                if self._get_section_answers().is_correct(question_id):
                     num_correct += 1
             except IllegalState:
                 pass
@@ -223,12 +597,33 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
             return True
         return False
 
+    def _get_section_answers(self):
+        """the section, or the context memoizing its answers if a walk is in progress"""
+        context = get_scaffold_evaluation_context(self._assessment_section)
+        if context is not None:
+            return context
+        return self._assessment_section
+
     def get_question_id_for_assessment_part(self, assessment_part_id):
-        question_ids = self._assessment_section.get_question_ids_for_assessment_part(assessment_part_id)
+        question_ids = self._get_section_answers().get_question_ids_for_assessment_part(assessment_part_id)
         if not question_ids:
             return None
         return question_ids[0]  # There is only one expected, but this might change
 
+    def _get_child_part_id(self, objective_ids, waypoint_index):
+        """the id of a new child part, a path id unless this part itself has a legacy id"""
+        my_id = self.my_osid_object.get_id()
+        orig_identifier = unquote(my_id.get_identifier()).split('?')[0]
+        my_path = self._get_magic_path()
+        if my_path is not None:
+            return get_magic_part_id(orig_identifier,
+                                     my_path + [[waypoint_index, objective_ids]])
+        return get_legacy_magic_part_id(orig_identifier,
+                                        self._level + 1,
+                                        objective_ids,
+                                        waypoint_index,
+                                        my_id)
+
     def generate_children(self):
         if not self.has_magic_children():
             return
@@ -241,23 +636,14 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
         # Prepare common Id elements for children:
         objective_id = scaffold_objective_ids.next() # Assume just one for now
         my_id = self.my_osid_object.get_id()
-        namespace = 'assessment_authoring.AssessmentPart'
-        level = self._level + 1
-        arg_map = {'parent_id': str(my_id),
-                   'level': level,
-                   'objective_ids': [str(objective_id)]}
-        orig_identifier = unquote(my_id.get_identifier()).split('?')[0]
+        objective_ids = [str(objective_id)]
 
-        # Generate all parts already known to the section:
-        section_part_ids = [p['assessmentPartId'] for p in self._assessment_section._my_map['assessmentParts']]
+        # Generate all parts already known to the section, whatever the form of their ids:
+        child_part_index = get_child_part_index(self._assessment_section)
         for num in range(self._max_waypoints):
-            arg_map['waypoint_index'] = num
-            magic_identifier_part = quote('{0}?{1}'.format(orig_identifier,
-                                                           json.dumps(arg_map)))
-            child_part_id = Id(authority=MAGIC_PART_AUTHORITY,
-                               namespace=namespace,
-                               identifier=magic_identifier_part)
-            if str(child_part_id) in section_part_ids:
+            child_part_id_str = child_part_index.get_child_part_id(my_id, num, objective_ids)
+            if child_part_id_str is not None:
+                child_part_id = Id(child_part_id_str)
                 # First check if the part is already cached in the section:
                 if child_part_id in self._assessment_section._assessment_parts:
                     child_part = self._assessment_section._assessment_parts[child_part_id]
@@ -274,6 +660,7 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
                 break
         if len(self._child_parts) == self._max_waypoints:
             return
+        child_part_id = self._get_child_part_id(objective_ids, len(self._child_parts))
 
         # Check if any child parts are finished. This will force them to generate children too
         # have to inspect the child_parts for waypoint quota, because only checking
@@ -290,7 +677,7 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
                 if question_id is None:
                     raise OperationFailed
                 try:
-                    if self._assessment_section.is_correct(question_id):
+                    if self._get_section_answers().is_correct(question_id):
                         num_correct += 1
                 except IllegalState:
                     num_not_answered += 1
@@ -304,11 +691,10 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
         waypoint_quota_met = (num_correct >= self.my_osid_object._my_map['waypointQuota'])
 
         if not self._child_parts or (should_add_new_sibling and not waypoint_quota_met and num_not_answered == 0):
-            child_part = get_part_from_magic_part_lookup_session(
-                section=self._assessment_section,
-                part_id=child_part_id,
-                runtime=self.my_osid_object._runtime,
-                proxy=self.my_osid_object._proxy)
+            # through the section's own lookup session, which is where the
+            # section gets the part's items from for its question, so the
+            # part only gets initialized, and picks its item, once
+            child_part = self._assessment_section._get_assessment_part(child_part_id)
             self._child_parts.append(child_part)
 
     def get_child_ids(self):
@@ -344,6 +730,24 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
                           proxy=self.my_osid_object._proxy)
         raise IllegalState()
 
+    def get_items(self):
+        """the items of this part, which the section makes its questions of.
+        With use_seeded_choice_orders, they get the choice orders seeded by
+        the section's taken."""
+        ils = get_item_lookup_session(runtime=self.my_osid_object._runtime, proxy=self.my_osid_object._proxy)
+        ils.use_federated_bank_view()
+        items = [ils.get_item(Id(item_id)) for item_id in self.my_osid_object._my_map['itemIds']]
+        if self.use_seeded_choice_orders and self._assessment_section is not None:
+            seed = str(self._assessment_section._assessment_taken.ident)
+            for item in items:
+                try:
+                    item.set_choice_seed(seed)
+                except AttributeError:
+                    pass  # not a randomized MC item
+        return ItemList(items,
+                        runtime=self.my_osid_object._runtime,
+                        proxy=self.my_osid_object._proxy)
+
     def get_learning_objective_ids(self):
         """gets all LO ids associated with this assessment part (should be only one for now)"""
         return IdList(self.my_osid_object._my_map['learningObjectiveIds'],
@@ -364,16 +768,15 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
 
     def get_scaffold_objective_ids(self):
         """Assumes that a scaffold objective id is available"""
-        section = self._assessment_section
-        item_id = self.get_my_item_id_from_section(section)
-        return section.get_confused_learning_objective_ids(item_id)
+        item_id = self.get_my_item_id_from_section(self._assessment_section)
+        return self._get_section_answers().get_confused_learning_objective_ids(item_id)
 
     def get_my_item_id_from_section(self, section):
         """returns the first item associated with this magic Part Id in the Section"""
-        for question_map in section._my_map['questions']:
-            if question_map['assessmentPartId'] == str(self.get_id()):
-                return section.get_question(question_map=question_map).get_id()
-        raise IllegalState('This Part currently has no Item in the Section')
+        item_id = get_question_index(section).get_item_id(section, self.get_id())
+        if item_id is None:
+            raise IllegalState('This Part currently has no Item in the Section')
+        return item_id
 
     def delete(self):
         """need this because the JSONClientValidated cannot deal with the magic identifier"""
@@ -390,6 +793,18 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
             return bool(self.my_osid_object._my_map['assessmentPartId'])
         return True
 
+    def update_assessment_section(self, assessment_section, structure_changed=True):
+        """rebinds the part to a newer copy of its section
+
+        The child parts depend on the section's parts and responses, so if
+        those changed they get generated again on the next walk, from the
+        parts already in the section.
+
+        """
+        self._assessment_section = assessment_section
+        if structure_changed:
+            self._child_parts = None
+
     def get_assessment_part_id(self):
         if self._magic_parent_id is None:
             return Id(self.my_osid_object._my_map['assessmentPartId'])
@@ -418,6 +833,122 @@ class ScaffoldDownAssessmentPartRecord(ObjectInitRecord):
         return apls.get_assessment_part(assessment_part_id)
 
 
+_SCAFFOLD_DOWN_METADATA = {}
+
+
+def _get_scaffold_down_metadata(authority, namespace):
+    """the metadata definitions of the scaffold-down part form fields, shared
+    by all the forms with the same authority and namespace"""
+    key = (authority, namespace)
+    if key not in _SCAFFOLD_DOWN_METADATA:
+        _SCAFFOLD_DOWN_METADATA[key] = {
+            'item_ids': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'item'),
+                'element_label': 'Item',
+                'instructions': 'accepts an Item id',
+                'required': False,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_id_values': [''],
+                'syntax': 'ID',
+                'id_set': []
+            },
+            'learning_objective_ids': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'learning-objective'),
+                'element_label': 'Learning Objective',
+                'instructions': 'accepts a Learning Objective id',
+                'required': False,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_id_values': [''],
+                'syntax': 'ID',
+                'id_set': []
+            },
+            'max_levels': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'max-levels'),
+                'element_label': 'Max Levels',
+                'instructions': 'accepts an integer value',
+                'required': True,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_cardinal_values': [None],
+                'syntax': 'CARDINAL',
+                'minimum_cardinal': 0,
+                'maximum_cardinal': None,
+                'cardinal_set': []
+            },
+            'max_waypoint_items': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'max-waypoint-items'),
+                'element_label': 'Max Waypoint Items',
+                'instructions': 'accepts an integer value',
+                'required': True,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_cardinal_values': [None],
+                'syntax': 'CARDINAL',
+                'minimum_cardinal': 0,
+                'maximum_cardinal': None,
+                'cardinal_set': []
+            },
+            'waypoint_quota': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'waypoint-quota'),
+                'element_label': 'Waypoint Quota',
+                'instructions': 'accepts an integer value',
+                'required': True,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_cardinal_values': [0],
+                'syntax': 'CARDINAL',
+                'minimum_cardinal': 0,
+                'maximum_cardinal': None,
+                'cardinal_set': []
+            },
+            'item_bank_id': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'item-bank'),
+                'element_label': 'Item Bank',
+                'instructions': 'accepts an assessment Bank Id',
+                'required': False,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_id_values': [''],
+                'syntax': 'ID',
+                'id_set': []
+            },
+            'allow_repeat_items': {
+                'element_id': Id(authority,
+                                 namespace,
+                                 'allow-repeat-items'),
+                'element_label': 'Allow Repeat Items',
+                'instructions': 'accepts a boolean value',
+                'required': True,
+                'read_only': False,
+                'linked': False,
+                'array': False,
+                'default_boolean_values': [True],
+                'syntax': 'BOOLEAN'
+            }
+        }
+    return _SCAFFOLD_DOWN_METADATA[key]
+
+
 class ScaffoldDownAssessmentPartFormRecord(abc_assessment_authoring_records.AssessmentPartFormRecord,
                                            osid_records.OsidRecord):
     """magic assessment part form record for scaffold down adaptive assessments"""
@@ -435,109 +966,15 @@ class ScaffoldDownAssessmentPartFormRecord(abc_assessment_authoring_records.Asse
         super(ScaffoldDownAssessmentPartFormRecord, self).__init__()
 
     def _init_metadata(self):
-        self._item_ids_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'item'),
-            'element_label': 'Item',
-            'instructions': 'accepts an Item id',
-            'required': False,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_id_values': [''],
-            'syntax': 'ID',
-            'id_set': []
-        }
-        self._learning_objective_ids_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'learning-objective'),
-            'element_label': 'Learning Objective',
-            'instructions': 'accepts a Learning Objective id',
-            'required': False,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_id_values': [''],
-            'syntax': 'ID',
-            'id_set': []
-        }
-        self._max_levels_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'max-levels'),
-            'element_label': 'Max Levels',
-            'instructions': 'accepts an integer value',
-            'required': True,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_cardinal_values': [None],
-            'syntax': 'CARDINAL',
-            'minimum_cardinal': 0,
-            'maximum_cardinal': None,
-            'cardinal_set': []
-        }
-        self._max_waypoint_items_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'max-waypoint-items'),
-            'element_label': 'Max Waypoint Items',
-            'instructions': 'accepts an integer value',
-            'required': True,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_cardinal_values': [None],
-            'syntax': 'CARDINAL',
-            'minimum_cardinal': 0,
-            'maximum_cardinal': None,
-            'cardinal_set': []
-        }
-        self._waypoint_quota_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'waypoint-quota'),
-            'element_label': 'Waypoint Quota',
-            'instructions': 'accepts an integer value',
-            'required': True,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_cardinal_values': [0],
-            'syntax': 'CARDINAL',
-            'minimum_cardinal': 0,
-            'maximum_cardinal': None,
-            'cardinal_set': []
-        }
-        self._item_bank_id_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'item-bank'),
-            'element_label': 'Item Bank',
-            'instructions': 'accepts an assessment Bank Id',
-            'required': False,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_id_values': [''],
-            'syntax': 'ID',
-            'id_set': []
-        }
-        self._allow_repeat_items_metadata = {
-            'element_id': Id(self.my_osid_object_form._authority,
-                             self.my_osid_object_form._namespace,
-                             'allow-repeat-items'),
-            'element_label': 'Allow Repeat Items',
-            'instructions': 'accepts a boolean value',
-            'required': True,
-            'read_only': False,
-            'linked': False,
-            'array': False,
-            'default_boolean_values': [True],
-            'syntax': 'BOOLEAN'
-        }
+        metadata = _get_scaffold_down_metadata(self.my_osid_object_form._authority,
+                                               self.my_osid_object_form._namespace)
+        self._item_ids_metadata = metadata['item_ids']
+        self._learning_objective_ids_metadata = metadata['learning_objective_ids']
+        self._max_levels_metadata = metadata['max_levels']
+        self._max_waypoint_items_metadata = metadata['max_waypoint_items']
+        self._waypoint_quota_metadata = metadata['waypoint_quota']
+        self._item_bank_id_metadata = metadata['item_bank_id']
+        self._allow_repeat_items_metadata = metadata['allow_repeat_items']
 
     def _init_map(self):
         """stub"""
@@ -622,7 +1059,8 @@ class ScaffoldDownAssessmentPartFormRecord(abc_assessment_authoring_records.Asse
     def set_max_levels(self, max_levels):
         if self.get_max_levels_metadata().is_read_only():
             raise NoAccess()
-        if not self.my_osid_object_form._is_valid_cardinal(max_levels):
+        if not self.my_osid_object_form._is_valid_cardinal(max_levels,
+                                                           self.get_max_levels_metadata()):
             raise InvalidArgument()
         self.my_osid_object_form._my_map['maxLevels'] = max_levels
  
@@ -721,31 +1159,87 @@ class ScaffoldDownAssessmentPartFormRecord(abc_assessment_authoring_records.Asse
             bool(self._allow_repeat_items_metadata['default_boolean_values'][0])
 
 
+class ScaffoldDownAssessmentPartAdminSession(AssessmentPartAdminSession):
+    """adds bulk creation of scaffold-down parts, for course imports"""
+    _part_spec_setters = [
+        ('learning_objective_ids', 'set_learning_objective_ids'),
+        ('item_bank_id', 'set_item_bank_id'),
+        ('max_levels', 'set_max_levels'),
+        ('max_waypoint_items', 'set_max_waypoint_items'),
+        ('waypoint_quota', 'set_waypoint_quota'),
+        ('allow_repeat_items', 'set_allow_repeat_items')
+    ]
+
+    def create_scaffold_down_assessment_parts(self, assessment_id, part_specs):
+        """creates a scaffold-down part in the assessment for each spec
+
+        A spec is a dict with any of learning_objective_ids, item_bank_id,
+        max_levels, max_waypoint_items, waypoint_quota and allow_repeat_items.
+        All the specs are validated before any part gets written, and then
+        each part goes through create_assessment_part_for_assessment, which
+        adds it to the assessment's child sequence. Returns the parts as read
+        back from the database.
+
+        """
+        part_specs = list(part_specs)
+        spec_keys = set(key for key, setter in self._part_spec_setters)
+        forms = []
+        for part_spec in part_specs:
+            unknown_keys = set(part_spec) - spec_keys
+            if unknown_keys:
+                raise InvalidArgument('unknown part spec keys: {0}'.format(', '.join(sorted(unknown_keys))))
+            form = self.get_assessment_part_form_for_create_for_assessment(assessment_id,
+                                                                           [SCAFFOLD_DOWN_RECORD_TYPE])
+            for key, setter in self._part_spec_setters:
+                if key in part_spec:
+                    getattr(form, setter)(part_spec[key])
+            if not form.is_valid():
+                raise InvalidArgument('one or more of the form elements is invalid')
+            forms.append(form)
+        part_list = [self.create_assessment_part_for_assessment(form) for form in forms]
+        return AssessmentPartList(part_list, runtime=self._runtime, proxy=self._proxy)
+
+
 class MagicAssessmentPartLookupSession(AssessmentPartLookupSession):
-    """This magic session should be used for getting magic AssessmentParts"""
+    """This magic session should be used for getting magic AssessmentParts
+
+    Set session_pool to a MagicAssessmentPartLookupSessionPool to reuse the
+    sessions, and the magic parts they have initialized, across requests.
+    Sections only get their sessions from the pool through
+    get_magic_assessment_part_lookup_session.
+    """
+    session_pool = None
 
     def __init__(self, assessment_section=None, *args, **kwargs):
         super(MagicAssessmentPartLookupSession, self).__init__(*args, **kwargs)
         self._my_assessment_section = assessment_section
+        self._section_version = None
+        if assessment_section is not None:
+            self._section_version = get_section_version(assessment_section)
         self._magic_parts = {}
 
     def update_section(self, assessment_section):
         # because we are now caching this lookup session in the AssessmentSession,
         #   in order to check the right seen_items for each magic part, we need to
         #   pass the parts an updated section...
+        if assessment_section is self._my_assessment_section:
+            # the section hands itself in on every use of the session
+            return
+        section_version = get_section_version(assessment_section)
+        structure_changed = section_version != self._section_version
         self._my_assessment_section = assessment_section
-        for part in self._magic_parts:
-            part._assessment_section = assessment_section
+        self._section_version = section_version
+        for part_id, part in self._magic_parts.items():
+            if part_id.get_authority() == MAGIC_PART_AUTHORITY:
+                part.update_assessment_section(assessment_section, structure_changed)
 
     def get_assessment_part(self, assessment_part_id):
         authority = assessment_part_id.get_authority()
+        count_cache_lookup('magic_parts.magic_parts', assessment_part_id in self._magic_parts)
         if assessment_part_id not in self._magic_parts:
             if authority == MAGIC_PART_AUTHORITY:
-                magic_identifier = unquote(assessment_part_id.identifier)
-                orig_identifier = magic_identifier.split('?')[0]
-                assessment_part = super(MagicAssessmentPartLookupSession, self).get_assessment_part(assessment_part_id=Id(authority=self._catalog.ident.authority,
-                                                                                                                          namespace=assessment_part_id.get_identifier_namespace(),
-                                                                                                                          identifier=orig_identifier))
+                assessment_part = super(MagicAssessmentPartLookupSession, self).get_assessment_part(
+                    assessment_part_id=self._get_original_part_id(assessment_part_id))
                 # should a magic assessment part's parent be the original part?
                 # Or that original part's parent?
                 assessment_part.initialize(assessment_part_id.identifier, self._my_assessment_section)
@@ -756,12 +1250,163 @@ class MagicAssessmentPartLookupSession(AssessmentPartLookupSession):
         else:
             return self._magic_parts[assessment_part_id]
 
+    def _get_original_part_id(self, assessment_part_id):
+        if assessment_part_id.get_authority() != MAGIC_PART_AUTHORITY:
+            return assessment_part_id
+        orig_identifier = unquote(assessment_part_id.identifier).split('?')[0]
+        return Id(authority=self._catalog.ident.authority,
+                  namespace=assessment_part_id.get_identifier_namespace(),
+                  identifier=orig_identifier)
+
+    def _load_candidate_item_ids(self, magic_parts):
+        """loads the candidate items of the magic parts that don't have an
+        item in the section yet into the item selection batch, with one query
+        per item bank for all their objectives"""
+        batch = get_item_selection_batch(self._my_assessment_section)
+        if batch is None:
+            return
+        question_index = get_question_index(self._my_assessment_section)
+        objective_ids_by_bank = OrderedDict()
+        for assessment_part_id, assessment_part in magic_parts:
+            if question_index.get_question_map(assessment_part_id) is not None:
+                # it gets its item from the section
+                continue
+            objective_ids = parse_magic_part_identifier(assessment_part_id.identifier)[1]['objective_ids']
+            if objective_ids == ['']:
+                continue
+            item_bank_id = assessment_part._my_map['itemBankId']
+            if item_bank_id not in objective_ids_by_bank:
+                objective_ids_by_bank[item_bank_id] = (assessment_part, OrderedDict())
+            objective_ids_by_bank[item_bank_id][1].update((objective_id, None) for objective_id in objective_ids)
+        for item_bank_id, (assessment_part, objective_ids) in objective_ids_by_bank.items():
+            item_ids_by_objective = assessment_part.get_candidate_item_ids_by_objective(list(objective_ids))
+            if item_ids_by_objective is not None:
+                batch.add_candidate_item_ids(item_bank_id, item_ids_by_objective)
+
     def get_assessment_parts_by_ids(self, assessment_part_ids):
-        part_list = []
+        """gets all the uncached parts with a single query, then initializes the magic ones
+
+        Magic ids of sibling waypoints point to the same original part, so
+        each one gets its own part built from the original's map. The parts
+        are initialized together, sharing the seen items of the section, and
+        the candidate items of the ones that still need an item are queried
+        once for all of them.
+
+        """
+        assessment_part_ids = list(assessment_part_ids)
+        uncached = OrderedDict()
+        lookup_ids = []
         for assessment_part_id in assessment_part_ids:
-            try:
-                part_list.append(self.get_assessment_part(assessment_part_id))
-            except NotFound:
-                # sequestered?
-                pass
+            count_cache_lookup('magic_parts.magic_parts', assessment_part_id in self._magic_parts)
+            if assessment_part_id in self._magic_parts or assessment_part_id in uncached:
+                continue
+            original_part_id = self._get_original_part_id(assessment_part_id)
+            uncached[assessment_part_id] = original_part_id
+            if original_part_id not in lookup_ids:
+                lookup_ids.append(original_part_id)
+
+        part_maps = {}
+        if lookup_ids:
+            for part in super(MagicAssessmentPartLookupSession, self).get_assessment_parts_by_ids(lookup_ids):
+                # not part.ident, which scaffold records turn into a magic id
+                part_maps[str(part._my_map['_id'])] = part._my_map
+
+        started_batch = start_item_selection_batch(self._my_assessment_section)
+        try:
+            magic_parts = []
+            for assessment_part_id, original_part_id in uncached.items():
+                if original_part_id.identifier not in part_maps:
+                    # sequestered?
+                    continue
+                assessment_part = AssessmentPart(osid_object_map=deepcopy(part_maps[original_part_id.identifier]),
+                                                 runtime=self._runtime,
+                                                 proxy=self._proxy)
+                if assessment_part_id.get_authority() == MAGIC_PART_AUTHORITY:
+                    magic_parts.append((assessment_part_id, assessment_part))
+                else:
+                    self._magic_parts[assessment_part_id] = assessment_part
+            self._load_candidate_item_ids(magic_parts)
+            for assessment_part_id, assessment_part in magic_parts:
+                assessment_part.initialize(assessment_part_id.identifier, self._my_assessment_section)
+                self._magic_parts[assessment_part_id] = assessment_part
+        finally:
+            if started_batch:
+                end_item_selection_batch(self._my_assessment_section)
+
+        part_list = [self._magic_parts[assessment_part_id]
+                     for assessment_part_id in assessment_part_ids
+                     if assessment_part_id in self._magic_parts]
         return AssessmentPartList(part_list, runtime=self._runtime, proxy=self._proxy)
+
+
+class MagicAssessmentPartLookupSessionPool(object):
+    """long-lived MagicAssessmentPartLookupSessions, per AssessmentTaken
+
+    Each section of a taken gets its own session per effective agent, which
+    is rebound to the newest copy of the section whenever it is handed out
+    again. The pool holds the sessions of at most max_takens takens, for ttl
+    seconds since the taken's first session. Every sweep_interval seconds,
+    handing out a session first drops the sessions of all the takens that
+    have been finished since, with a single query.
+
+    A session isn't meant for concurrent requests of the same taken.
+    """
+    def __init__(self, max_takens=1000, ttl=1800, sweep_interval=60):
+        self._takens = LRUCache(max_entries=max_takens, ttl=ttl)
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    def get_session(self, assessment_section, *args, **kwargs):
+        if time.time() >= self._next_sweep:
+            self.evict_finished_takens(assessment_section._runtime)
+        taken = assessment_section._assessment_taken
+        taken_key = str(taken.get_id())
+        if taken.has_ended():
+            self.evict(taken_key)
+            session = MagicAssessmentPartLookupSession(assessment_section, *args, **kwargs)
+            session.use_unsequestered_assessment_part_view()
+            session.use_federated_bank_view()
+            return session
+
+        # the session and its parts keep the proxy they were created with
+        session_key = (str(assessment_section.get_id()),
+                       str(kwargs.get('catalog_id')),
+                       str(get_effective_agent_id_with_proxy(kwargs.get('proxy'))))
+        with self._lock:
+            sessions = self._takens.get(taken_key)
+            if sessions is None:
+                sessions = {}
+                self._takens.set(taken_key, sessions)
+            session = sessions.get(session_key)
+            count_cache_lookup('magic_parts.session_pool', session is not None)
+            if session is None:
+                session = MagicAssessmentPartLookupSession(assessment_section, *args, **kwargs)
+                session.use_unsequestered_assessment_part_view()
+                session.use_federated_bank_view()
+                sessions[session_key] = session
+                return session
+        session.update_section(assessment_section)
+        return session
+
+    def evict(self, assessment_taken_id):
+        """drops the sessions of the taken, e.g. when it is finished"""
+        self._takens.pop(str(assessment_taken_id))
+
+    def evict_finished_takens(self, runtime):
+        """drops the sessions of the takens that have been finished"""
+        self._next_sweep = time.time() + self._sweep_interval
+        taken_keys = dict((Id(taken_key).identifier, taken_key) for taken_key in self._takens.keys())
+        if not taken_keys:
+            return
+        collection = JSONClientValidated('assessment',
+                                         collection='AssessmentTaken',
+                                         runtime=runtime)
+        finished_takens = collection.raw().find({'_id': {'$in': [ObjectId(identifier) for identifier in taken_keys]},
+                                                 'completionTime': {'$ne': None}},
+                                                {'_id': 1})
+        for taken_map in finished_takens:
+            self.evict(taken_keys[str(taken_map['_id'])])
+
+    def clear(self):
+        self._takens.clear()
@@ -0,0 +1,40 @@
+"""
+Staging of item selections made ahead of time for scaffold parts.
+
+Once a part has its item, it can start selecting the item of its first child
+part on a worker pool, for if the item gets answered wrong (see
+prefetch_next_item). The pending selection is staged here, keyed on the
+section and the part id, because the child part usually only gets created in
+a later request.
+
+The child only takes a selection that has finished by the time it needs
+one, so there is never any waiting: anything else falls back to selecting
+the item right away.
+
+The staged selections live in this process only: a request served by another
+process doesn't see them, and selects its item right away.
+"""
+from ..utilities import LRUCache
+
+# selections that are never picked up expire, e.g. when the student leaves or
+# answers right
+staged_selections = LRUCache(max_entries=10000, ttl=600)
+
+
+def _get_key(section, assessment_part_id):
+    return str(section.get_id()), str(assessment_part_id)
+
+
+def stage_item_selection(pool, section, assessment_part_id, select, *args):
+    """runs select(*args) on the pool and stages its result for the part"""
+    staged_selections.set(_get_key(section, assessment_part_id),
+                          pool.apply_async(select, args))
+
+
+def pop_staged_item_selection(section, assessment_part_id):
+    """the staged selection for the part, if it has finished successfully,
+    else None. Either way it is unstaged."""
+    result = staged_selections.pop(_get_key(section, assessment_part_id))
+    if result is None or not result.ready() or not result.successful():
+        return None
+    return result.get()
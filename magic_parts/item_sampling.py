@@ -0,0 +1,107 @@
+"""
+Picks one random item among the candidates of a scaffold part, without
+building an Item for, or shuffling, every candidate.
+
+SAMPLE_ITEMS lets MongoDB do it: an aggregation that matches the item query,
+drops the excluded ids with $nin and picks one with $sample.
+
+RESERVOIR_ITEMS streams only the candidate ids and reservoir-samples the ones
+that aren't excluded, so it works anywhere, in constant memory.
+"""
+from random import randrange
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from dlkit.json_.assessment.objects import Item
+from dlkit.json_.utilities import JSONClientValidated
+from dlkit.primordium.id.primitives import Id
+
+SHUFFLE_ITEMS = 'shuffle'
+SAMPLE_ITEMS = 'sample'
+RESERVOIR_ITEMS = 'reservoir'
+
+
+def reservoir_sample(values, exclude=()):
+    """a uniformly random value that is not in exclude, or None, in one pass"""
+    sample = None
+    num_seen = 0
+    for value in values:
+        if value in exclude:
+            continue
+        num_seen += 1
+        if randrange(num_seen) == 0:
+            sample = value
+    return sample
+
+
+def _get_query_terms(item_query_session, item_query):
+    """the MongoDB query that get_items_by_query runs for the item query"""
+    and_list = []
+    for term, value in item_query._query_terms.items():
+        if '$in' in value and '$nin' in value:
+            and_list.append({'$or': [{term: {'$in': value['$in']}},
+                                     {term: {'$nin': value['$nin']}}]})
+        else:
+            and_list.append({term: value})
+    or_list = [{term: value} for term, value in item_query._keyword_terms.items()]
+    if or_list:
+        and_list.append({'$or': or_list})
+    view_filter = item_query_session._view_filter()
+    if view_filter:
+        and_list.append(view_filter)
+    if not and_list:
+        return None
+    return {'$and': and_list}
+
+
+def _get_object_ids(item_ids):
+    object_ids = []
+    for item_id in item_ids:
+        try:
+            object_ids.append(ObjectId(Id(item_id).identifier))
+        except (InvalidId, TypeError):
+            # magic and foreign ids can't match an Item _id anyway
+            continue
+    return object_ids
+
+
+def _get_item_id_str(item_query_session, item_map):
+    return str(Item(osid_object_map=item_map,
+                    runtime=item_query_session._runtime,
+                    proxy=item_query_session._proxy).ident)
+
+
+def sample_item_id(item_query_session, item_query, exclude_item_ids=()):
+    """a random item id string matching the query, but not excluded,
+    or None. It takes a single aggregation whatever the number of items."""
+    query_terms = _get_query_terms(item_query_session, item_query)
+    if query_terms is None:
+        return None
+    exclude = _get_object_ids(exclude_item_ids)
+    if exclude:
+        query_terms = {'$and': [query_terms, {'_id': {'$nin': exclude}}]}
+    collection = JSONClientValidated('assessment',
+                                     collection='Item',
+                                     runtime=item_query_session._runtime)
+    for item_map in collection.raw().aggregate([{'$match': query_terms},
+                                                {'$sample': {'size': 1}}]):
+        return _get_item_id_str(item_query_session, item_map)
+    return None
+
+
+def reservoir_sample_item_id(item_query_session, item_query, exclude_item_ids=()):
+    """like sample_item_id, but streams the matching _ids and samples them here.
+    Only the picked item is read in full."""
+    query_terms = _get_query_terms(item_query_session, item_query)
+    if query_terms is None:
+        return None
+    exclude = set(_get_object_ids(exclude_item_ids))
+    collection = JSONClientValidated('assessment',
+                                     collection='Item',
+                                     runtime=item_query_session._runtime)
+    object_id = reservoir_sample((item_map['_id'] for item_map in collection.raw().find(query_terms, {'_id': 1})),
+                                 exclude)
+    if object_id is None:
+        return None
+    return _get_item_id_str(item_query_session, collection.find_one({'_id': object_id}))
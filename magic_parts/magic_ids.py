@@ -0,0 +1,89 @@
+"""
+Encoding of the scaffolding information carried in magic assessment part ids.
+
+Root parts (level 0) have ids like
+    <part>?{"level": 0, "objective_ids": [...], "waypoint_index": 0}
+
+Legacy child ids embed the full id of their parent, which is quoted again at
+every level, so they grow much faster than linearly with the depth:
+    <part>?{"level": 2, "objective_ids": [...], "waypoint_index": 1, "parent_id": "<parent id>"}
+
+Path ids instead list the waypoint index and objective ids of every part from
+the root down to the part itself, so each level adds a bounded amount:
+    <part>?{"path": [[0, [<root objective>]], [0, [<objective>]], [1, [<objective>]]]}
+
+The parent of a path id is the same path without its last step.
+"""
+import json
+
+from urllib import quote, unquote
+
+from dlkit.primordium.id.primitives import Id
+
+from ..instrumentation import increment
+
+MAGIC_PART_AUTHORITY = 'magic-part-authority'
+MAGIC_PART_NAMESPACE = 'assessment_authoring.AssessmentPart'
+
+
+def get_legacy_magic_part_id(original_identifier, level, objective_ids, waypoint_index, parent_id=None):
+    """builds a magic part id that embeds its parent id"""
+    increment('magic_ids.part.encode')
+    magic_identifier = {
+        'level': level,
+        'objective_ids': objective_ids,
+        'waypoint_index': waypoint_index
+    }
+    if parent_id is not None:
+        magic_identifier['parent_id'] = str(parent_id)
+
+    identifier = quote('{0}?{1}'.format(original_identifier,
+                                        json.dumps(magic_identifier)))
+    return Id(namespace=MAGIC_PART_NAMESPACE,
+              identifier=identifier,
+              authority=MAGIC_PART_AUTHORITY)
+
+
+def get_magic_part_id(original_identifier, path):
+    """builds a magic part id from the path of [waypoint_index, objective_ids]
+    steps leading from the root part to the part"""
+    if len(path) == 1:
+        # root parts keep their original form, so existing sections still match
+        waypoint_index, objective_ids = path[0]
+        return get_legacy_magic_part_id(original_identifier, 0, objective_ids, waypoint_index)
+    increment('magic_ids.part.encode')
+    identifier = quote('{0}?{1}'.format(original_identifier,
+                                        json.dumps({'path': path}, separators=(',', ':'))))
+    return Id(namespace=MAGIC_PART_NAMESPACE,
+              identifier=identifier,
+              authority=MAGIC_PART_AUTHORITY)
+
+
+def parse_magic_part_identifier(magic_identifier):
+    """returns the original part identifier and the decoded scaffolding arguments
+
+    The arguments always include level, objective_ids, waypoint_index and
+    parent_id (an id string, or None for root parts). path is the list of
+    steps for path ids, and None for root and legacy ids.
+
+    """
+    increment('magic_ids.part.decode')
+    original_identifier, _, payload = unquote(magic_identifier).partition('?')
+    arg_map = json.loads(payload)
+    if 'path' in arg_map:
+        path = arg_map['path']
+        waypoint_index, objective_ids = path[-1]
+        return original_identifier, {
+            'level': len(path) - 1,
+            'objective_ids': objective_ids,
+            'waypoint_index': waypoint_index,
+            'parent_id': str(get_magic_part_id(original_identifier, path[:-1])),
+            'path': path
+        }
+    return original_identifier, {
+        'level': arg_map.get('level', 0),
+        'objective_ids': arg_map['objective_ids'],
+        'waypoint_index': arg_map['waypoint_index'],
+        'parent_id': arg_map.get('parent_id'),
+        'path': None
+    }
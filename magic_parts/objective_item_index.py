@@ -0,0 +1,152 @@
+"""
+Inverted index from learning objective to the items that match it, per bank,
+for scaffold item selection.
+
+There is one document per (bank, objective), keyed '<bank id>|<objective id>',
+listing the ids of the items assigned to that bank or to any bank below it.
+So finding the candidate items for an objective in the federated view of a
+bank is a single _id lookup. Every item is also listed under ALL_BANKS, for
+parts that have no item bank.
+
+The index is kept current by RandomizedMCItemAdminSession when its
+maintain_objective_item_index is set. Changes it can't see, like items
+being assigned to other banks or banks being moved in the hierarchy, are
+picked up by rebuild_objective_item_index.
+"""
+from collections import OrderedDict
+
+from pymongo import ReplaceOne
+
+from dlkit.abstract_osid.osid.errors import NotFound
+from dlkit.json_.assessment.objects import Item
+from dlkit.json_.utilities import JSONClientValidated
+from dlkit.primordium.id.primitives import Id
+
+OBJECTIVE_ITEM_INDEX_COLLECTION = 'ObjectiveItemIndex'
+ALL_BANKS = '*'
+
+
+def _get_index_collection(runtime):
+    return JSONClientValidated('assessment',
+                               collection=OBJECTIVE_ITEM_INDEX_COLLECTION,
+                               runtime=runtime)
+
+
+def _get_key(bank_id, objective_id):
+    return '{0}|{1}'.format(bank_id, objective_id)
+
+
+def get_bank_ids_with_ancestors(bank_ids, hierarchy_session):
+    """returns the id strings of the banks and of all the banks above them"""
+    found = set()
+    pending = [str(bank_id) for bank_id in bank_ids]
+    while pending:
+        bank_id = pending.pop()
+        if bank_id in found:
+            continue
+        found.add(bank_id)
+        try:
+            parent_ids = hierarchy_session.get_parent_bank_ids(Id(bank_id))
+        except NotFound:
+            # not in the hierarchy
+            continue
+        pending += [str(parent_id) for parent_id in parent_ids]
+    return found
+
+
+def _get_index_keys(item_map, bank_ids):
+    keys = set()
+    for objective_id in item_map.get('learningObjectiveIds', []):
+        if not objective_id:
+            continue
+        keys.add(_get_key(ALL_BANKS, objective_id))
+        for bank_id in bank_ids:
+            keys.add(_get_key(bank_id, objective_id))
+    return keys
+
+
+def get_item_ids_for_objectives(objective_ids, runtime, bank_id=None):
+    """returns the id strings of the items that match any of the objectives,
+    in the federated view of the bank, or of all banks if there is none"""
+    if not bank_id:
+        bank_id = ALL_BANKS
+    keys = [_get_key(bank_id, objective_id) for objective_id in objective_ids]
+    item_ids = []
+    for index_map in _get_index_collection(runtime).find({'_id': {'$in': keys}}):
+        item_ids += index_map['itemIds']
+    if len(keys) > 1:
+        # an item can match several of the objectives
+        item_ids = list(OrderedDict.fromkeys(item_ids))
+    return item_ids
+
+
+def get_item_ids_by_objective(objective_ids, runtime, bank_id=None):
+    """returns the id strings of the items of each of the objectives, like
+    get_item_ids_for_objectives, with a single lookup for all of them"""
+    if not bank_id:
+        bank_id = ALL_BANKS
+    objective_ids_by_key = dict((_get_key(bank_id, objective_id), objective_id) for objective_id in objective_ids)
+    item_ids = dict((objective_id, []) for objective_id in objective_ids)
+    for index_map in _get_index_collection(runtime).find({'_id': {'$in': list(objective_ids_by_key)}}):
+        item_ids[objective_ids_by_key[index_map['_id']]] = index_map['itemIds']
+    return item_ids
+
+
+def unindex_item(item_id, runtime):
+    _get_index_collection(runtime).raw().update_many({'itemIds': str(item_id)},
+                                                     {'$pull': {'itemIds': str(item_id)}})
+
+
+def index_item(item, hierarchy_session, runtime):
+    """(re-)indexes an item under its current objectives and banks"""
+    item_id = str(item.ident)
+    unindex_item(item_id, runtime)
+    bank_ids = get_bank_ids_with_ancestors(item._my_map.get('assignedBankIds', []),
+                                           hierarchy_session)
+    collection = _get_index_collection(runtime).raw()
+    for key in _get_index_keys(item._my_map, bank_ids):
+        collection.update_one({'_id': key},
+                              {'$addToSet': {'itemIds': item_id}},
+                              upsert=True)
+
+
+def rebuild_objective_item_index(hierarchy_session, runtime, proxy=None, dry_run=False):
+    """checks the index against the Item collection and rewrites it if needed.
+
+    Returns a report of the keys that were missing, stale (listing different
+    items) or orphaned (no longer matching any item). With dry_run the index
+    is only checked. Otherwise only those keys get written or deleted, so
+    the index stays usable while it is being rewritten.
+
+    """
+    items = JSONClientValidated('assessment',
+                                collection='Item',
+                                runtime=runtime)
+    ancestors = {}
+    expected = {}
+    for item_map in items.find({}):
+        item_id = str(Item(osid_object_map=item_map, runtime=runtime, proxy=proxy).ident)
+        bank_ids = set()
+        for bank_id in item_map.get('assignedBankIds', []):
+            if bank_id not in ancestors:
+                ancestors[bank_id] = get_bank_ids_with_ancestors([bank_id], hierarchy_session)
+            bank_ids.update(ancestors[bank_id])
+        for key in _get_index_keys(item_map, bank_ids):
+            expected.setdefault(key, set()).add(item_id)
+
+    collection = _get_index_collection(runtime)
+    actual = dict((index_map['_id'], set(index_map['itemIds'])) for index_map in collection.find({}))
+    report = {
+        'missing': sorted(key for key in expected if key not in actual),
+        'stale': sorted(key for key in expected if key in actual and actual[key] != expected[key]),
+        'orphaned': sorted(key for key in actual if key not in expected)
+    }
+    if not dry_run:
+        raw = collection.raw()
+        updates = [ReplaceOne({'_id': key}, {'_id': key, 'itemIds': sorted(expected[key])}, upsert=True)
+                   for key in report['missing'] + report['stale']]
+        if updates:
+            raw.bulk_write(updates, ordered=False)
+        if report['orphaned']:
+            raw.delete_many({'_id': {'$in': report['orphaned']}})
+    return report
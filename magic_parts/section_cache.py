@@ -0,0 +1,265 @@
+"""
+Indexes over an AssessmentSection's maps for the magic parts.
+
+They are kept on the section object itself, so every magic part walking
+the same section shares them, and they are updated as the section grows.
+"""
+from collections import OrderedDict
+
+from dlkit.abstract_osid.osid.errors import IllegalState
+from dlkit.json_.assessment.objects import ASSESSMENT_AUTHORITY
+from dlkit.json_.id.objects import IdList
+from dlkit.primordium.id.primitives import Id
+
+from .magic_ids import MAGIC_PART_AUTHORITY, parse_magic_part_identifier
+
+
+class _SectionListIndex(object):
+    """an index over one of the section's lists of maps, kept up to date as
+    the list grows.
+
+    dlkit appends to the lists, but also inserts into them, e.g. the
+    questions of a new child part right after its parent's. New maps at the
+    end just get indexed; anything inserted before the maps already indexed
+    shifts the last of them off its position, and then the index has to be
+    rebuilt, as it has to if the list gets replaced or shrinks.
+
+    """
+    def __init__(self, maps):
+        self._maps = maps
+        self._num_indexed = 0
+        self._last_indexed = None
+
+    def is_valid_for(self, maps):
+        if maps is not self._maps or len(maps) < self._num_indexed:
+            return False
+        return self._num_indexed == 0 or maps[self._num_indexed - 1] is self._last_indexed
+
+    def update(self):
+        for a_map in self._maps[self._num_indexed:]:
+            self._add(a_map)
+        self._num_indexed = len(self._maps)
+        if self._maps:
+            self._last_indexed = self._maps[-1]
+
+    def _add(self, a_map):
+        raise NotImplementedError()
+
+
+class QuestionIndex(_SectionListIndex):
+    """assessmentPartId -> first question map for that part in the section,
+    and question id -> question map"""
+    def __init__(self, questions):
+        super(QuestionIndex, self).__init__(questions)
+        self._question_maps = {}
+        self._item_ids = {}
+        self._question_maps_by_id = {}
+        self._question_maps_by_question_id = {}
+
+    def _add(self, question_map):
+        self._question_maps.setdefault(question_map['assessmentPartId'], question_map)
+        if '_id' in question_map:
+            self._question_maps_by_id[str(question_map['_id'])] = question_map
+        self._question_maps_by_question_id.setdefault(question_map['questionId'], question_map)
+
+    def get_question_map(self, assessment_part_id):
+        return self._question_maps.get(str(assessment_part_id))
+
+    def find_question_map(self, question_id):
+        """the question map of a question id, the one section._get_question_map
+        would find, or None"""
+        if question_id.get_authority() == ASSESSMENT_AUTHORITY:
+            # the ids the section hands out for its questions
+            return self._question_maps_by_id.get(question_id.get_identifier())
+        return self._question_maps_by_question_id.get(str(question_id))
+
+    def get_item_id(self, section, assessment_part_id):
+        """the item id of the part's question, as the section reports it,
+        or None if the part has no question yet"""
+        assessment_part_id = str(assessment_part_id)
+        if assessment_part_id not in self._item_ids:
+            question_map = self._question_maps.get(assessment_part_id)
+            if question_map is None:
+                return None
+            # the section decides how its question ids look, so ask it once
+            self._item_ids[assessment_part_id] = section.get_question(question_map=question_map).get_id()
+        return self._item_ids[assessment_part_id]
+
+
+def get_question_index(section):
+    """returns the up to date QuestionIndex for the section"""
+    questions = section._my_map['questions']
+    index = getattr(section, '_magic_question_index', None)
+    if index is None or not index.is_valid_for(questions):
+        index = QuestionIndex(questions)
+        section._magic_question_index = index
+    index.update()
+    return index
+
+
+class ChildPartIndex(_SectionListIndex):
+    """(parent part id, waypoint index, objective ids) -> magic part id string,
+    for the magic parts already in the section"""
+    def __init__(self, assessment_parts):
+        super(ChildPartIndex, self).__init__(assessment_parts)
+        self._part_ids = {}
+
+    def _add(self, part_map):
+        part_id = Id(part_map['assessmentPartId'])
+        if part_id.get_authority() != MAGIC_PART_AUTHORITY:
+            return
+        arg_map = parse_magic_part_identifier(part_id.get_identifier())[1]
+        if arg_map['parent_id'] is None:
+            return
+        key = (arg_map['parent_id'], arg_map['waypoint_index'], tuple(arg_map['objective_ids']))
+        self._part_ids.setdefault(key, part_map['assessmentPartId'])
+
+    def get_child_part_id(self, parent_part_id, waypoint_index, objective_ids):
+        """the id string of the child part, or None if it is not in the section"""
+        return self._part_ids.get((str(parent_part_id), waypoint_index, tuple(objective_ids)))
+
+
+def get_child_part_index(section):
+    """returns the up to date ChildPartIndex for the section"""
+    assessment_parts = section._my_map['assessmentParts']
+    index = getattr(section, '_magic_child_part_index', None)
+    if index is None or not index.is_valid_for(assessment_parts):
+        index = ChildPartIndex(assessment_parts)
+        section._magic_child_part_index = index
+    index.update()
+    return index
+
+
+def get_section_version(section):
+    """a key that changes whenever a part, question or response gets added to
+    the section, i.e. whenever the scaffold tree may have to grow"""
+    return (len(section._my_map['assessmentParts']),
+            tuple((len(question_map['responses']), str(question_map['responses'][0].get('submissionTime')))
+                  if question_map.get('responses') else (0, None)
+                  for question_map in section._my_map['questions']))
+
+
+class ScaffoldEvaluationContext(object):
+    """memoizes the section's answers during one walk of the scaffold tree.
+
+    Stands in for the section in is_correct, get_confused_learning_objective_ids
+    and get_question_ids_for_assessment_part, so that each response is only
+    evaluated once per walk, however many parts ask about it. Submitting a
+    response puts a new latest response on the question, which invalidates
+    the answers memoized for it. The latest response is found through the
+    section's QuestionIndex, so checking the memo doesn't scan the questions.
+
+    """
+    def __init__(self, section):
+        self._section = section
+        self._answers = {}
+
+    def _get_answer(self, key, method, question_id, response=None):
+        """method(question_id), memoized under key for as long as the
+        latest response of the question is response"""
+        memo = self._answers.get(key)
+        if memo is None or memo[0] is not response:
+            try:
+                memo = (response, method(question_id), None)
+            except IllegalState as ex:
+                memo = (response, None, ex)
+            self._answers[key] = memo
+        response, answer, error = memo
+        if error is not None:
+            raise error
+        return answer
+
+    def _get_latest_response(self, question_id):
+        question_map = get_question_index(self._section).find_question_map(question_id)
+        if question_map is None or not question_map.get('responses'):
+            return None
+        return question_map['responses'][0]
+
+    def is_correct(self, question_id):
+        return self._get_answer(('is_correct', str(question_id)),
+                                self._section.is_correct,
+                                question_id,
+                                self._get_latest_response(question_id))
+
+    def get_confused_learning_objective_ids(self, question_id):
+        objective_ids = self._get_answer(('confused_learning_objective_ids', str(question_id)),
+                                         self._get_confused_learning_objective_ids,
+                                         question_id,
+                                         self._get_latest_response(question_id))
+        # IdLists get used up, so hand out a new one every time
+        return IdList(objective_ids,
+                      runtime=self._section._runtime,
+                      proxy=self._section._proxy)
+
+    def _get_confused_learning_objective_ids(self, question_id):
+        return list(self._section.get_confused_learning_objective_ids(question_id))
+
+    def get_question_ids_for_assessment_part(self, assessment_part_id):
+        return self._get_answer(('question_ids', str(assessment_part_id)),
+                                self._section.get_question_ids_for_assessment_part,
+                                assessment_part_id)
+
+
+def get_scaffold_evaluation_context(section):
+    """the ScaffoldEvaluationContext of the walk in progress over the section, if any"""
+    return getattr(section, '_magic_evaluation_context', None)
+
+
+def start_scaffold_evaluation(section):
+    """starts memoizing the section's answers, unless a walk is already in progress.
+
+    Returns True if it did, in which case the caller must end_scaffold_evaluation.
+
+    """
+    if get_scaffold_evaluation_context(section) is not None:
+        return False
+    section._magic_evaluation_context = ScaffoldEvaluationContext(section)
+    return True
+
+
+def end_scaffold_evaluation(section):
+    section._magic_evaluation_context = None
+
+
+class ItemSelectionBatch(object):
+    """shares the seen item ids between magic parts initialized together,
+    so they are only looked up once, and items picked for one part count as
+    seen for the next. The candidate items of their objectives can be loaded
+    up front too, with add_candidate_item_ids."""
+    def __init__(self):
+        self.seen_item_ids = None
+        self._candidate_item_ids = {}
+
+    def add_candidate_item_ids(self, item_bank_id, item_ids_by_objective):
+        self._candidate_item_ids.update(((item_bank_id, objective_id), item_ids)
+                                        for objective_id, item_ids in item_ids_by_objective.items())
+
+    def get_candidate_item_ids(self, item_bank_id, objective_ids):
+        """the candidate item ids for any of the objectives, or None if they
+        weren't all loaded"""
+        keys = [(item_bank_id, objective_id) for objective_id in objective_ids]
+        if not keys or not all(key in self._candidate_item_ids for key in keys):
+            return None
+        # an item can match several of the objectives
+        return list(OrderedDict.fromkeys(item_id for key in keys for item_id in self._candidate_item_ids[key]))
+
+
+def get_item_selection_batch(section):
+    """the ItemSelectionBatch in progress for the section, if any"""
+    return getattr(section, '_magic_item_selection_batch', None)
+
+
+def start_item_selection_batch(section):
+    """starts sharing the seen item ids, unless a batch is already in progress.
+
+    Returns True if it did, in which case the caller must end_item_selection_batch.
+
+    """
+    if section is None or get_item_selection_batch(section) is not None:
+        return False
+    section._magic_item_selection_batch = ItemSelectionBatch()
+    return True
+
+
+def end_item_selection_batch(section):
+    section._magic_item_selection_batch = None
@@ -0,0 +1,63 @@
+"""
+Per-agent index of the item ids that have already appeared in that agent's
+AssessmentSections, so scaffold item selection does not have to scan every
+section of every AssessmentTaken the agent has ever had.
+
+The index is built from the agent's sections the first time the agent is
+looked up. After that, a scaffold part's get_parts adds the items of the
+parts that are new to the section, right before the section adds their
+questions. So only the items that actually make it into a section count as
+seen, not every item a part considered.
+
+Questions that reach a section some other way, e.g. through admin edits,
+are not seen by the index; clear_seen_item_ids makes it rebuild from the
+sections.
+"""
+from dlkit.abstract_osid.osid.errors import NotFound
+from dlkit.json_.utilities import JSONClientValidated
+
+SEEN_ITEMS_COLLECTION = 'SeenItems'
+
+
+def _get_seen_items_collection(runtime):
+    return JSONClientValidated('assessment',
+                               collection=SEEN_ITEMS_COLLECTION,
+                               runtime=runtime)
+
+
+def get_seen_item_ids(taking_agent_id, runtime):
+    """returns the set of item id strings seen by the agent, or None if the
+    agent has not been indexed yet
+
+    The agent document is keyed on the agent id string, so this is a
+    single _id lookup.
+
+    """
+    collection = _get_seen_items_collection(runtime)
+    try:
+        agent_map = collection.find_one({'_id': str(taking_agent_id)})
+    except NotFound:
+        return None
+    return set(agent_map['itemIds'])
+
+
+def set_seen_item_ids(taking_agent_id, item_ids, runtime):
+    """(re)builds the agent's index from all the item ids in the agent's sections"""
+    collection = _get_seen_items_collection(runtime)
+    collection.raw().update_one({'_id': str(taking_agent_id)},
+                                {'$set': {'itemIds': sorted(set(str(item_id) for item_id in item_ids))}},
+                                upsert=True)
+
+
+def add_seen_item_ids(taking_agent_id, item_ids, runtime):
+    """adds item ids to the agent's index, if the agent has been indexed"""
+    item_ids = [str(item_id) for item_id in item_ids]
+    collection = _get_seen_items_collection(runtime)
+    collection.raw().update_one({'_id': str(taking_agent_id)},
+                                {'$addToSet': {'itemIds': {'$each': item_ids}}})
+
+
+def clear_seen_item_ids(taking_agent_id, runtime):
+    """drops the agent's index, so it gets rebuilt from the sections on next use"""
+    collection = _get_seen_items_collection(runtime)
+    collection.raw().delete_one({'_id': str(taking_agent_id)})
@@ -0,0 +1,41 @@
+"""
+Seeded choice orders for randomized MC questions.
+
+The order is a Fisher-Yates shuffle driven by HMAC-SHA256 of the seed (say
+the taking agent or the taken id) and the item id, keyed with a salt. So it
+needs no RNG state: any process that knows the seed, the item and the salt
+gets the same order.
+"""
+import hashlib
+import hmac
+import struct
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _iter_hash_words(seed, item_id, salt):
+    """an endless stream of 32 bit words from the keyed hash"""
+    key = _to_bytes(salt)
+    message = '{0}|{1}'.format(_to_bytes(seed), _to_bytes(item_id))
+    counter = 0
+    while True:
+        digest = hmac.new(key, '{0}|{1}'.format(message, counter), hashlib.sha256).digest()
+        for word in struct.unpack('>8I', digest):
+            yield word
+        counter += 1
+
+
+def get_seeded_choice_order(num_choices, seed, item_id, salt=''):
+    """the choice order for the item and seed, as indexes into the original order"""
+    order = range(num_choices)
+    words = _iter_hash_words(seed, item_id, salt)
+    for index in range(num_choices - 1, 0, -1):
+        # the modulo bias is negligible for a 32 bit word and a few choices
+        other_index = next(words) % (index + 1)
+        order[index], order[other_index] = order[other_index], order[index]
+    return order
+
@@ -0,0 +1,85 @@
+"""
+Encoding of the choice order carried in randomized MC "magic" item ids.
+
+The legacy payload is the JSON list of choice ids in display order, e.g.
+    57978959cdfc5c42eefb36d2?["57978959cdfc5c42eefb36d1", "57978959cdfc5c42eefb36d0", ...]
+
+The compact (version 1) payload stores a fingerprint of the item's original
+(unrandomized) choice ids, then the display order as indexes into that
+original order, one base 36 digit per choice:
+    57978959cdfc5c42eefb36d2?p1.5d41a2.1032
+
+The indexes only mean something for the choices they were made from, so
+decoding them checks the fingerprint (see CompactChoiceOrder).
+"""
+import json
+
+from hashlib import md5
+from urllib import quote, unquote
+
+from ..instrumentation import increment
+
+COMPACT_CHOICE_ORDER_PREFIX = 'p1.'
+CHOICE_INDEX_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+FINGERPRINT_LENGTH = 6
+
+
+class CompactChoiceOrder(list):
+    """the indexes of a compact payload, with the fingerprint of the choice
+    ids they index into"""
+    def __init__(self, indexes, fingerprint):
+        super(CompactChoiceOrder, self).__init__(indexes)
+        self.fingerprint = fingerprint
+
+    def matches(self, original_choice_ids):
+        """are these the choices the indexes were made from?"""
+        return (len(self) == len(original_choice_ids) and
+                self.fingerprint == get_choice_set_fingerprint(original_choice_ids))
+
+
+def get_choice_set_fingerprint(original_choice_ids):
+    """a short hash of the original choice ids, in order"""
+    return md5(','.join(str(choice_id) for choice_id in original_choice_ids)).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def encode_choice_order(choice_ids, original_choice_ids):
+    """returns the payload for the choice order, compact whenever possible"""
+    if len(original_choice_ids) <= len(CHOICE_INDEX_DIGITS):
+        original_indexes = dict((choice_id, index) for index, choice_id in enumerate(original_choice_ids))
+        try:
+            indexes = ''.join(CHOICE_INDEX_DIGITS[original_indexes[choice_id]] for choice_id in choice_ids)
+        except KeyError:
+            # the choices were changed under us, so keep the ids themselves
+            pass
+        else:
+            return '{0}{1}.{2}'.format(COMPACT_CHOICE_ORDER_PREFIX,
+                                       get_choice_set_fingerprint(original_choice_ids),
+                                       indexes)
+    return json.dumps(choice_ids)
+
+
+def decode_choice_order(payload):
+    """returns the choice order in a payload
+
+    This is a CompactChoiceOrder of indexes into the original choice order
+    for compact payloads, or a list of choice ids for legacy ones.
+
+    """
+    if payload.startswith(COMPACT_CHOICE_ORDER_PREFIX):
+        fingerprint, _, indexes = payload[len(COMPACT_CHOICE_ORDER_PREFIX):].partition('.')
+        return CompactChoiceOrder([CHOICE_INDEX_DIGITS.index(digit) for digit in indexes], fingerprint)
+    return json.loads(payload)
+
+
+def get_magic_item_identifier(original_identifier, choice_ids, original_choice_ids):
+    """the (quoted) identifier of a magic item id"""
+    increment('magic_ids.item.encode')
+    return quote('{0}?{1}'.format(original_identifier,
+                                  encode_choice_order(choice_ids, original_choice_ids)))
+
+
+def parse_magic_item_identifier(magic_identifier):
+    """returns the original item identifier and the choice order of a magic item identifier"""
+    increment('magic_ids.item.decode')
+    original_identifier, _, payload = unquote(magic_identifier).partition('?')
+    return original_identifier, decode_choice_order(payload)
@@ -1,20 +1,27 @@
 import json
+import threading
 
-from copy import deepcopy
+from bson import ObjectId
+from collections import OrderedDict
+from copy import copy, deepcopy
 
+from dlkit.abstract_osid.osid.errors import NotFound, OperationFailed
 from dlkit.json_.osid import record_templates as osid_records
-from dlkit.json_.assessment.objects import Question
-from dlkit.json_.assessment.sessions import ItemLookupSession
+from dlkit.json_.assessment.objects import Item, ItemList, Question
+from dlkit.json_.assessment.sessions import ItemAdminSession, ItemLookupSession
+from dlkit.json_.utilities import JSONClientValidated
 from dlkit.primordium.id.primitives import Id
 
 from random import shuffle
 
-from urllib import unquote, quote
-
 from ...assessment.basic.multi_choice_records import MultiChoiceTextAndFilesQuestionFormRecord,\
     MultiChoiceTextAndFilesQuestionRecord
 from ...assessment.basic.base_records import ItemWithWrongAnswerLOsRecord
 
+from .magic_ids import CompactChoiceOrder, get_magic_item_identifier, parse_magic_item_identifier
+from ..instrumentation import count_cache_lookup
+from ..utilities import LRUCache
+
 MAGIC_AUTHORITY = 'magic-randomize-choices-question-record'
 
 
@@ -61,31 +68,319 @@ class RandomizedMCItemLookupSession(ItemLookupSession):
         This adapter session has out-of-band knowledge of the authority
         of the items it needs to deconstruct -- i.e. from the DLKit
         records implementation.
+
+        Set shared_item_cache to a SharedItemCache (see
+        get_shared_item_cache) to share the original, unscrambled item maps
+        between all the sessions in this process. Its entries are per catalog
+        and catalog view, so a hit only returns items a lookup would. Edits
+        to an item show up once its entry expires, after the cache's ttl;
+        only edits made through RandomizedMCItemAdminSession, in the same
+        process, show up right away.
     """
+    shared_item_cache = None
+
     def __init__(self, *args, **kwargs):
         super(RandomizedMCItemLookupSession, self).__init__(*args, **kwargs)
         self._magic_items = {}
 
+    def _get_shared_item_cache_key(self, identifier):
+        return str(self._catalog_id), self._catalog_view, identifier
+
+    def _get_original_item_map(self, item_id):
+        """gets the map of an unscrambled item, from the shared item cache if there is one"""
+        cache = self.shared_item_cache
+        if cache is None:
+            return super(RandomizedMCItemLookupSession, self).get_item(item_id)._my_map
+        item_map = cache.get(self._get_shared_item_cache_key(item_id.identifier))
+        count_cache_lookup('randomized_mc.shared_item_cache', item_map is not None)
+        if item_map is None:
+            generation = cache.get_generation(item_id.identifier)
+            item_map = super(RandomizedMCItemLookupSession, self).get_item(item_id)._my_map
+            if str(item_map['_id']) == item_id.identifier:
+                cache.set(self._get_shared_item_cache_key(item_id.identifier),
+                          deepcopy(item_map),
+                          generation)
+        return item_map
+
+    def _build_item(self, item_map, choice_ids):
+        """a new Item on the cached map, which it only copies to change it"""
+        item = CopyOnWriteItem(osid_object_map=item_map,
+                               runtime=self._runtime,
+                               proxy=self._proxy)
+        if choice_ids is not None:
+            item.set_params(choice_ids)
+        return item
+
+    def _get_original_item_id(self, item_id):
+        """returns the unscrambled item id and the choice order encoded in a magic id"""
+        # for now, this will not work with aliased IDs...
+        original_identifier, choice_order = parse_magic_item_identifier(item_id.identifier)
+        original_item_id = Id(identifier=original_identifier,
+                              namespace=item_id.namespace,
+                              authority=self._catalog.ident.authority)
+        return original_item_id, choice_order
+
     def get_item(self, item_id):
-        authority = item_id.authority
+        count_cache_lookup('randomized_mc.magic_items', item_id in self._magic_items)
         if item_id not in self._magic_items:
-            if authority == MAGIC_AUTHORITY:
-                # for now, this will not work with aliased IDs...
-                magic_identifier = unquote(item_id.identifier)
-                original_identifier = magic_identifier.split('?')[0]
-                choice_ids = json.loads(magic_identifier.split('?')[-1])
-                original_item_id = Id(identifier=original_identifier,
-                                      namespace=item_id.namespace,
-                                      authority=self._catalog.ident.authority)
-                orig_item = super(RandomizedMCItemLookupSession, self).get_item(original_item_id)
-                orig_item.set_params(choice_ids)
-                item = orig_item
+            if item_id.authority == MAGIC_AUTHORITY:
+                original_item_id, choice_ids = self._get_original_item_id(item_id)
+            else:
+                original_item_id, choice_ids = item_id, None
+            self._magic_items[item_id] = (self._get_original_item_map(original_item_id), choice_ids)
+        return self._build_item(*self._magic_items[item_id])
+
+    def _get_primary_identifiers(self, item_ids):
+        """maps the identifiers of the item ids to those of the stored items,
+        resolving any aliases with a single query"""
+        identifiers = dict((item_id.identifier, item_id.identifier) for item_id in item_ids)
+        collection = JSONClientValidated('id',
+                                         collection='assessmentIds',
+                                         runtime=self._runtime)
+        for result in collection.find({'aliasIds': {'$in': [str(item_id) for item_id in item_ids]}}):
+            primary_identifier = Id(result['_id']).identifier
+            for alias_id in result['aliasIds']:
+                alias_identifier = Id(alias_id).identifier
+                if alias_identifier in identifiers:
+                    identifiers[alias_identifier] = primary_identifier
+        return identifiers
+
+    def _find_item_maps(self, item_ids):
+        """the maps of the stored items, by the identifiers of item_ids, in
+        two queries: one for the aliases, one for the items
+
+        The items get found with a single $in query on the Item collection,
+        instead of through ItemLookupSession.get_items_by_ids, which looks
+        up the aliases of each id with a query of its own.
+
+        """
+        primary_identifiers = self._get_primary_identifiers(item_ids)
+        object_ids = [ObjectId(identifier) for identifier in set(primary_identifiers.values())
+                      if ObjectId.is_valid(identifier)]
+        collection = JSONClientValidated('assessment',
+                                         collection='Item',
+                                         runtime=self._runtime)
+        results = dict((str(item_map['_id']), item_map)
+                       for item_map in collection.find(dict({'_id': {'$in': object_ids}},
+                                                            **self._view_filter())))
+        return dict((identifier, results[primary_identifier])
+                    for identifier, primary_identifier in primary_identifiers.items()
+                    if primary_identifier in results)
+
+    def get_items_by_ids(self, item_ids):
+        """gets all the uncached items with a single query, then unscrambles the magic ones
+
+        Several magic ids can point to the same original item, so each one
+        gets its own Item built from a copy of the original's map. Like get_item,
+        raises NotFound if any of the items isn't found.
+
+        """
+        item_ids = list(item_ids)
+        uncached = OrderedDict()
+        lookup_ids = OrderedDict()
+        for item_id in item_ids:
+            if item_id in self._magic_items or item_id in uncached:
+                count_cache_lookup('randomized_mc.magic_items', True)
+                continue
+            count_cache_lookup('randomized_mc.magic_items', False)
+            if item_id.authority == MAGIC_AUTHORITY:
+                original_item_id, choice_ids = self._get_original_item_id(item_id)
             else:
-                item = super(RandomizedMCItemLookupSession, self).get_item(item_id)
-            self._magic_items[item_id] = item
-            return item
+                original_item_id, choice_ids = item_id, None
+            uncached[item_id] = (original_item_id, choice_ids)
+            lookup_ids[original_item_id.identifier] = original_item_id
+
+        item_maps = {}
+        cache = self.shared_item_cache
+        generations = {}
+        if cache is not None:
+            for identifier in list(lookup_ids):
+                item_map = cache.get(self._get_shared_item_cache_key(identifier))
+                count_cache_lookup('randomized_mc.shared_item_cache', item_map is not None)
+                if item_map is not None:
+                    item_maps[identifier] = item_map
+                    del lookup_ids[identifier]
+                else:
+                    generations[identifier] = cache.get_generation(identifier)
+        if lookup_ids:
+            for identifier, item_map in self._find_item_maps(lookup_ids.values()).items():
+                item_maps[identifier] = item_map
+                # aliases get looked up again, like get_item does
+                if identifier in generations and str(item_map['_id']) == identifier:
+                    cache.set(self._get_shared_item_cache_key(identifier),
+                              deepcopy(item_map),
+                              generations[identifier])
+
+        for item_id, (original_item_id, choice_ids) in uncached.items():
+            if original_item_id.identifier not in item_maps:
+                # not found, or sequestered
+                raise NotFound(str(item_id))
+            self._magic_items[item_id] = (item_maps[original_item_id.identifier], choice_ids)
+
+        return ItemList([self._build_item(*self._magic_items[item_id]) for item_id in item_ids],
+                        runtime=self._runtime,
+                        proxy=self._proxy)
+
+
+class CopyOnWriteItem(Item):
+    """an Item on a map it shares with other Items, like the ones handed out
+    by RandomizedMCItemLookupSession for the same cached item
+
+    Nothing that reads the Item, or builds its Question, changes the map,
+    so handing one out costs no copy. get_object_map writes into the map's
+    nested dicts, so it gets the Item a private copy first, and so does
+    get_private_map, for callers that want to change the map themselves.
+    """
+    def __init__(self, osid_object_map, **kwargs):
+        self._is_map_private = False
+        super(CopyOnWriteItem, self).__init__(osid_object_map=osid_object_map, **kwargs)
+
+    def get_private_map(self):
+        """the Item's map, copied first if it is still shared"""
+        if not self._is_map_private:
+            self._my_map = deepcopy(self._my_map)
+            self._is_map_private = True
+        return self._my_map
+
+    def get_object_map(self):
+        self.get_private_map()
+        return super(CopyOnWriteItem, self).get_object_map()
+
+    object_map = property(fget=get_object_map)
+
+
+class RandomizedMCItemAdminSession(ItemAdminSession):
+    """this session evicts changed items from the shared item cache
+        of RandomizedMCItemLookupSession, if there is one.
+
+        dlkit has no hook for magic admin sessions, so only the callers
+        that make this session themselves get the eviction. The cache is
+        per process too, so everywhere else a change shows up once the
+        cached entry expires.
+
+        With maintain_objective_item_index set, it also keeps the
+        objective -> item index of the scaffold parts up to date.
+    """
+    maintain_objective_item_index = False
+
+    def _index_item(self, item):
+        if not self.maintain_objective_item_index:
+            return
+        from ..magic_parts.objective_item_index import index_item
+        mgr = item._get_provider_manager('ASSESSMENT', local=True)
+        index_item(item,
+                   mgr.get_bank_hierarchy_session(proxy=self._proxy),
+                   runtime=self._runtime)
+
+    def _unindex_item(self, item_id):
+        if not self.maintain_objective_item_index:
+            return
+        from ..magic_parts.objective_item_index import unindex_item
+        unindex_item(item_id, runtime=self._runtime)
+
+    def _invalidate_item(self, item_id=None):
+        cache = RandomizedMCItemLookupSession.shared_item_cache
+        if cache is None:
+            return
+        if item_id is None:
+            cache.invalidate()
         else:
-            return deepcopy(self._magic_items[item_id])
+            cache.invalidate(Id(str(item_id)).identifier)
+
+    def create_item(self, item_form):
+        item = super(RandomizedMCItemAdminSession, self).create_item(item_form)
+        self._index_item(item)
+        return item
+
+    def update_item(self, item_form):
+        item = super(RandomizedMCItemAdminSession, self).update_item(item_form)
+        self._invalidate_item(item.ident)
+        self._index_item(item)
+        return item
+
+    def delete_item(self, item_id):
+        super(RandomizedMCItemAdminSession, self).delete_item(item_id)
+        self._invalidate_item(item_id)
+        self._unindex_item(item_id)
+
+    def create_question(self, question_form):
+        question = super(RandomizedMCItemAdminSession, self).create_question(question_form)
+        self._invalidate_item(question_form._my_map['itemId'])
+        return question
+
+    def update_question(self, question_form):
+        question = super(RandomizedMCItemAdminSession, self).update_question(question_form)
+        self._invalidate_item(question_form._my_map['itemId'])
+        return question
+
+    def delete_question(self, question_id):
+        super(RandomizedMCItemAdminSession, self).delete_question(question_id)
+        # no cheap way back to the item here
+        self._invalidate_item()
+
+    def create_answer(self, answer_form):
+        answer = super(RandomizedMCItemAdminSession, self).create_answer(answer_form)
+        self._invalidate_item(answer_form._my_map['itemId'])
+        return answer
+
+    def update_answer(self, answer_form):
+        answer = super(RandomizedMCItemAdminSession, self).update_answer(answer_form)
+        self._invalidate_item(answer_form._my_map['itemId'])
+        return answer
+
+    def delete_answer(self, answer_id):
+        super(RandomizedMCItemAdminSession, self).delete_answer(answer_id)
+        self._invalidate_item()
+
+
+class SharedItemCache(object):
+    """the original item maps shared by the RandomizedMCItemLookupSessions
+    of a process, in an LRUCache
+
+    Every entry keeps the edit generation of its item from before the item
+    was read. invalidate() moves the generation on, so neither the entries
+    cached so far nor those of reads still in flight get used again.
+    """
+    def __init__(self, **kwargs):
+        self._entries = LRUCache(**kwargs)
+        self._generation = 0
+        self._item_generations = {}
+        self._lock = threading.Lock()
+
+    def get_generation(self, identifier):
+        """the generation to set() an item map with, taken before reading it"""
+        return self._generation, self._item_generations.get(identifier, 0)
+
+    def get(self, key):
+        """the item map for a (catalog id, catalog view, item identifier) key, or None"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.get_generation(key[-1]):
+            return None
+        return entry[1]
+
+    def set(self, key, item_map, generation):
+        if generation == self.get_generation(key[-1]):
+            self._entries.set(key, (generation, item_map))
+
+    def invalidate(self, identifier=None):
+        """drops the item with the identifier, or all the items"""
+        with self._lock:
+            if identifier is None:
+                self._generation += 1
+                self._item_generations.clear()
+                self._entries.clear()
+            else:
+                self._item_generations[identifier] = self._item_generations.get(identifier, 0) + 1
+
+
+def get_shared_item_cache(max_entries=5000, ttl=600, max_bytes=50 * 1024 * 1024):
+    """returns an item cache for RandomizedMCItemLookupSession.shared_item_cache,
+    sized by the JSON length of the item maps. Items are cached for ttl
+    seconds, which is how long edits can take to show up."""
+    return SharedItemCache(max_entries=max_entries,
+                           ttl=ttl,
+                           max_bytes=max_bytes,
+                           sizeof=lambda entry: len(json.dumps(entry[1], default=str)))
 
 
 class MagicRandomizedMCItemRecord(ItemWithWrongAnswerLOsRecord):
@@ -95,24 +390,59 @@ class MagicRandomizedMCItemRecord(ItemWithWrongAnswerLOsRecord):
     def __init__(self, *args, **kwargs):
         super(MagicRandomizedMCItemRecord, self).__init__(*args, **kwargs)
         self._magic_params = None
+        self._choice_seed = None
+        self._question = None
 
     def get_question(self):
-        question = Question(osid_object_map=self.my_osid_object._my_map['question'],
+        """the Question, built once for the current magic params or choice seed
+
+        Repeated reads return the same Question, so always the same choice
+        order. set_params and set_choice_seed drop it. Each lookup hands out
+        a new Item, so callers of different lookups don't share it.
+
+        """
+        count_cache_lookup('randomized_mc.question', self._question is not None)
+        if self._question is None:
+            self._question = self._build_question()
+        return self._question
+
+    def _build_question(self):
+        # The question records reorder the choices and relabel the question,
+        # so they get their own copies of those. The item's own map is left
+        # alone, so the item keeps its original choice order.
+        question_map = dict(self.my_osid_object._my_map['question'])
+        for key in ('choices', 'displayName'):
+            if key in question_map:
+                question_map[key] = copy(question_map[key])
+        question = Question(osid_object_map=question_map,
                             runtime=self.my_osid_object._runtime,
                             proxy=self.my_osid_object._proxy)
-        if self._magic_params is not None:
-            try:
-                if question.shuffle:
-                    question.set_values(self._magic_params)
-            except AttributeError:
-                # no shuffle arg, so shuffle by default
+        if self._is_shuffled(question):
+            if self._magic_params is not None:
                 question.set_values(self._magic_params)
+            elif self._choice_seed is not None:
+                question.set_choice_seed(self._choice_seed)
         return question
 
+    @staticmethod
+    def _is_shuffled(question):
+        try:
+            return question.shuffle
+        except AttributeError:
+            # no shuffle arg, so shuffle by default
+            return True
+
     question = property(fget=get_question)
 
     def set_params(self, params):
         self._magic_params = params
+        self._question = None
+
+    def set_choice_seed(self, seed):
+        """seeds the choice order of the question, see
+        MultiChoiceRandomizeChoicesQuestionRecord.set_choice_seed"""
+        self._choice_seed = seed
+        self._question = None
 
 
 class MagicRandomizedMCItemFormRecord(osid_records.OsidRecord):
@@ -152,22 +482,51 @@ class MultiChoiceRandomizeChoicesQuestionRecord(MultiChoiceTextAndFilesQuestionR
     _implemented_record_type_identifiers = [
         'randomize-choices'
     ]
+    # When True, the choices only get shuffled when they are first read
+    # through get_choices or get_id, so questions that get their order from a
+    # magic id (set_values) are never shuffled at all. Only turn this on where
+    # nothing reads _my_map['choices'] directly before that.
+    lazy_choice_order = False
+    # key of the hash behind set_choice_seed. Set it per deployment, so the
+    # choice orders can't be worked out from the ids.
+    choice_order_salt = ''
 
     def __init__(self, osid_object):
-        self._original_choice_order = deepcopy(osid_object._my_map['choices'])
+        # set_values hands out copies of the choices, so the original order
+        # can share them with the map
+        self._original_choice_order = list(osid_object._my_map['choices'])
+        self._choices_by_id = None
         super(MultiChoiceRandomizeChoicesQuestionRecord, self).__init__(osid_object)
         # it is possible to have no choices set yet --- so don't throw exceptions in that
         #   case
         # if not self.my_osid_object._my_map['choices']:
         #     raise IllegalState()
-        if ('shuffle' not in self.my_osid_object._my_map or
-                self.my_osid_object._my_map['shuffle']):
-            choices = self.my_osid_object._my_map['choices']
-            shuffle(choices)
-            self.my_osid_object._my_map['choices'] = choices
+        self._shuffle_pending = ('shuffle' not in self.my_osid_object._my_map or
+                                 self.my_osid_object._my_map['shuffle'])
+        if not self.lazy_choice_order:
+            self._shuffle_choices()
         # Claim authority on this object, until someone else does:
         self.my_osid_object._authority = MAGIC_AUTHORITY
 
+    def _shuffle_choices(self):
+        if self._shuffle_pending:
+            self._shuffle_pending = False
+            # a new list, the question may share the old one with its item
+            choices = list(self.my_osid_object._my_map['choices'])
+            shuffle(choices)
+            self.my_osid_object._my_map['choices'] = choices
+
+    def get_choices(self):
+        self._shuffle_choices()
+        return super(MultiChoiceRandomizeChoicesQuestionRecord, self).get_choices()
+
+    choices = property(fget=get_choices)
+
+    def get_choice_ids(self):
+        """the choice ids, in the order they are shown"""
+        self._shuffle_choices()
+        return [c['id'] for c in self.my_osid_object._my_map['choices']]
+
     def get_id(self):
         """override get_id to generate our "magic" ids that encode choice order"""
 
@@ -179,10 +538,12 @@ class MultiChoiceRandomizeChoicesQuestionRecord(MultiChoiceTextAndFilesQuestionR
             # raise AttributeError
 
         # If not, go ahead and build magic Id:
+        self._shuffle_choices()
         choices = self.my_osid_object._my_map['choices']
         choice_ids = [c['id'] for c in choices]
-        magic_identifier = quote('{0}?{1}'.format(self.my_osid_object._my_map['_id'],
-                                                  json.dumps(choice_ids)))
+        magic_identifier = get_magic_item_identifier(self.my_osid_object._my_map['_id'],
+                                                     choice_ids,
+                                                     [c['id'] for c in self._original_choice_order])
         return Id(namespace='assessment.Item',
                   identifier=magic_identifier,
                   authority=MAGIC_AUTHORITY)
@@ -199,15 +560,40 @@ class MultiChoiceRandomizeChoicesQuestionRecord(MultiChoiceTextAndFilesQuestionR
         """assume choice_ids is a list of choiceIds, like
         ["57978959cdfc5c42eefb36d1", "57978959cdfc5c42eefb36d0",
         "57978959cdfc5c42eefb36cf", "57978959cdfc5c42eefb36ce"]
+
+        or, from a compact magic id, a list of indexes into the original
+        choice order, like [1, 0, 3, 2]. Raises OperationFailed if the
+        choices were reordered, added or removed since the indexes were made.
         """
         # if not self.my_osid_object._my_map['choices']:
         #     raise IllegalState()
-        organized_choices = []
-        for choice_id in choice_ids:
-            choice_obj = [c for c in self._original_choice_order if c['id'] == choice_id][0]
-            organized_choices.append(choice_obj)
-        self.my_osid_object._my_map['choices'] = organized_choices
+        self._shuffle_pending = False
+        if all(isinstance(choice_id, int) for choice_id in choice_ids):
+            if (isinstance(choice_ids, CompactChoiceOrder) and
+                    not choice_ids.matches([c['id'] for c in self._original_choice_order])):
+                raise OperationFailed('the choices of item {0} have changed since its choice order was '
+                                      'encoded'.format(self.my_osid_object._my_map['_id']))
+            self.my_osid_object._my_map['choices'] = [dict(self._original_choice_order[index])
+                                                      for index in choice_ids]
+            return
+        if self._choices_by_id is None:
+            self._choices_by_id = dict((c['id'], c) for c in self._original_choice_order)
+        self.my_osid_object._my_map['choices'] = [dict(self._choices_by_id[choice_id])
+                                                  for choice_id in choice_ids]
+
+    def set_choice_seed(self, seed):
+        """orders the choices by a keyed hash of the seed (e.g. the taking agent
+        or taken id) and the item id, instead of at random, so any process can
+        reproduce the order from the seed alone"""
+        from .choice_order import get_seeded_choice_order
+        self.set_values(get_seeded_choice_order(len(self._original_choice_order),
+                                                seed,
+                                                self.my_osid_object._my_map['_id'],
+                                                self.choice_order_salt))
 
     def set_display_label(self, display_label):
         """used to temporarily show a new name, like 1.1.1"""
-        self.my_osid_object._my_map['displayName']['text'] = str(display_label)
+        # a new dict, the question may share the old one with its item
+        display_name = dict(self.my_osid_object._my_map['displayName'])
+        display_name['text'] = str(display_label)
+        self.my_osid_object._my_map['displayName'] = display_name
@@ -0,0 +1,7 @@
+"""
+Tests of the id codecs and helpers that need no database.
+
+The package lives in dlkit's records, so run them from there:
+
+    cd <site-packages>/dlkit && python -m pytest records/fbw_dlkit_adapters/tests
+"""
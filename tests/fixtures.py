@@ -0,0 +1,140 @@
+"""
+Fixtures for the tests that take assessments through the dlkit runtime, in
+mongomock, with the synthetic assessment of the benchmarks.
+
+Like the benchmarks, these tests need a runtime whose records registry has
+this package's records, and whose magicAssessmentPartLookupSessions and
+magicItemLookupSessions are the sessions here. They are skipped otherwise.
+"""
+import unittest
+
+from importlib import import_module
+from random import Random
+
+from dlkit.abstract_osid.osid.errors import IllegalState, NotFound
+from dlkit.json_.utilities import JSONClientValidated
+from dlkit.primordium.id.primitives import Id
+
+from .. import instrumentation
+from ..benchmarks.fixtures import DEFAULT_PARAMS, answer_question, build_assessment, create_taken,\
+    get_assessment_manager
+from ..benchmarks.mongo import get_mongo_client
+from ..multi_choice_questions.magic_ids import get_magic_item_identifier
+from ..registry import ASSESSMENT_PART_RECORD_TYPES, ITEM_RECORD_TYPES
+
+# the runtime imports the records by their registry module paths, so these
+# are the modules to configure, whatever name the tests got imported under
+assessment_part_records = import_module(ASSESSMENT_PART_RECORD_TYPES['scaffold-down']['module_path'])
+randomized_questions = import_module(ITEM_RECORD_TYPES['multi-choice-randomized']['module_path'])
+
+# two items per objective
+TEST_PARAMS = DEFAULT_PARAMS._replace(bank_size=20, prior_takens=0)
+
+
+class QueryRecorder(object):
+    """instrumentation sink that records the Mongo round trips, as collection.method"""
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, kind, name, value):
+        if kind == instrumentation.TIMING and name.startswith('mongo.'):
+            self.calls.append(name[len('mongo.'):])
+
+    def count(self, collection=None, method=None):
+        return len([call for call in self.calls
+                    if collection in (None, call.split('.')[0]) and method in (None, call.split('.')[-1])])
+
+    def reset(self):
+        self.calls = []
+
+
+def get_runtime():
+    """the runtime of the dlkit implementation under the service managers,
+    or None if they don't run on it directly"""
+    return getattr(get_assessment_manager('fixtures@mit.edu')._provider_manager, '_runtime', None)
+
+
+def is_runtime_configured():
+    runtime = get_runtime()
+    if runtime is None:
+        return False
+    configuration = runtime.get_configuration()
+    expected = {
+        'magicAssessmentPartLookupSessions': [assessment_part_records.__name__ + '.MagicAssessmentPartLookupSession',
+                                              assessment_part_records.__name__ +
+                                              '.get_magic_assessment_part_lookup_session'],
+        'magicItemLookupSessions': [randomized_questions.__name__ + '.RandomizedMCItemLookupSession']
+    }
+    for parameter, values in expected.items():
+        try:
+            configured = configuration.get_value_by_parameter(Id('parameter:{0}@json'.format(parameter)))
+        except (KeyError, NotFound):
+            return False
+        if configured.get_string_value() not in values:
+            return False
+    return True
+
+
+class MagicSessionTestCase(unittest.TestCase):
+    """builds the assessment in a new mongomock database for each test class"""
+    params = TEST_PARAMS
+
+    @classmethod
+    def setUpClass(cls):
+        if not is_runtime_configured():
+            raise unittest.SkipTest('the dlkit runtime is not configured with these records and sessions')
+        instrumentation.instrument_mongo_client(get_mongo_client('mongomock'))
+        cls.runtime = get_runtime()
+        cls.assessment = build_assessment(cls.params, Random(cls.params.seed))
+
+    def setUp(self):
+        self.queries = instrumentation.add_sink(QueryRecorder())
+        self.addCleanup(instrumentation.remove_sink, self.queries)
+
+    def set_class_attribute(self, cls, name, value):
+        """sets a class attribute for the test, e.g. to switch on an opt-in feature"""
+        self.addCleanup(setattr, cls, name, getattr(cls, name))
+        setattr(cls, name, value)
+
+    def get_collection(self, collection, database='assessment'):
+        """the raw Mongo collection"""
+        return JSONClientValidated(database, collection=collection, runtime=self.runtime).raw()
+
+    def get_bank(self, username='student@mit.edu'):
+        return get_assessment_manager(username).get_bank(self.assessment.bank_id)
+
+    def start_taken(self, username='student@mit.edu'):
+        """the bank of the agent, and the first section of a new taken"""
+        bank = self.get_bank(username)
+        return bank, create_taken(bank, self.assessment.offered_id)
+
+    def answer_questions(self, bank, section, answers):
+        """answers the section's next questions, right or wrong as in answers.
+        Returns the questions answered."""
+        questions = []
+        for index, correct in enumerate(answers):
+            try:
+                question = bank.get_first_unanswered_question(section.ident)
+            except IllegalState:
+                break
+            answer_question(bank, section, question, self.assessment, correct, Random(index))
+            questions.append(question)
+        return questions
+
+    def get_item_lookup_session(self):
+        session = randomized_questions.RandomizedMCItemLookupSession(catalog_id=self.assessment.bank_id,
+                                                                     runtime=self.runtime)
+        session.use_federated_bank_view()
+        return session
+
+    def get_magic_item_id(self, item_id, random):
+        """a magic id of the item, with its choices in a random order"""
+        original_choice_ids = self.assessment.choice_ids[item_id.identifier]
+        choice_ids = list(original_choice_ids)
+        random.shuffle(choice_ids)
+        return Id(namespace=item_id.namespace,
+                  identifier=get_magic_item_identifier(item_id.identifier, choice_ids, original_choice_ids),
+                  authority=randomized_questions.MAGIC_AUTHORITY)
+
+    def get_section_map(self, bank, section):
+        return bank.get_assessment_section(section.ident)._my_map
@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from dlkit.abstract_osid.osid.errors import InvalidArgument, OperationFailed
+from dlkit.primordium.id.primitives import Id
+
+from ..benchmarks.fixtures import SIMPLE_SEQUENCE_RECORD_TYPE, get_magic_part_maps
+from ..magic_parts.magic_ids import get_magic_part_id, parse_magic_part_identifier
+from .fixtures import MagicSessionTestCase, assessment_part_records
+
+
+class SeededChoiceOrderTests(MagicSessionTestCase):
+    def setUp(self):
+        super(SeededChoiceOrderTests, self).setUp()
+        self.set_class_attribute(assessment_part_records.ScaffoldDownAssessmentPartRecord,
+                                 'use_seeded_choice_orders', True)
+
+    def test_questions_get_the_order_seeded_by_the_taken(self):
+        bank, section = self.start_taken()
+        self.answer_questions(bank, section, [False, False])
+        session = self.get_item_lookup_session()
+        taken_id = str(section._assessment_taken.ident)
+        question_maps = self.get_section_map(bank, section)['questions']
+        self.assertGreater(len(question_maps), 1)
+        for question_map in question_maps:
+            item = session.get_item(Id(question_map['itemId']))
+            item.set_choice_seed(taken_id)
+            self.assertEqual(question_map['questionId'], str(item.get_question().ident))
+
+
+class SessionPoolTests(MagicSessionTestCase):
+    def setUp(self):
+        super(SessionPoolTests, self).setUp()
+        self.pool = assessment_part_records.MagicAssessmentPartLookupSessionPool(sweep_interval=0)
+        self.set_class_attribute(assessment_part_records.MagicAssessmentPartLookupSession,
+                                 'session_pool', self.pool)
+
+    def get_session(self, section):
+        return assessment_part_records.get_magic_assessment_part_lookup_session(section, runtime=self.runtime)
+
+    def test_sections_get_their_sessions_from_the_pool(self):
+        bank, section = self.start_taken()
+        session = self.get_session(section)
+        section = bank.get_assessment_section(section.ident)
+        self.assertIs(self.get_session(section), session)
+        # rebound to the newest copy of the section
+        self.assertIs(session._my_assessment_section, section)
+
+    def test_drops_the_sessions_of_finished_takens(self):
+        bank, section = self.start_taken()
+        session = self.get_session(section)
+        bank.finish_assessment(section._assessment_taken.ident)
+        # the sweep runs on any hand out
+        other_bank, other_section = self.start_taken('other-student@mit.edu')
+        self.get_session(other_section)
+        self.assertEqual(self.pool._takens.keys(), [str(other_section._assessment_taken.ident)])
+        self.assertIsNot(self.get_session(section), session)
+
+
+class SectionPartsTestCase(MagicSessionTestCase):
+    """a section with two magic parts, both answered wrong, and a new
+    session for it"""
+    def setUp(self):
+        super(SectionPartsTestCase, self).setUp()
+        self.bank, self.section = self.start_taken()
+        self.answer_questions(self.bank, self.section, [False, False])
+        self.section = self.bank.get_assessment_section(self.section.ident)
+        section_map = self.get_section_map(self.bank, self.section)
+        self.part_ids = [Id(part_map['assessmentPartId']) for part_map in get_magic_part_maps(section_map)]
+        # the parts in a section take their item ids as the section reports them
+        self.section_item_ids = [str(self.section.get_question(question_map=question_map).get_id())
+                                 for question_map in section_map['questions']]
+        self.original_identifier = parse_magic_part_identifier(self.part_ids[0].identifier)[0]
+        self.session = assessment_part_records.get_magic_assessment_part_lookup_session(self.section,
+                                                                                        runtime=self.runtime)
+        self.queries.reset()
+
+    def get_waypoint_part_ids(self, objective_id, waypoint_indexes):
+        return [get_magic_part_id(self.original_identifier, [[waypoint_index, [str(objective_id)]]])
+                for waypoint_index in waypoint_indexes]
+
+
+class GetAssessmentPartsByIdsTests(SectionPartsTestCase):
+    def test_gets_the_parts_of_a_section_with_one_query(self):
+        parts = list(self.session.get_assessment_parts_by_ids(self.part_ids))
+        self.assertEqual(self.queries.count('AssessmentPart'), 1)
+        self.assertEqual([str(part.get_id()) for part in parts], [str(part_id) for part_id in self.part_ids])
+        # the magic ids point to the same original part, but each gets its own
+        self.assertEqual(len(self.part_ids), 2)
+        self.assertIsNot(parts[0]._my_map, parts[1]._my_map)
+        self.assertEqual([part._my_map['itemIds'][0] for part in parts], self.section_item_ids)
+
+        self.queries.reset()
+        self.assertEqual([part for part in self.session.get_assessment_parts_by_ids(self.part_ids)], parts)
+        self.assertEqual(self.queries.count(), 0)
+
+    def test_skips_parts_that_are_not_found(self):
+        missing_part_id = get_magic_part_id('0' * 24, [[0, [str(self.assessment.objective_ids[1])]]])
+        parts = list(self.session.get_assessment_parts_by_ids([missing_part_id, self.part_ids[0]]))
+        self.assertEqual([str(part.get_id()) for part in parts], [str(self.part_ids[0])])
+
+    def test_selects_the_items_of_new_parts_together(self):
+        objective_index = 5
+        part_ids = self.get_waypoint_part_ids(self.assessment.objective_ids[objective_index], [1, 2])
+        parts = list(self.session.get_assessment_parts_by_ids(part_ids))
+        # the candidates and the seen items of both parts get queried once
+        self.assertEqual(self.queries.count('Item'), 1)
+        self.assertEqual(self.queries.count('AssessmentSection'), 1)
+        # and an item picked for one part counts as seen for the other
+        self.assertEqual(sorted(part._my_map['itemIds'][0] for part in parts),
+                         sorted(str(item_id) for item_id in self.assessment.item_ids[objective_index::10]))
+
+
+class CreateScaffoldDownAssessmentPartsTests(MagicSessionTestCase):
+    def setUp(self):
+        super(CreateScaffoldDownAssessmentPartsTests, self).setUp()
+        self.bank = self.get_bank('author@mit.edu')
+        form = self.bank.get_assessment_form_for_create([SIMPLE_SEQUENCE_RECORD_TYPE])
+        self.assessment_id = self.bank.create_assessment(form).ident
+        self.session = assessment_part_records.ScaffoldDownAssessmentPartAdminSession(
+            catalog_id=self.assessment.bank_id,
+            runtime=self.runtime)
+
+    def get_part_maps(self):
+        return list(self.get_collection('AssessmentPart', database='assessment_authoring').find(
+            {'assessmentId': str(self.assessment_id)}))
+
+    def test_creates_a_part_per_spec_in_the_assessment(self):
+        parts = list(self.session.create_scaffold_down_assessment_parts(self.assessment_id, [
+            {'learning_objective_ids': [self.assessment.objective_ids[1]],
+             'item_bank_id': self.assessment.bank_id,
+             'max_levels': 2,
+             'allow_repeat_items': False},
+            {'learning_objective_ids': [self.assessment.objective_ids[2]],
+             'waypoint_quota': 2}
+        ]))
+        self.assertEqual([part._my_map['learningObjectiveIds'] for part in parts],
+                         [[str(self.assessment.objective_ids[1])], [str(self.assessment.objective_ids[2])]])
+        self.assertEqual(parts[0]._my_map['itemBankId'], str(self.assessment.bank_id))
+        self.assertEqual(parts[0]._my_map['maxLevels'], 2)
+        self.assertFalse(parts[0]._my_map['allowRepeatItems'])
+        self.assertEqual(parts[1]._my_map['waypointQuota'], 2)
+        self.assertEqual(sorted(part_map['_id'] for part_map in self.get_part_maps()),
+                         sorted(part._my_map['_id'] for part in parts))
+        # they went through create_assessment_part_for_assessment, so the
+        # assessment sequences them
+        assessment = self.bank.get_assessment(self.assessment_id)
+        self.assertEqual([str(child_id) for child_id in assessment.get_child_ids()],
+                         [str(part.ident) for part in parts])
+
+    def test_validates_every_spec_before_writing(self):
+        valid_spec = {'learning_objective_ids': [self.assessment.objective_ids[1]]}
+        for invalid_spec in [{'max_levels': 'three'}, {'objective_ids': []}]:
+            with self.assertRaises(InvalidArgument):
+                self.session.create_scaffold_down_assessment_parts(self.assessment_id, [valid_spec, invalid_spec])
+        self.assertEqual(self.get_part_maps(), [])
+
+
+class QueryPoolTests(SectionPartsTestCase):
+    def setUp(self):
+        super(QueryPoolTests, self).setUp()
+        self.pool = ThreadPool(2)
+        self.addCleanup(self.pool.terminate)
+        self.record_class = assessment_part_records.ScaffoldDownAssessmentPartRecord
+
+    def get_new_part(self, waypoint_index=1):
+        """a new waypoint part, that selects its item on its own"""
+        part_id = self.get_waypoint_part_ids(self.assessment.objective_ids[5], [waypoint_index])[0]
+        return self.session.get_assessment_part(part_id)
+
+    def test_selects_the_same_items_as_without_the_pool(self):
+        selections = []
+        for username in ['student-without-pool@mit.edu', 'student-with-pool@mit.edu']:
+            if selections:
+                self.set_class_attribute(self.record_class, 'query_pool', self.pool)
+            random.seed(0)
+            bank, section = self.start_taken(username)
+            self.answer_questions(bank, section, [False, False, False])
+            selections.append([question_map['itemId']
+                               for question_map in self.get_section_map(bank, section)['questions']])
+        self.assertEqual(len(selections[0]), 3)
+        self.assertEqual(selections[0], selections[1])
+
+    def test_looks_up_the_seen_items_on_the_pool(self):
+        self.set_class_attribute(self.record_class, 'query_pool', self.pool)
+        get_all_seen_item_ids = self.record_class._get_all_seen_item_ids.im_func
+        threads = []
+
+        def record_thread(record, *args):
+            threads.append(threading.current_thread())
+            return get_all_seen_item_ids(record, *args)
+        self.set_class_attribute(self.record_class, '_get_all_seen_item_ids', record_thread)
+        part = self.get_new_part()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        self.assertNotIn(part._my_map['itemIds'][0], self.section_item_ids)
+
+    def test_waits_for_the_seen_items_when_the_candidate_query_fails(self):
+        self.set_class_attribute(self.record_class, 'query_pool', self.pool)
+        finished = []
+
+        def get_all_seen_item_ids(record, *args):
+            time.sleep(0.1)
+            finished.append(True)
+            return set()
+
+        def get_candidate_item_ids(record, mgr, objective_ids):
+            raise OperationFailed('the query failed')
+        self.set_class_attribute(self.record_class, '_get_all_seen_item_ids', get_all_seen_item_ids)
+        self.set_class_attribute(self.record_class, '_get_candidate_item_ids', get_candidate_item_ids)
+        with self.assertRaises(OperationFailed):
+            self.get_new_part()
+        self.assertEqual(finished, [True])
+
+
+class UpdateSectionTests(SectionPartsTestCase):
+    def setUp(self):
+        super(UpdateSectionTests, self).setUp()
+        self.part = self.session.get_assessment_part(self.part_ids[0])
+        self.part.get_parts()
+        self.child_parts = self.part._child_parts
+        self.assertIsNotNone(self.child_parts)
+
+    def test_keeps_the_child_parts_of_an_unchanged_section(self):
+        section = self.bank.get_assessment_section(self.section.ident)
+        self.session.update_section(section)
+        self.assertIs(self.part._assessment_section, section)
+        self.assertIs(self.part._child_parts, self.child_parts)
+
+    def test_drops_the_child_parts_when_the_section_changed(self):
+        self.answer_questions(self.bank, self.section, [False])
+        section = self.bank.get_assessment_section(self.section.ident)
+        self.session.update_section(section)
+        self.assertIs(self.part._assessment_section, section)
+        self.assertIsNone(self.part._child_parts)
+
+    def test_ignores_its_own_section(self):
+        section = self.part._assessment_section
+        self.session.update_section(self.section)
+        self.assertIs(self.part._assessment_section, section)
+        self.assertIs(self.part._child_parts, self.child_parts)
@@ -0,0 +1,28 @@
+import unittest
+
+from ..multi_choice_questions.choice_order import get_seeded_choice_order
+
+
+class SeededChoiceOrderTests(unittest.TestCase):
+    def test_orders_are_permutations(self):
+        for num_choices in range(8):
+            order = get_seeded_choice_order(num_choices, 'taken-1', 'item-1')
+            self.assertEqual(sorted(order), range(num_choices))
+
+    def test_orders_are_stable(self):
+        self.assertEqual(get_seeded_choice_order(5, 'taken-1', 'item-1', salt='salt'),
+                         get_seeded_choice_order(5, u'taken-1', u'item-1', salt=u'salt'))
+        # other processes and versions have to come up with the same orders
+        self.assertEqual(get_seeded_choice_order(5, 'taken-1', 'item-1'), [4, 1, 3, 2, 0])
+        self.assertEqual(get_seeded_choice_order(5, 'taken-1', 'item-1', salt='salt'), [4, 1, 2, 0, 3])
+
+    def test_orders_depend_on_the_seed_item_and_salt(self):
+        orders = set(tuple(get_seeded_choice_order(6, seed, item_id, salt))
+                     for seed in ['taken-1', 'taken-2']
+                     for item_id in ['item-1', 'item-2']
+                     for salt in ['', 'salt'])
+        self.assertGreater(len(orders), 1)
+        orders = set(tuple(get_seeded_choice_order(6, 'taken-{0}'.format(index), 'item-1'))
+                     for index in range(50))
+        self.assertGreater(len(orders), 10)
+
@@ -0,0 +1,33 @@
+import subprocess
+import unittest
+
+from ..benchmarks.import_budget import BUDGETS, PACKAGE, get_forbidden_modules, get_loaded_modules
+
+
+class ImportedModulesTests(unittest.TestCase):
+    """the modules each adapter module loads at import, in a fresh interpreter"""
+    def get_loaded_modules(self, name):
+        preloaded = BUDGETS[name][0]
+        try:
+            return get_loaded_modules('{0}.{1}'.format(PACKAGE, name), preloaded)
+        except subprocess.CalledProcessError:
+            raise unittest.SkipTest('{0} is not importable from here'.format(PACKAGE))
+
+    def test_modules_load_no_forbidden_modules(self):
+        for name, (_, _, forbidden) in sorted(BUDGETS.items()):
+            self.assertEqual(get_forbidden_modules(self.get_loaded_modules(name), forbidden), [], name)
+
+    def test_record_modules_defer_their_opt_in_helpers(self):
+        loaded = self.get_loaded_modules('magic_parts.assessment_part_records')
+        self.assertIn(PACKAGE + '.magic_parts.section_cache', loaded)
+        for helper in ['seen_items', 'objective_item_index', 'item_prefetch']:
+            self.assertNotIn(PACKAGE + '.magic_parts.' + helper, loaded)
+
+        loaded = self.get_loaded_modules('multi_choice_questions.randomized_questions')
+        self.assertIn(PACKAGE + '.multi_choice_questions.magic_ids', loaded)
+        self.assertNotIn(PACKAGE + '.multi_choice_questions.choice_order', loaded)
+        self.assertNotIn(PACKAGE + '.magic_parts.objective_item_index', loaded)
+
+    def test_forbidden_modules_match_packages(self):
+        self.assertEqual(get_forbidden_modules(['bson.objectid', 'dlkit.json_x'], ['bson', 'dlkit.json_']),
+                         ['bson'])
@@ -0,0 +1,131 @@
+import unittest
+
+from importlib import import_module
+from multiprocessing.pool import ThreadPool
+
+from .fixtures import MagicSessionTestCase, assessment_part_records
+
+# the one the records stage their selections in
+item_prefetch = import_module(assessment_part_records.__name__.rpartition('.')[0] + '.item_prefetch')
+
+
+class FakeResult(object):
+    def __init__(self, value=None, ready=True, successful=True):
+        self.value = value
+        self._ready = ready
+        self._successful = successful
+
+    def ready(self):
+        return self._ready
+
+    def successful(self):
+        return self._successful
+
+    def get(self):
+        return self.value
+
+
+class FakePool(object):
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def apply_async(self, func, args):
+        self.calls.append((func, args))
+        return self.result
+
+
+class FakeSection(object):
+    def __init__(self, section_id):
+        self.section_id = section_id
+
+    def get_id(self):
+        return self.section_id
+
+
+class StagedSelectionTests(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(item_prefetch.staged_selections.clear)
+        self.section = FakeSection('section-1')
+
+    def stage(self, result, section=None, assessment_part_id='part-1'):
+        pool = FakePool(result)
+        item_prefetch.stage_item_selection(pool, section or self.section, assessment_part_id, len, 'args')
+        self.assertEqual(pool.calls, [(len, ('args',))])
+
+    def test_pops_a_finished_selection_once(self):
+        self.stage(FakeResult('selection'))
+        self.assertEqual(item_prefetch.pop_staged_item_selection(self.section, 'part-1'), 'selection')
+        self.assertIsNone(item_prefetch.pop_staged_item_selection(self.section, 'part-1'))
+
+    def test_drops_unfinished_and_failed_selections(self):
+        self.stage(FakeResult('selection', ready=False))
+        self.assertIsNone(item_prefetch.pop_staged_item_selection(self.section, 'part-1'))
+        self.assertEqual(len(item_prefetch.staged_selections), 0)
+        self.stage(FakeResult('selection', successful=False))
+        self.assertIsNone(item_prefetch.pop_staged_item_selection(self.section, 'part-1'))
+        self.assertEqual(len(item_prefetch.staged_selections), 0)
+
+    def test_keys_on_the_section_and_the_part(self):
+        self.stage(FakeResult('selection'))
+        self.assertIsNone(item_prefetch.pop_staged_item_selection(FakeSection('section-2'), 'part-1'))
+        self.assertIsNone(item_prefetch.pop_staged_item_selection(self.section, 'part-2'))
+        self.assertEqual(item_prefetch.pop_staged_item_selection(self.section, 'part-1'), 'selection')
+
+
+class PrefetchTests(MagicSessionTestCase):
+    def setUp(self):
+        super(PrefetchTests, self).setUp()
+        pool = ThreadPool(1)
+        self.addCleanup(pool.terminate)
+        self.set_class_attribute(assessment_part_records.ScaffoldDownAssessmentPartRecord, 'prefetch_pool', pool)
+        self.addCleanup(item_prefetch.staged_selections.clear)
+        item_prefetch.staged_selections.clear()
+
+    def start_taken(self, username='student@mit.edu'):
+        """the bank, the first section of a new taken with its first question
+        answered wrong, and the key of the selection prefetched for the child
+        part that the next question comes from"""
+        bank, section = super(PrefetchTests, self).start_taken(username)
+        self.answer_questions(bank, section, [False])
+        keys = item_prefetch.staged_selections.keys()
+        self.assertEqual(len(keys), 1)
+        return bank, section, keys[0]
+
+    def get_item_ids(self, bank, section):
+        return [question_map['itemId'] for question_map in self.get_section_map(bank, section)['questions']]
+
+    def test_wrong_answer_takes_the_prefetched_item(self):
+        bank, section, key = self.start_taken()
+        staged = item_prefetch.staged_selections.get(key)
+        staged.wait()
+        objective_ids, (item_ids, unseen) = staged.get()
+        self.assertEqual(len(item_ids), 1)
+
+        self.assertNotIn(str(item_ids[0]), self.get_item_ids(bank, section))
+        self.answer_questions(bank, section, [False])
+        self.assertNotIn(key, item_prefetch.staged_selections)
+        self.assertIn(str(item_ids[0]), self.get_item_ids(bank, section))
+
+    def test_ignores_a_selection_for_another_objective(self):
+        bank, section, key = self.start_taken()
+        other_item_id = str(self.assessment.item_ids[-1])
+        item_prefetch.staged_selections.set(key, FakeResult((['mc3-objective%3Aother%40MIT-OEIT'],
+                                                              ([other_item_id], True))))
+        self.answer_questions(bank, section, [False])
+        self.assertNotIn(key, item_prefetch.staged_selections)
+        item_ids = self.get_item_ids(bank, section)
+        self.assertEqual(len(item_ids), 2)
+        self.assertNotIn(other_item_id, item_ids)
+
+    def test_ignores_a_selection_of_an_item_in_the_section(self):
+        bank, section, key = self.start_taken()
+        staged = item_prefetch.staged_selections.get(key)
+        staged.wait()
+        objective_ids = staged.get()[0]
+        first_item_id = self.get_item_ids(bank, section)[0]
+        item_prefetch.staged_selections.set(key, FakeResult((objective_ids, ([first_item_id], True))))
+        self.answer_questions(bank, section, [False])
+        item_ids = self.get_item_ids(bank, section)
+        self.assertEqual(len(item_ids), 2)
+        self.assertEqual(item_ids.count(first_item_id), 1)
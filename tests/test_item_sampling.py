@@ -0,0 +1,29 @@
+import random
+import unittest
+
+from ..magic_parts.item_sampling import reservoir_sample
+
+
+class ReservoirSampleTests(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    def test_samples_the_only_value(self):
+        self.assertEqual(reservoir_sample(['a']), 'a')
+        self.assertEqual(reservoir_sample(['a', 'b', 'c'], exclude=set(['a', 'c'])), 'b')
+
+    def test_nothing_to_sample(self):
+        self.assertIsNone(reservoir_sample([]))
+        self.assertIsNone(reservoir_sample(['a', 'b'], exclude=set(['a', 'b'])))
+
+    def test_samples_in_one_pass(self):
+        values = iter(['a', 'b', 'c'])
+        self.assertIn(reservoir_sample(values), ['a', 'b', 'c'])
+        self.assertEqual(list(values), [])
+
+    def test_samples_uniformly(self):
+        counts = dict((value, 0) for value in 'abcde')
+        for _ in range(5000):
+            counts[reservoir_sample('abcdefg', exclude=set('fg'))] += 1
+        for count in counts.values():
+            self.assertTrue(800 < count < 1200, counts)
@@ -0,0 +1,140 @@
+import unittest
+
+from bson import ObjectId
+
+from dlkit.primordium.id.primitives import Id
+
+from ..magic_id_compaction import compact_assessment_sections, compact_magic_item_id, compact_magic_part_id,\
+    compact_section_map
+from ..magic_parts.magic_ids import get_legacy_magic_part_id, parse_magic_part_identifier
+from .test_magic_item_ids import ORIGINAL_CHOICE_IDS, ORIGINAL_IDENTIFIER, STORED_COMPACT_IDENTIFIER,\
+    STORED_LEGACY_IDENTIFIER, get_magic_item_id
+from .fixtures import MagicSessionTestCase
+from .test_magic_part_ids import CHILD_OBJECTIVE, GRANDCHILD_OBJECTIVE, get_legacy_ids
+
+PLAIN_PART_ID = 'assessment_authoring.AssessmentPart%3A57978959cdfc5c42eefb36d2%40ODL.MIT.EDU'
+PLAIN_ITEM_ID = 'assessment.Item%3A57978959cdfc5c42eefb36d2%40ODL.MIT.EDU'
+
+
+def get_section_map():
+    """a section with a question in a root, child and grandchild part, and
+    a child part no question is in"""
+    root_id, child_id, grandchild_id = get_legacy_ids()
+    orphan_id = get_legacy_magic_part_id(ORIGINAL_IDENTIFIER, 1, [GRANDCHILD_OBJECTIVE], 2, parent_id=root_id)
+    legacy_item_id = str(get_magic_item_id(STORED_LEGACY_IDENTIFIER))
+
+    def get_question_map(part_id, responses):
+        return {
+            'itemId': PLAIN_ITEM_ID,
+            'questionId': legacy_item_id,
+            'assessmentPartId': str(part_id),
+            'responses': responses
+        }
+
+    return {
+        '_id': 'section',
+        'questions': [get_question_map(root_id, [{'missingResponse': 'UNANSWERED'}]),
+                      get_question_map(child_id, [{'choiceIds': [ORIGINAL_CHOICE_IDS[0]]}]),
+                      get_question_map(grandchild_id, [None])],
+        'assessmentParts': [{'assessmentPartId': PLAIN_PART_ID, 'level': 0},
+                            {'assessmentPartId': str(root_id), 'level': 0},
+                            {'assessmentPartId': str(child_id), 'level': 1},
+                            {'assessmentPartId': str(orphan_id), 'level': 1},
+                            {'assessmentPartId': str(grandchild_id), 'level': 2}]
+    }
+
+
+class CompactSectionMapTests(unittest.TestCase):
+    def setUp(self):
+        self.original_choice_ids = {ORIGINAL_IDENTIFIER: ORIGINAL_CHOICE_IDS}
+
+    def test_compacts_the_ids(self):
+        section_map = get_section_map()
+        root_id, child_id, grandchild_id = get_legacy_ids()
+        orphan_id = section_map['assessmentParts'][3]['assessmentPartId']
+        questions, assessment_parts, rewritten_ids = compact_section_map(section_map, self.original_choice_ids)
+
+        compact_item_id = str(get_magic_item_id(STORED_COMPACT_IDENTIFIER))
+        self.assertEqual([question_map['questionId'] for question_map in questions], [compact_item_id] * 3)
+        self.assertEqual([question_map['itemId'] for question_map in questions], [PLAIN_ITEM_ID] * 3)
+        self.assertEqual([question_map['assessmentPartId'] for question_map in questions],
+                         [str(root_id), compact_magic_part_id(str(child_id)),
+                          compact_magic_part_id(str(grandchild_id))])
+        self.assertEqual([question_map['responses'] for question_map in questions],
+                         [question_map['responses'] for question_map in section_map['questions']])
+        self.assertEqual(rewritten_ids, {
+            section_map['questions'][0]['questionId']: compact_item_id,
+            str(child_id): compact_magic_part_id(str(child_id)),
+            str(grandchild_id): compact_magic_part_id(str(grandchild_id)),
+            # dropped, but its id is compacted all the same
+            orphan_id: compact_magic_part_id(orphan_id)
+        })
+
+    def test_drops_the_orphaned_parts(self):
+        section_map = get_section_map()
+        questions, assessment_parts, rewritten_ids = compact_section_map(section_map, self.original_choice_ids)
+        self.assertEqual([part_map['level'] for part_map in assessment_parts], [0, 0, 1, 2])
+        self.assertEqual(assessment_parts[0]['assessmentPartId'], PLAIN_PART_ID)
+        # the parts still nest the same way
+        part_ids = [part_map['assessmentPartId'] for part_map in assessment_parts]
+        for parent_id, part_id in zip(part_ids[1:], part_ids[2:]):
+            self.assertEqual(parse_magic_part_identifier(Id(part_id).get_identifier())[1]['parent_id'], parent_id)
+
+    def test_keeps_the_orphaned_parts_unless_dropping_them(self):
+        section_map = get_section_map()
+        assessment_parts = compact_section_map(section_map, self.original_choice_ids, drop_orphaned_parts=False)[1]
+        self.assertEqual([part_map['assessmentPartId'] for part_map in assessment_parts],
+                         [compact_magic_part_id(part_map['assessmentPartId'])
+                          for part_map in section_map['assessmentParts']])
+
+    def test_leaves_the_section_map_alone(self):
+        section_map = get_section_map()
+        compact_section_map(section_map, self.original_choice_ids)
+        self.assertEqual(section_map, get_section_map())
+
+    def test_compacting_again_changes_nothing(self):
+        section_map = get_section_map()
+        questions, assessment_parts, rewritten_ids = compact_section_map(section_map, self.original_choice_ids)
+        compacted_map = dict(section_map, questions=questions, assessmentParts=assessment_parts)
+        self.assertEqual(compact_section_map(compacted_map, self.original_choice_ids),
+                         (questions, assessment_parts, {}))
+
+    def test_rewrites_both_item_ids_or_neither(self):
+        section_map = get_section_map()
+        legacy_item_id = section_map['questions'][0]['questionId']
+        other_item_id = str(get_magic_item_id(STORED_LEGACY_IDENTIFIER.replace(ORIGINAL_IDENTIFIER,
+                                                                               '57978959cdfc5c42eefb36d9')))
+        section_map['questions'][0]['itemId'] = other_item_id
+        section_map['questions'][1]['itemId'] = legacy_item_id
+        # the choices of the other item are unknown, so its id stays legacy
+        questions = compact_section_map(section_map, self.original_choice_ids)[0]
+        self.assertEqual((questions[0]['itemId'], questions[0]['questionId']), (other_item_id, legacy_item_id))
+        compact_item_id = compact_magic_item_id(legacy_item_id, ORIGINAL_CHOICE_IDS)
+        self.assertEqual((questions[1]['itemId'], questions[1]['questionId']), (compact_item_id, compact_item_id))
+
+
+class CompactAssessmentSectionsTests(MagicSessionTestCase):
+    def insert_section(self, completion_time):
+        """the _id of a section like get_section_map's, in a taken finished at completion_time"""
+        taken_id = ObjectId()
+        self.get_collection('AssessmentTaken').insert_one({'_id': taken_id, 'completionTime': completion_time})
+        section_map = get_section_map()
+        section_map['_id'] = ObjectId()
+        section_map['assessmentTakenId'] = str(Id(namespace='assessment.AssessmentTaken',
+                                                  identifier=str(taken_id),
+                                                  authority='ODL.MIT.EDU'))
+        self.get_collection('AssessmentSection').insert_one(section_map)
+        return section_map['_id']
+
+    def get_part_levels(self, section_id):
+        section_map = self.get_collection('AssessmentSection').find_one({'_id': section_id})
+        return [part_map['level'] for part_map in section_map['assessmentParts']]
+
+    def test_drops_orphaned_parts_of_finished_takens_only(self):
+        in_progress_section_id = self.insert_section(None)
+        finished_section_id = self.insert_section('2017-01-01T00:00:00')
+        report = compact_assessment_sections(self.runtime, verify=False, job_name='orphans', restart=True)
+        # the orphan in the section still being taken may get its question yet
+        self.assertEqual(self.get_part_levels(in_progress_section_id), [0, 0, 1, 1, 2])
+        self.assertEqual(self.get_part_levels(finished_section_id), [0, 0, 1, 2])
+        self.assertEqual(report['orphaned_parts_dropped'], 1)
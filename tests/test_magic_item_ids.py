@@ -0,0 +1,91 @@
+import json
+import unittest
+
+from urllib import quote
+
+from dlkit.primordium.id.primitives import Id
+
+from ..magic_id_compaction import compact_magic_item_id
+from ..multi_choice_questions.magic_ids import CompactChoiceOrder, decode_choice_order, encode_choice_order,\
+    get_magic_item_identifier, parse_magic_item_identifier
+
+ORIGINAL_IDENTIFIER = '57978959cdfc5c42eefb36d2'
+ORIGINAL_CHOICE_IDS = ['57978959cdfc5c42eefb36d0', '57978959cdfc5c42eefb36d1', '57978959cdfc5c42eefb36d3']
+CHOICE_IDS = ['57978959cdfc5c42eefb36d1', '57978959cdfc5c42eefb36d0', '57978959cdfc5c42eefb36d3']
+
+# as stored in existing sections
+STORED_LEGACY_IDENTIFIER = ('57978959cdfc5c42eefb36d2%3F%5B%2257978959cdfc5c42eefb36d1%22%2C%20%2257978959cdfc5c42'
+                            'eefb36d0%22%2C%20%2257978959cdfc5c42eefb36d3%22%5D')
+STORED_COMPACT_IDENTIFIER = '57978959cdfc5c42eefb36d2%3Fp1.877c40.102'
+
+
+def get_magic_item_id(identifier):
+    return Id(namespace='assessment.Item',
+              identifier=identifier,
+              authority='magic-randomize-choices-question-record')
+
+
+class MagicItemIdTests(unittest.TestCase):
+    def test_stored_legacy_id_decodes(self):
+        original_identifier, choice_order = parse_magic_item_identifier(STORED_LEGACY_IDENTIFIER)
+        self.assertEqual(original_identifier, ORIGINAL_IDENTIFIER)
+        self.assertEqual(choice_order, CHOICE_IDS)
+        self.assertNotIsInstance(choice_order, CompactChoiceOrder)
+
+    def test_stored_compact_id_decodes(self):
+        original_identifier, choice_order = parse_magic_item_identifier(STORED_COMPACT_IDENTIFIER)
+        self.assertEqual(original_identifier, ORIGINAL_IDENTIFIER)
+        self.assertIsInstance(choice_order, CompactChoiceOrder)
+        self.assertEqual(choice_order, [1, 0, 2])
+        self.assertTrue(choice_order.matches(ORIGINAL_CHOICE_IDS))
+
+    def test_compact_ids_round_trip(self):
+        identifier = get_magic_item_identifier(ORIGINAL_IDENTIFIER, CHOICE_IDS, ORIGINAL_CHOICE_IDS)
+        self.assertEqual(identifier, STORED_COMPACT_IDENTIFIER)
+        choice_order = parse_magic_item_identifier(identifier)[1]
+        self.assertEqual([ORIGINAL_CHOICE_IDS[index] for index in choice_order], CHOICE_IDS)
+
+    def test_compact_orders_only_match_their_choices(self):
+        choice_order = parse_magic_item_identifier(STORED_COMPACT_IDENTIFIER)[1]
+        self.assertFalse(choice_order.matches(list(reversed(ORIGINAL_CHOICE_IDS))))
+        self.assertFalse(choice_order.matches(ORIGINAL_CHOICE_IDS[:2]))
+        self.assertFalse(choice_order.matches(ORIGINAL_CHOICE_IDS + ['57978959cdfc5c42eefb36d4']))
+
+    def test_many_choices_round_trip(self):
+        original_choice_ids = ['choice{0}'.format(index) for index in range(36)]
+        choice_ids = list(reversed(original_choice_ids))
+        choice_order = decode_choice_order(encode_choice_order(choice_ids, original_choice_ids))
+        self.assertIsInstance(choice_order, CompactChoiceOrder)
+        self.assertEqual([original_choice_ids[index] for index in choice_order], choice_ids)
+
+    def test_legacy_payload_when_compact_is_impossible(self):
+        # too many choices for one digit each
+        original_choice_ids = ['choice{0}'.format(index) for index in range(37)]
+        payload = encode_choice_order(original_choice_ids, original_choice_ids)
+        self.assertEqual(decode_choice_order(payload), original_choice_ids)
+        # a choice that isn't among the original ones
+        payload = encode_choice_order(CHOICE_IDS + ['other'], ORIGINAL_CHOICE_IDS)
+        self.assertEqual(decode_choice_order(payload), CHOICE_IDS + ['other'])
+
+    def test_legacy_ids_compact_to_the_same_order(self):
+        legacy_id = get_magic_item_id(STORED_LEGACY_IDENTIFIER)
+        compacted_id = compact_magic_item_id(str(legacy_id), ORIGINAL_CHOICE_IDS)
+        self.assertEqual(Id(compacted_id).get_identifier(), STORED_COMPACT_IDENTIFIER)
+        self.assertEqual(Id(compacted_id).get_authority(), legacy_id.get_authority())
+        self.assertEqual(Id(compacted_id).get_identifier_namespace(), legacy_id.get_identifier_namespace())
+
+    def test_compact_leaves_other_ids_alone(self):
+        compact_id = str(get_magic_item_id(STORED_COMPACT_IDENTIFIER))
+        self.assertEqual(compact_magic_item_id(compact_id, ORIGINAL_CHOICE_IDS), compact_id)
+        # unknown choices
+        legacy_id = str(get_magic_item_id(STORED_LEGACY_IDENTIFIER))
+        self.assertEqual(compact_magic_item_id(legacy_id, None), legacy_id)
+        plain_id = 'assessment.Item%3A57978959cdfc5c42eefb36d2%40ODL.MIT.EDU'
+        self.assertEqual(compact_magic_item_id(plain_id, ORIGINAL_CHOICE_IDS), plain_id)
+
+    def test_legacy_ids_with_changed_choices_stay_legacy(self):
+        identifier = quote('{0}?{1}'.format(ORIGINAL_IDENTIFIER, json.dumps(CHOICE_IDS + ['other'])))
+        legacy_id = str(get_magic_item_id(identifier))
+        compacted_id = compact_magic_item_id(legacy_id, ORIGINAL_CHOICE_IDS)
+        self.assertEqual(parse_magic_item_identifier(Id(compacted_id).get_identifier())[1],
+                         CHOICE_IDS + ['other'])
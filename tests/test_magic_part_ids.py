@@ -0,0 +1,99 @@
+import unittest
+
+from dlkit.primordium.id.primitives import Id
+
+from ..magic_id_compaction import compact_magic_part_id
+from ..magic_parts.magic_ids import MAGIC_PART_AUTHORITY, get_legacy_magic_part_id, get_magic_part_id,\
+    parse_magic_part_identifier
+
+ORIGINAL_IDENTIFIER = '57978959cdfc5c42eefb36d2'
+ROOT_OBJECTIVE = 'learning.Objective%3A5797895acdfc5c42eefb36e0%40MIT-OEIT'
+CHILD_OBJECTIVE = 'learning.Objective%3A5797895acdfc5c42eefb36e1%40MIT-OEIT'
+GRANDCHILD_OBJECTIVE = 'learning.Objective%3A5797895acdfc5c42eefb36e2%40MIT-OEIT'
+
+# as stored in existing sections
+STORED_ROOT_ID = (
+    'assessment_authoring.AssessmentPart%3A57978959cdfc5c42eefb36d2%25253F%25257B%252522waypoint_index%252522'
+    '%25253A%2525200%25252C%252520%252522objective_ids%252522%25253A%252520%25255B%252522learning.Objective'
+    '%2525253A5797895acdfc5c42eefb36e0%25252540MIT-OEIT%252522%25255D%25252C%252520%252522level%252522%25253A'
+    '%2525200%25257D%40magic-part-authority')
+
+
+def get_legacy_ids():
+    """a root, child and grandchild part, with legacy ids"""
+    root_id = get_legacy_magic_part_id(ORIGINAL_IDENTIFIER, 0, [ROOT_OBJECTIVE], 0)
+    child_id = get_legacy_magic_part_id(ORIGINAL_IDENTIFIER, 1, [CHILD_OBJECTIVE], 1, parent_id=root_id)
+    grandchild_id = get_legacy_magic_part_id(ORIGINAL_IDENTIFIER, 2, [GRANDCHILD_OBJECTIVE], 0,
+                                             parent_id=child_id)
+    return root_id, child_id, grandchild_id
+
+
+class MagicPartIdTests(unittest.TestCase):
+    def test_stored_root_id_decodes(self):
+        original_identifier, arg_map = parse_magic_part_identifier(Id(STORED_ROOT_ID).get_identifier())
+        self.assertEqual(original_identifier, ORIGINAL_IDENTIFIER)
+        self.assertEqual(arg_map, {
+            'level': 0,
+            'objective_ids': [ROOT_OBJECTIVE],
+            'waypoint_index': 0,
+            'parent_id': None,
+            'path': None
+        })
+
+    def test_root_ids_keep_their_form(self):
+        self.assertEqual(str(get_legacy_magic_part_id(ORIGINAL_IDENTIFIER, 0, [ROOT_OBJECTIVE], 0)),
+                         STORED_ROOT_ID)
+        self.assertEqual(str(get_magic_part_id(ORIGINAL_IDENTIFIER, [[0, [ROOT_OBJECTIVE]]])),
+                         STORED_ROOT_ID)
+
+    def test_legacy_child_ids_decode(self):
+        root_id, child_id, grandchild_id = get_legacy_ids()
+        self.assertEqual(child_id.get_authority(), MAGIC_PART_AUTHORITY)
+        original_identifier, arg_map = parse_magic_part_identifier(grandchild_id.get_identifier())
+        self.assertEqual(original_identifier, ORIGINAL_IDENTIFIER)
+        self.assertEqual(arg_map['level'], 2)
+        self.assertEqual(arg_map['objective_ids'], [GRANDCHILD_OBJECTIVE])
+        self.assertEqual(arg_map['waypoint_index'], 0)
+        self.assertEqual(arg_map['parent_id'], str(child_id))
+        self.assertIsNone(arg_map['path'])
+        self.assertEqual(parse_magic_part_identifier(child_id.get_identifier())[1]['parent_id'], str(root_id))
+
+    def test_path_ids_round_trip(self):
+        path = [[0, [ROOT_OBJECTIVE]], [1, [CHILD_OBJECTIVE]], [0, [GRANDCHILD_OBJECTIVE]]]
+        part_id = get_magic_part_id(ORIGINAL_IDENTIFIER, path)
+        original_identifier, arg_map = parse_magic_part_identifier(part_id.get_identifier())
+        self.assertEqual(original_identifier, ORIGINAL_IDENTIFIER)
+        self.assertEqual(arg_map['path'], path)
+        self.assertEqual(arg_map['level'], 2)
+        self.assertEqual(arg_map['objective_ids'], [GRANDCHILD_OBJECTIVE])
+        self.assertEqual(arg_map['waypoint_index'], 0)
+        self.assertEqual(arg_map['parent_id'], str(get_magic_part_id(ORIGINAL_IDENTIFIER, path[:2])))
+        # the parent of a level 1 part is the root, in its original form
+        self.assertEqual(parse_magic_part_identifier(Id(arg_map['parent_id']).get_identifier())[1]['parent_id'],
+                         STORED_ROOT_ID)
+
+    def test_legacy_ids_compact_to_path_ids(self):
+        root_id, child_id, grandchild_id = get_legacy_ids()
+        compacted_id = compact_magic_part_id(str(grandchild_id))
+        self.assertEqual(compacted_id, str(get_magic_part_id(
+            ORIGINAL_IDENTIFIER, [[0, [ROOT_OBJECTIVE]], [1, [CHILD_OBJECTIVE]], [0, [GRANDCHILD_OBJECTIVE]]])))
+        self.assertLess(len(compacted_id), len(str(grandchild_id)))
+
+        legacy_arg_map = parse_magic_part_identifier(grandchild_id.get_identifier())[1]
+        path_arg_map = parse_magic_part_identifier(Id(compacted_id).get_identifier())[1]
+        for key in ['level', 'objective_ids', 'waypoint_index']:
+            self.assertEqual(path_arg_map[key], legacy_arg_map[key])
+        self.assertEqual(path_arg_map['parent_id'], compact_magic_part_id(legacy_arg_map['parent_id']))
+
+    def test_compact_leaves_other_ids_alone(self):
+        root_id, child_id, grandchild_id = get_legacy_ids()
+        path_id = compact_magic_part_id(str(child_id))
+        self.assertEqual(compact_magic_part_id(path_id), path_id)
+        self.assertEqual(compact_magic_part_id(str(root_id)), str(root_id))
+        plain_id = 'assessment_authoring.AssessmentPart%3A57978959cdfc5c42eefb36d2%40ODL.MIT.EDU'
+        self.assertEqual(compact_magic_part_id(plain_id), plain_id)
+
+    def test_legacy_ids_with_a_foreign_parent_stay_legacy(self):
+        root_id = get_legacy_magic_part_id('57978959cdfc5c42eefb36d9', 0, [ROOT_OBJECTIVE], 0)
+        child_id = get_legacy_magic_part_id(ORIGINAL_IDENTIFIER, 1, [CHILD_OBJECTIVE], 0, parent_id=root_id)
+        self.assertEqual(compact_magic_part_id(str(child_id)), str(child_id))
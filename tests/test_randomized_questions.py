@@ -0,0 +1,157 @@
+from copy import deepcopy
+from random import Random
+
+from dlkit.abstract_osid.osid.errors import NotFound
+from dlkit.json_.utilities import JSONClientValidated
+from dlkit.primordium.id.primitives import Id
+
+from ..benchmarks.fixtures import get_assessment_manager
+from ..multi_choice_questions.magic_ids import get_magic_item_identifier
+from .fixtures import MagicSessionTestCase, randomized_questions
+
+
+class GetItemsByIdsTests(MagicSessionTestCase):
+    def test_gets_a_batch_in_two_queries(self):
+        random = Random(0)
+        item_ids = self.assessment.item_ids[:10]
+        magic_item_ids = [self.get_magic_item_id(item_id, random) for item_id in item_ids]
+        session = self.get_item_lookup_session()
+        self.queries.reset()
+        items = list(session.get_items_by_ids(magic_item_ids + item_ids[:2]))
+        # one for the aliases, one for the items, whatever the size of the batch
+        self.assertEqual(self.queries.count('assessmentIds'), 1)
+        self.assertEqual(self.queries.count('Item'), 1)
+        self.assertEqual([str(item.ident) for item in items],
+                         [str(item_id) for item_id in item_ids + item_ids[:2]])
+
+    def test_resolves_aliases(self):
+        item_id = self.assessment.item_ids[0]
+        alias_id = Id(namespace=item_id.namespace, identifier='alias-of-the-first-item', authority='ODL.MIT.EDU')
+        collection = JSONClientValidated('id', collection='assessmentIds', runtime=self.runtime)
+        collection.insert_one({'_id': str(item_id), 'aliasIds': [str(alias_id)]})
+        self.addCleanup(collection.delete_one, {'_id': str(item_id)})
+        items = list(self.get_item_lookup_session().get_items_by_ids([alias_id, item_id]))
+        self.assertEqual([str(item.ident) for item in items], [str(item_id), str(item_id)])
+
+    def test_raises_not_found(self):
+        missing_item_id = Id(namespace='assessment.Item', identifier='0' * 24, authority='ODL.MIT.EDU')
+        with self.assertRaises(NotFound):
+            self.get_item_lookup_session().get_items_by_ids([self.assessment.item_ids[0], missing_item_id])
+
+
+class CopyOnWriteItemTests(MagicSessionTestCase):
+    def setUp(self):
+        super(CopyOnWriteItemTests, self).setUp()
+        self.session = self.get_item_lookup_session()
+        self.item_id = self.get_magic_item_id(self.assessment.item_ids[0], Random(0))
+
+    def test_items_share_the_cached_map(self):
+        item = self.session.get_item(self.item_id)
+        self.assertIs(self.session.get_item(self.item_id)._my_map, item._my_map)
+        self.assertIs(list(self.session.get_items_by_ids([self.item_id]))[0]._my_map, item._my_map)
+
+    def test_reading_the_question_leaves_the_map_alone(self):
+        item = self.session.get_item(self.item_id)
+        question_map = deepcopy(item._my_map['question'])
+        question = item.get_question()
+        question.get_choices()
+        question.set_display_label('1.1')
+        question.get_object_map()
+        self.assertEqual(self.session.get_item(self.item_id)._my_map['question'], question_map)
+
+    def test_object_map_copies_the_map(self):
+        item = self.session.get_item(self.item_id)
+        shared_map = item._my_map
+        item.get_object_map()
+        self.assertIsNot(item._my_map, shared_map)
+        self.assertIs(self.session.get_item(self.item_id)._my_map, shared_map)
+
+
+class MagicItemQuestionTests(MagicSessionTestCase):
+    def setUp(self):
+        super(MagicItemQuestionTests, self).setUp()
+        self.item_id = self.assessment.item_ids[0]
+        self.magic_item_id = self.get_magic_item_id(self.item_id, Random(0))
+        self.item = self.get_item_lookup_session().get_item(self.magic_item_id)
+
+    def test_builds_the_question_once(self):
+        question = self.item.get_question()
+        self.assertIs(self.item.question, question)
+        self.assertEqual(str(question.ident), str(self.magic_item_id))
+
+    def test_new_params_drop_the_question(self):
+        question = self.item.get_question()
+        choice_ids = list(reversed(self.assessment.choice_ids[self.item_id.identifier]))
+        self.item.set_params(choice_ids)
+        self.assertIsNot(self.item.get_question(), question)
+        self.assertEqual([choice['id'] for choice in self.item.get_question()._my_map['choices']], choice_ids)
+
+    def test_a_choice_seed_drops_the_question(self):
+        question = self.item.get_question()
+        self.item.set_choice_seed('student@mit.edu')
+        self.assertIsNot(self.item.get_question(), question)
+
+
+class SharedItemCacheTests(MagicSessionTestCase):
+    def setUp(self):
+        super(SharedItemCacheTests, self).setUp()
+        self.cache = randomized_questions.get_shared_item_cache()
+        self.set_class_attribute(randomized_questions.RandomizedMCItemLookupSession, 'shared_item_cache', self.cache)
+        self.item_id = self.assessment.item_ids[0]
+        self.magic_item_id = self.get_magic_item_id(self.item_id, Random(0))
+
+    def test_sessions_read_an_item_once(self):
+        item = self.get_item_lookup_session().get_item(self.magic_item_id)
+        self.assertEqual(self.queries.count('Item'), 1)
+        self.queries.reset()
+        other_magic_item_id = self.get_magic_item_id(self.item_id, Random(1))
+        session = self.get_item_lookup_session()
+        self.assertEqual(str(session.get_item(self.magic_item_id).ident), str(item.ident))
+        self.assertEqual(len(list(session.get_items_by_ids([other_magic_item_id]))), 1)
+        self.assertEqual(self.queries.count('Item'), 0)
+
+    def test_applies_the_choice_order_to_the_cached_item(self):
+        self.get_item_lookup_session().get_item(self.magic_item_id)
+        choice_ids = list(reversed(self.assessment.choice_ids[self.item_id.identifier]))
+        magic_item_id = Id(namespace=self.item_id.namespace,
+                           identifier=get_magic_item_identifier(self.item_id.identifier, choice_ids,
+                                                                self.assessment.choice_ids[self.item_id.identifier]),
+                           authority=randomized_questions.MAGIC_AUTHORITY)
+        question = self.get_item_lookup_session().get_item(magic_item_id).get_question()
+        self.assertEqual([choice['id'] for choice in question._my_map['choices']], choice_ids)
+
+    def test_admin_updates_evict_the_item(self):
+        self.get_item_lookup_session().get_item(self.magic_item_id)
+        self.get_item_lookup_session().get_item(self.get_magic_item_id(self.assessment.item_ids[1], Random(0)))
+        admin_session = randomized_questions.RandomizedMCItemAdminSession(catalog_id=self.assessment.bank_id,
+                                                                          runtime=self.runtime)
+        form = admin_session.get_item_form_for_update(self.item_id)
+        form.display_name = 'edited item'
+        admin_session.update_item(form)
+        self.queries.reset()
+
+        session = self.get_item_lookup_session()
+        self.assertEqual(session.get_item(self.magic_item_id).display_name.text, 'edited item')
+        self.assertEqual(self.queries.count('Item'), 1)
+        # the other items stay cached
+        session.get_item(self.get_magic_item_id(self.assessment.item_ids[1], Random(1)))
+        self.assertEqual(self.queries.count('Item'), 1)
+
+    def test_invalidating_every_item(self):
+        self.get_item_lookup_session().get_item(self.magic_item_id)
+        self.cache.invalidate()
+        self.queries.reset()
+        self.get_item_lookup_session().get_item(self.magic_item_id)
+        self.assertEqual(self.queries.count('Item'), 1)
+
+    def test_entries_are_per_catalog(self):
+        self.get_item_lookup_session().get_item(self.magic_item_id)
+        manager = get_assessment_manager('author@mit.edu')
+        form = manager.get_bank_form_for_create([])
+        form.display_name = 'another bank'
+        other_bank = manager.create_bank(form)
+        session = randomized_questions.RandomizedMCItemLookupSession(catalog_id=other_bank.ident,
+                                                                     runtime=self.runtime)
+        session.use_federated_bank_view()
+        with self.assertRaises(NotFound):
+            session.get_item(self.magic_item_id)
@@ -0,0 +1,151 @@
+import unittest
+
+from bson import ObjectId
+
+from dlkit.json_.assessment.objects import ASSESSMENT_AUTHORITY
+from dlkit.primordium.id.primitives import Id
+
+from ..magic_parts.magic_ids import get_magic_part_id
+from ..magic_parts.section_cache import ScaffoldEvaluationContext, get_child_part_index, get_question_index
+
+ORIGINAL_IDENTIFIER = '57978959cdfc5c42eefb36d2'
+
+
+class FakeQuestion(object):
+    def __init__(self, question_map):
+        self._question_map = question_map
+
+    def get_id(self):
+        return Id(self._question_map['itemId'])
+
+
+class FakeSection(object):
+    """just the maps of a section, and how it reports its questions"""
+    def __init__(self, assessment_parts=None, questions=None):
+        self._my_map = {
+            'assessmentParts': assessment_parts or [],
+            'questions': questions or []
+        }
+
+    def get_question(self, question_map):
+        return FakeQuestion(question_map)
+
+
+def get_part_id(*path):
+    return str(get_magic_part_id(ORIGINAL_IDENTIFIER, [[waypoint_index, ['objective']] for waypoint_index in path]))
+
+
+def get_question_map(part_id, item_number):
+    item_id = 'assessment.Item%3A{0}%40ODL.MIT.EDU'.format(item_number)
+    return {
+        '_id': ObjectId(),
+        'assessmentPartId': part_id,
+        'itemId': item_id,
+        'questionId': item_id,
+        'responses': [{'missingResponse': 'UNANSWERED'}]
+    }
+
+
+def get_section_question_id(question_map):
+    """the id the section hands out for the question"""
+    return Id(namespace='assessment.Item',
+              identifier=str(question_map['_id']),
+              authority=ASSESSMENT_AUTHORITY)
+
+
+class QuestionIndexTests(unittest.TestCase):
+    def test_finds_the_first_question_of_a_part(self):
+        section = FakeSection(questions=[get_question_map('part-1', 1),
+                                         get_question_map('part-1', 2),
+                                         get_question_map('part-2', 3)])
+        index = get_question_index(section)
+        self.assertEqual(index.get_item_id(section, 'part-1'), Id(get_question_map('part-1', 1)['itemId']))
+        self.assertEqual(index.get_question_map('part-2')['itemId'], get_question_map('part-2', 3)['itemId'])
+        self.assertIsNone(index.get_question_map('part-3'))
+        self.assertIsNone(index.get_item_id(section, 'part-3'))
+
+    def test_picks_up_appended_questions(self):
+        section = FakeSection(questions=[get_question_map('part-1', 1)])
+        index = get_question_index(section)
+        section._my_map['questions'].append(get_question_map('part-2', 2))
+        self.assertIs(get_question_index(section), index)
+        self.assertEqual(index.get_item_id(section, 'part-2'), Id(get_question_map('part-2', 2)['itemId']))
+
+    def test_picks_up_questions_inserted_mid_list(self):
+        section = FakeSection(questions=[get_question_map('part-1', 1),
+                                         get_question_map('part-3', 3),
+                                         get_question_map('part-4', 4)])
+        get_question_index(section).get_item_id(section, 'part-4')
+        # as dlkit inserts the question of a new child part after its parent's
+        section._my_map['questions'].insert(1, get_question_map('part-2', 2))
+        index = get_question_index(section)
+        for part_number in range(1, 5):
+            part_id = 'part-{0}'.format(part_number)
+            self.assertEqual(index.get_item_id(section, part_id), Id(get_question_map(part_id, part_number)['itemId']))
+
+    def test_rebuilds_for_a_new_list(self):
+        section = FakeSection(questions=[get_question_map('part-1', 1)])
+        get_question_index(section)
+        section._my_map['questions'] = [get_question_map('part-1', 2)]
+        self.assertEqual(get_question_index(section).get_item_id(section, 'part-1'),
+                         Id(get_question_map('part-1', 2)['itemId']))
+
+    def test_finds_questions_by_id(self):
+        section = FakeSection(questions=[get_question_map('part-1', 1), get_question_map('part-2', 2)])
+        index = get_question_index(section)
+        question_map = section._my_map['questions'][1]
+        self.assertIs(index.find_question_map(get_section_question_id(question_map)), question_map)
+        self.assertIs(index.find_question_map(Id(question_map['questionId'])), question_map)
+        self.assertIsNone(index.find_question_map(Id('assessment.Item%3A3%40ODL.MIT.EDU')))
+
+
+class AnsweringSection(FakeSection):
+    """answers from the latest response, counting the evaluations"""
+    num_evaluations = 0
+
+    def is_correct(self, question_id):
+        self.num_evaluations += 1
+        question_map = get_question_index(self).find_question_map(question_id)
+        return question_map['responses'][0].get('isCorrect', False)
+
+
+class ScaffoldEvaluationContextTests(unittest.TestCase):
+    def test_evaluates_each_response_once(self):
+        section = AnsweringSection(questions=[get_question_map('part-1', 1), get_question_map('part-2', 2)])
+        question_id = get_section_question_id(section._my_map['questions'][1])
+        context = ScaffoldEvaluationContext(section)
+        self.assertFalse(context.is_correct(question_id))
+        self.assertFalse(context.is_correct(question_id))
+        self.assertEqual(section.num_evaluations, 1)
+
+        # a new question before it, and a new response to it
+        section._my_map['questions'].insert(1, get_question_map('part-3', 3))
+        section._my_map['questions'][2]['responses'].insert(0, {'isCorrect': True})
+        self.assertTrue(context.is_correct(question_id))
+        self.assertTrue(context.is_correct(question_id))
+        self.assertEqual(section.num_evaluations, 2)
+
+
+class ChildPartIndexTests(unittest.TestCase):
+    def test_finds_the_child_parts(self):
+        section = FakeSection(assessment_parts=[{'assessmentPartId': get_part_id(0)},
+                                                {'assessmentPartId': get_part_id(0, 0)},
+                                                {'assessmentPartId': get_part_id(0, 1)}])
+        index = get_child_part_index(section)
+        self.assertEqual(index.get_child_part_id(get_part_id(0), 1, ['objective']), get_part_id(0, 1))
+        self.assertIsNone(index.get_child_part_id(get_part_id(0), 2, ['objective']))
+        self.assertIsNone(index.get_child_part_id(get_part_id(0), 0, ['other objective']))
+
+    def test_picks_up_parts_inserted_mid_list(self):
+        section = FakeSection(assessment_parts=[{'assessmentPartId': get_part_id(0)},
+                                                {'assessmentPartId': get_part_id(0, 0)},
+                                                {'assessmentPartId': get_part_id(0, 1)}])
+        get_child_part_index(section)
+        # as dlkit inserts a new grandchild part after its parent
+        section._my_map['assessmentParts'].insert(2, {'assessmentPartId': get_part_id(0, 0, 0)})
+        index = get_child_part_index(section)
+        self.assertEqual(index.get_child_part_id(get_part_id(0, 0), 0, ['objective']), get_part_id(0, 0, 0))
+        self.assertEqual(index.get_child_part_id(get_part_id(0), 1, ['objective']), get_part_id(0, 1))
+        section._my_map['assessmentParts'].append({'assessmentPartId': get_part_id(0, 2)})
+        self.assertIs(get_child_part_index(section), index)
+        self.assertEqual(index.get_child_part_id(get_part_id(0), 2, ['objective']), get_part_id(0, 2))
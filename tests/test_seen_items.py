@@ -0,0 +1,48 @@
+from dlkit.primordium.id.primitives import Id
+
+from .fixtures import MagicSessionTestCase, assessment_part_records
+
+
+class SeenItemsIndexTests(MagicSessionTestCase):
+    def setUp(self):
+        super(SeenItemsIndexTests, self).setUp()
+        self.set_class_attribute(assessment_part_records.ScaffoldDownAssessmentPartRecord,
+                                 'use_seen_items_index', True)
+
+    def get_section_item_ids(self, section):
+        """the items of the questions in all the sections of the section's agent"""
+        taken_ids = set(str(taken_map['_id']) for taken_map in self.get_collection('AssessmentTaken').find(
+            {'takingAgentId': str(section._assessment_taken.taking_agent_id)}))
+        return set(question_map['itemId']
+                   for section_map in self.get_collection('AssessmentSection').find()
+                   if Id(section_map['assessmentTakenId']).identifier in taken_ids
+                   for question_map in section_map.get('questions', []))
+
+    def get_indexed_item_ids(self, section):
+        agent_map = self.get_collection('SeenItems').find_one({'_id': str(section._assessment_taken.taking_agent_id)})
+        return set(agent_map['itemIds'])
+
+    def test_indexes_the_questions_of_the_sections(self):
+        username = 'indexed-student@mit.edu'
+        root_item_ids = []
+        for _ in range(2):
+            bank, section = self.start_taken(username)
+            # wrong twice, to scaffold down
+            questions = self.answer_questions(bank, section, [False, False, True, True])
+            root_item_ids.append(questions[0]._my_map['itemId'])
+            # the index only has the items of the questions in the sections,
+            # not the ones that parts picked but never made it
+            self.assertEqual(self.get_indexed_item_ids(section), self.get_section_item_ids(section))
+        # the other item of the root objective
+        self.assertNotEqual(root_item_ids[0], root_item_ids[1])
+
+    def test_item_selection_looks_up_the_index_only(self):
+        username = 'looked-up-student@mit.edu'
+        bank, section = self.start_taken(username)
+        self.answer_questions(bank, section, [True])
+        bank, section = self.start_taken(username)
+        self.queries.reset()
+        self.answer_questions(bank, section, [False])
+        self.assertEqual(self.queries.count('SeenItems', 'find_one'), 1)
+        self.assertEqual(self.queries.count('AssessmentSection', 'aggregate'), 0)
+        self.assertEqual(self.queries.count('AssessmentTaken', 'find'), 0)
@@ -0,0 +1,88 @@
+import unittest
+
+from .. import utilities
+from ..utilities import LRUCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class LRUCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self._time = utilities.time
+        utilities.time = self.clock
+
+    def tearDown(self):
+        utilities.time = self._time
+
+    def test_set_get_and_pop(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIn('a', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 2), 2)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.pop('a', 3), 3)
+
+    def test_evicts_the_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_keys_least_recently_used_first(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        self.assertEqual(cache.keys(), ['b', 'a'])
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=10)
+        cache.set('a', 1)
+        self.clock.now += 10
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.now += 1
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_evicts_past_max_bytes(self):
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        cache.set('c', 'xxxx')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'xxxx')
+        # replacing a value counts only its new size
+        cache.set('c', 'xx')
+        cache.set('d', 'xxxx')
+        self.assertEqual(cache.get('b'), 'xxxx')
+        self.assertEqual(cache.get('c'), 'xx')
+
+    def test_does_not_keep_values_too_big_to_cache(self):
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache.set('a', 'x')
+        cache.set('a', 'x' * 11)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_clear(self):
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache.set('a', 'xxxx')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.set('b', 'x' * 10)
+        self.assertEqual(cache.get('b'), 'x' * 10)
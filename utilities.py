@@ -0,0 +1,89 @@
+"""
+Utilities shared by the adapter records and sessions
+"""
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """thread-safe, process-wide cache with LRU eviction
+
+    max_entries -- evict the least recently used entries past this many
+    ttl -- seconds an entry stays valid, or None to keep it until evicted
+    max_bytes -- evict the least recently used entries past this total size,
+        as measured by sizeof(value)
+
+    """
+    def __init__(self, max_entries=1000, ttl=None, max_bytes=None, sizeof=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """returns the cached value, or default on a miss"""
+        with self._lock:
+            try:
+                value, expires, num_bytes = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                self._num_bytes -= num_bytes
+                return default
+            self._entries[key] = (value, expires, num_bytes)
+            return value
+
+    def set(self, key, value):
+        if self._sizeof is not None:
+            num_bytes = self._sizeof(value)
+        else:
+            num_bytes = 0
+        if self._max_bytes is not None and num_bytes > self._max_bytes:
+            # too big to cache, but don't leave an older value behind
+            self.pop(key)
+            return
+        if self._ttl is not None:
+            expires = time.time() + self._ttl
+        else:
+            expires = None
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, expires, num_bytes)
+            self._num_bytes += num_bytes
+            while (len(self._entries) > self._max_entries or
+                   (self._max_bytes is not None and self._num_bytes > self._max_bytes)):
+                self._pop(next(iter(self._entries)))
+
+    def keys(self):
+        """the keys of the entries, least recently used first, expired or not"""
+        with self._lock:
+            return list(self._entries)
+
+    def pop(self, key, default=None):
+        """removes and returns the cached value, or default if there is none"""
+        with self._lock:
+            return self._pop(key, default)
+
+    def _pop(self, key, default=None):
+        try:
+            value, expires, num_bytes = self._entries.pop(key)
+        except KeyError:
+            return default
+        self._num_bytes -= num_bytes
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0